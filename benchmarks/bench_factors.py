@@ -0,0 +1,259 @@
+"""
+因子计算的基准测试。
+
+在合成的 OHLCV 面板（标的数 × 日期数可配置，固定随机种子，不联网）上计时：
+    op/<后端>/<算子>            expr_functions 里的每个算子，单独调用一次
+    alpha158/<后端>             Alpha158().get_fields_names() 整套因子一起算
+    wq101/<后端>/<因子名>       WorldQuant101 的每个因子单独算（用到未定义算子的因子记下报错）
+    wq101/<后端>                WorldQuant101 中能算的因子整套一起算
+
+每项记录最快一次的耗时、吞吐（行/秒，整套因子为 格子/秒）和 tracemalloc 统计的峰值内存，写成 JSON；
+--compare 读入之前的 JSON 逐项对比，慢于阈值的项目列为退化，此时退出码为 1。
+
+    python benchmarks/bench_factors.py --symbols 300 --dates 1000 --out bench.json
+    python benchmarks/bench_factors.py --symbols 300 --dates 1000 --compare bench.json
+"""
+import argparse
+import io
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import nullcontext, redirect_stdout
+from datetime import datetime
+from inspect import signature
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from kkexpr import dtypes, expr_functions  # noqa: E402
+from kkexpr.expr import calc_exprs, compile_expr  # noqa: E402
+from kkexpr.factor.alpha158 import Alpha158  # noqa: E402
+from kkexpr.factor.alpha_worldquant101 import WorldQuant101  # noqa: E402
+
+_OPERATOR_MODULES = ['expr_unary', 'expr_binary', 'expr_unary_rolling', 'expr_binary_rolling',
+                     'expr_not_use_in_ga']
+_WINDOW_PARAMS = {'d', 'n', 'N', 'window', 'periods'}
+_SERIES_ARGS = ('close', 'volume')
+_WINDOW = 10
+
+
+def make_panel(n_symbols=300, n_dates=1000, seed=0, missing=0.0) -> pd.DataFrame:
+    """
+    合成行情：(date, symbol) 双层索引、按日期排序的长表，列为 open、high、low、close、volume，
+    以及 WorldQuant101 直接引用的 vwap、returns、adv20。
+    missing > 0 时随机去掉这一比例的行，模拟停牌和上市前后的空缺。
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2010-01-04', periods=n_dates, freq='B')
+    symbols = ['{:06d}.SZ'.format(i) for i in range(n_symbols)]
+    shape = (n_dates, n_symbols)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, shape), axis=0))
+    open_ = close * np.exp(rng.normal(0, 0.01, shape))
+    spread = np.abs(rng.normal(0, 0.01, shape))
+    high = np.maximum(open_, close) * (1 + spread)
+    low = np.minimum(open_, close) * (1 - spread)
+    volume = rng.lognormal(13, 0.5, shape).round()
+    vwap = (open_ + high + low + close) / 4
+
+    returns = np.full(shape, np.nan)
+    returns[1:] = close[1:] / close[:-1] - 1
+    cum_volume = np.cumsum(volume, axis=0)
+    adv20 = np.full(shape, np.nan)
+    adv20[19:] = (cum_volume[19:] - np.vstack([np.zeros((1, n_symbols)), cum_volume[:-20]])) / 20
+
+    index = pd.MultiIndex.from_product([dates, symbols], names=['date', 'symbol'])
+    columns = dict(open=open_, high=high, low=low, close=close, volume=volume, vwap=vwap,
+                   returns=returns, adv20=adv20)
+    df = pd.DataFrame({k: v.ravel() for k, v in columns.items()}, index=index)
+    if missing:
+        df = df[rng.random(len(df)) >= missing]
+    return df
+
+
+def operator_exprs():
+    """expr_functions 里每个算子的一条调用：前面的序列参数依次用 close、volume，窗口参数取 10。"""
+    exprs = {}
+    for module in _OPERATOR_MODULES:
+        mod = getattr(expr_functions, module)
+        for name in expr_functions.list_funcs(mod):
+            params = list(signature(getattr(mod, name)).parameters.values())
+            args = []
+            for param in params:
+                if param.name in _WINDOW_PARAMS:
+                    args.append(str(_WINDOW))
+                    break
+                if param.default is not param.empty or len(args) == len(_SERIES_ARGS):
+                    break
+                args.append(_SERIES_ARGS[len(args)])
+            exprs[name] = '{}({})'.format(name, ', '.join(args))
+    return exprs
+
+
+def _measure(func, repeat):
+    """先预热一次（numba 编译、报错都在这里暴露），再取 repeat 次中最快的耗时，最后单独跑一次量峰值内存。"""
+    with redirect_stdout(io.StringIO()):  # 个别算子带调试输出
+        func()
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            seconds.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return min(seconds), peak
+
+
+def _record(results, key, func, repeat, rows, cells=None, **info):
+    try:
+        seconds, peak = _measure(func, repeat)
+    except Exception as e:
+        results[key] = dict(info, error='{}: {}'.format(type(e).__name__, e))
+        return False
+    record = dict(info, seconds=seconds, rows_per_s=rows / seconds if seconds else None, peak_bytes=peak)
+    if cells is not None:
+        record['cells_per_s'] = cells / seconds if seconds else None
+    results[key] = record
+    return True
+
+
+def run(df, backends=('pandas', 'panel'), repeat=3, groups=('op', 'alpha158', 'wq101'), pattern=None, log=print):
+    """跑选中的各组基准，返回 {名称: 记录}。pattern 为正则，只跑名称匹配的项目。"""
+    rows = len(df)
+    results = {}
+
+    def selected(key):
+        return pattern is None or re.search(pattern, key)
+
+    def bench(key, exprs, names=None, **info):
+        if not selected(key):
+            return False
+        ok = _record(results, key, lambda: calc_exprs(df, exprs, names, backend), repeat, rows,
+                     cells=rows * len(exprs) if len(exprs) > 1 else None, **info)
+        r = results[key]
+        log('{:<40} {}'.format(key, r['error'] if not ok else '{:9.4f}s {:8.1f} MB'.format(
+            r['seconds'], r['peak_bytes'] / 1024 ** 2)))
+        return ok
+
+    for backend in backends:
+        if 'op' in groups:
+            for name, expr in operator_exprs().items():
+                bench('op/{}/{}'.format(backend, name), [expr], expr=expr)
+
+        if 'alpha158' in groups:
+            fields, names = Alpha158().get_fields_names()
+            bench('alpha158/{}'.format(backend), fields, names, factors=len(fields))
+
+        if 'wq101' in groups:
+            names, features = WorldQuant101().get_names_features()
+            ok_names, ok_features = [], []
+            for name, feature in zip(names, features):
+                key = 'wq101/{}/{}'.format(backend, name)
+                if not selected(key):
+                    continue
+                try:
+                    compile_expr(feature)
+                except Exception as e:
+                    results[key] = dict(expr=feature, error='{}: {}'.format(type(e).__name__, e))
+                    log('{:<40} {}'.format(key, results[key]['error']))
+                    continue
+                if bench(key, [feature], expr=feature):
+                    ok_names.append(name)
+                    ok_features.append(feature)
+            if ok_features:
+                bench('wq101/{}'.format(backend), ok_features, ok_names, factors=len(ok_features))
+    return results
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    versions = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__}
+    try:
+        import numba
+        versions['numba'] = numba.__version__
+    except ImportError:
+        pass
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    return dict(commit=_git('rev-parse', 'HEAD'), dirty=bool(status) if status is not None else None,
+                created=datetime.now().isoformat(timespec='seconds'), platform=platform.platform(),
+                processor=platform.processor(), versions=versions)
+
+
+def compare(results, baseline, threshold=0.2):
+    """逐项对比耗时，返回 (对比表, 退化项目)。比值 = 本次 / 基线，大于 1 + threshold 算退化。"""
+    table = []
+    for key, new in results.items():
+        old = baseline.get(key)
+        if old is None or 'seconds' not in old or 'seconds' not in new:
+            status = 'new' if old is None else ('broken' if 'seconds' in old else ('fixed' if 'seconds' in new else 'error'))
+            table.append((key, old.get('seconds') if old else None, new.get('seconds'), None, status))
+            continue
+        ratio = new['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        status = 'slower' if ratio > 1 + threshold else ('faster' if ratio < 1 / (1 + threshold) else '')
+        table.append((key, old['seconds'], new['seconds'], ratio, status))
+    regressions = [row for row in table if row[4] in ('slower', 'broken')]
+    return table, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--symbols', type=int, default=300)
+    parser.add_argument('--dates', type=int, default=1000)
+    parser.add_argument('--missing', type=float, default=0.0, help='随机去掉的行的比例')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backend', nargs='+', default=['pandas', 'panel'], choices=['pandas', 'panel'])
+    parser.add_argument('--groups', nargs='+', default=['op', 'alpha158', 'wq101'], choices=['op', 'alpha158', 'wq101'])
+    parser.add_argument('--filter', default=None, help='只跑名称匹配这个正则的项目')
+    parser.add_argument('--float32', action='store_true', help='用 float32 精度策略计算')
+    parser.add_argument('--out', default=None, help='结果写到这个 JSON 文件')
+    parser.add_argument('--compare', default=None, help='与之前写出的 JSON 对比')
+    parser.add_argument('--threshold', type=float, default=0.2, help='耗时增加超过这个比例算退化')
+    args = parser.parse_args(argv)
+
+    with dtypes.float_dtype('float32') if args.float32 else nullcontext():
+        df = dtypes.compact_frame(make_panel(args.symbols, args.dates, args.seed, args.missing))
+        results = run(df, args.backend, args.repeat, args.groups, args.filter)
+
+    report = dict(meta=dict(environment(), symbols=args.symbols, dates=args.dates, rows=len(df),
+                            missing=args.missing, seed=args.seed, repeat=args.repeat,
+                            float_dtype='float32' if args.float32 else 'float64'),
+                  results=results)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline['meta']['rows'] != report['meta']['rows']:
+            print('注意：基线的面板为 {} 行，本次为 {} 行'.format(baseline['meta']['rows'], report['meta']['rows']))
+        table, regressions = compare(results, baseline['results'], args.threshold)
+        print('\n基线 {}，本次 {}'.format(baseline['meta'].get('commit'), report['meta']['commit']))
+        for key, old, new, ratio, status in table:
+            if status:
+                print('{:<40} {:>10} {:>10} {:>7} {}'.format(
+                    key, '-' if old is None else '{:.4f}'.format(old), '-' if new is None else '{:.4f}'.format(new),
+                    '-' if ratio is None else '{:.2f}x'.format(ratio), status))
+        print('{} 项退化'.format(len(regressions)))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
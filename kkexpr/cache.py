@@ -0,0 +1,181 @@
+"""
+因子结果的磁盘缓存。
+
+每个因子一份缓存，键由规范化后的表达式（compile_expr 的 key，写法不同但等价的表达式共用一份）、
+标的列表、数据来源、计算后端和当时的精度策略（float32 / float64，见 kkexpr.dtypes）决定。结果按 (日期 × 标的) 存成 .npy，同时为每个日期保存一份输入数据的指纹：
+再次计算时，日期和指纹都对得上的前缀直接复用，其后的日期（新增的行情，或被修订过的数据）
+带上一段预热数据重新计算，再拼回缓存。缓存总大小超过上限时按最近使用时间淘汰。
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from kkexpr import config, dtypes
+from kkexpr.expr import _as_values, _calc_dependent, _split_fields, compile_expr, iter_exprs, required_history
+from kkexpr.panel import Panel
+
+_FILES = ('values', 'dates', 'hashes')
+
+
+class FactorCache:
+    """
+    root 为缓存目录，默认 config.DATA_DIR_CACHE；max_bytes 为缓存总大小上限；
+    warmup 为重新计算新日期时向前多取的交易日数，默认 None 时取待算表达式的回看（expr.required_history）。
+    """
+
+    def __init__(self, root=None, max_bytes=2 * 1024 ** 3, warmup=None):
+        self.root = Path(root) if root is not None else config.DATA_DIR_CACHE
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.warmup = warmup
+
+    def key(self, expr, symbols, source='', backend='pandas'):
+        # float32 与 float64、不同后端算出的结果不完全相同，各存一份
+        text = '|'.join([compile_expr(expr).key, ','.join(map(str, symbols)), str(source), backend,
+                         np.dtype(dtypes.get_float_dtype()).name])
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        path = self.root / key
+        try:
+            entry = {name: np.load(path / (name + '.npy')) for name in _FILES}
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # 记录最近使用时间，淘汰时先删最久未用的
+        return entry
+
+    def put(self, key, values, dates, hashes, meta=None):
+        path = self.root / key
+        path.mkdir(exist_ok=True)
+        for name, arr in zip(_FILES, (values, dates, hashes)):
+            # 先写临时文件再替换，中途中断也不会留下半个文件
+            tmp = path / (name + '.tmp')
+            with open(tmp, 'wb') as f:
+                np.save(f, arr)
+            os.replace(tmp, path / (name + '.npy'))
+        (path / 'meta.json').write_text(json.dumps(meta or {}, ensure_ascii=False), encoding='utf-8')
+        os.utime(path)
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for path in self.root.iterdir():
+            if path.is_dir():
+                size = sum(f.stat().st_size for f in path.iterdir())
+                entries.append((path.stat().st_mtime, size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    def calc_exprs(self, df: pd.DataFrame, exprs, names=None, backend='pandas', source=''):
+        """
+        与 expr.calc_exprs 相同，但先查缓存，只重新计算缓存里没有的日期。
+
+        所有需要重新计算的表达式合并成一次求值，从其中最早缺失的日期往前 warmup 个交易日开始。
+        用到未来数据的表达式（前视 h 根），缓存末尾 h 个日期的值在有了新日期后也重新计算。
+        引用了其他因子名字的表达式不进缓存，在最后按名字计算。结果的值为 float64。
+        """
+        names = list(names) if names is not None else [None] * len(exprs)
+        independent, dependent = _split_fields(df, exprs, names)
+        panel = Panel.from_index(df.index)
+        dates = np.asarray(panel.dates.astype(str), dtype=str)
+        symbols = [str(s) for s in panel.symbols]
+        results = [None] * len(exprs)
+        todo = {}
+        for pos in independent:
+            expr = exprs[pos]
+            if expr in df.columns:
+                results[pos] = df[expr]
+                continue
+            hashes = _fingerprint(df, panel, compile_expr(expr).columns)
+            key = self.key(expr, symbols, source, backend)
+            entry = self.get(key)
+            matched, offset = _match(entry, dates, hashes)
+            horizon = compile_expr(expr).horizon
+            if horizon and entry is not None and len(dates) > len(entry['dates']) - offset:
+                # 缓存时末尾的标签还看不到未来，新日期到来后要重算
+                matched = min(matched, max(len(entry['dates']) - offset - horizon, 0))
+            if matched == len(dates):
+                values = entry['values'][offset:offset + matched]
+                results[pos] = panel.to_series(values, names[pos])
+            else:
+                todo[pos] = (key, entry, hashes, matched, offset)
+
+        if todo:
+            warmup = self.warmup
+            if warmup is None:
+                warmup = required_history([exprs[p] for p in todo])[0]
+            first = min(matched for _, _, _, matched, _ in todo.values())
+            start = max(first - warmup, 0)
+            in_range = panel.rows >= start
+            sub = df[in_range] if start else df
+            rows, cols = panel.rows[in_range], panel.cols[in_range]
+            for pos, se in zip(todo, iter_exprs(sub, [exprs[p] for p in todo], backend=backend)):
+                key, entry, hashes, matched, offset = todo[pos]
+                values = np.full(panel.shape, np.nan)
+                values[rows, cols] = _as_values(se, sub.index)
+                if matched:
+                    values[:matched] = entry['values'][offset:offset + matched]
+                results[pos] = panel.to_series(values, names[pos])
+                if entry is not None:  # 保留缓存里早于本次数据的部分
+                    values = np.concatenate([entry['values'][:offset], values])
+                    hashes = np.concatenate([entry['hashes'][:offset], hashes])
+                    cached_dates = np.concatenate([entry['dates'][:offset], dates])
+                else:
+                    cached_dates = dates
+                self.put(key, values, cached_dates, hashes,
+                         dict(expr=exprs[pos], key=compile_expr(exprs[pos]).key, symbols=symbols, source=str(source),
+                              backend=backend, float_dtype=np.dtype(dtypes.get_float_dtype()).name))
+
+        if dependent:
+            _calc_dependent(df, exprs, names, results, independent, dependent, backend)
+        return results
+
+    def calc_expr(self, df: pd.DataFrame, expr: str, backend='pandas', source=''):
+        return self.calc_exprs(df, [expr], backend=backend, source=source)[0]
+
+
+def _fingerprint(df, panel, columns):
+    # 每个日期一个指纹，由当天所有标的在表达式用到的列上的取值算出（缺失的格子按 NaN 计）
+    hashes = np.zeros(panel.shape[0], dtype=np.uint64)
+    weights = pd.util.hash_array(np.arange(panel.shape[1])) | np.uint64(1)
+    for col in sorted(columns):
+        if col not in df.columns or not pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        arr = panel.to_array(df[col])
+        cell = pd.util.hash_array(arr.ravel()).reshape(arr.shape)
+        hashes = hashes * np.uint64(1099511628211) + (cell * weights).sum(axis=1, dtype=np.uint64)
+    return hashes
+
+
+def _match(entry, dates, hashes):
+    """返回 (本次数据从头开始能复用的日期数, 第一个日期在缓存中的位置)。"""
+    if entry is None:
+        return 0, 0
+    cached = entry['dates']
+    offset = int(np.searchsorted(cached, dates[0]))
+    if offset == len(cached) or cached[offset] != dates[0]:
+        # 第一个日期不在缓存里，整体重算，缓存中更早的日期保留
+        return 0, offset
+    n = min(len(cached) - offset, len(dates))
+    same = (cached[offset:offset + n] == dates[:n]) & (entry['hashes'][offset:offset + n] == hashes[:n])
+    return (n if same.all() else int(np.argmin(same))), offset
@@ -7,7 +7,10 @@ DATA_DIR = WORKDIR.joinpath("data")
 print(DATA_DIR)
 DATA_DIR_QUOTES = DATA_DIR.joinpath('quotes')
 DATA_DIR_CSVS = DATA_DIR.joinpath('csvs')
-dirs = [DATA_DIR, DATA_DIR_QUOTES, DATA_DIR_CSVS]
+DATA_DIR_CACHE = DATA_DIR.joinpath('factor_cache')
+DATA_DIR_PARQUET = DATA_DIR.joinpath('parquet')
+DATA_DIR_PANEL = DATA_DIR.joinpath('panel')
+dirs = [DATA_DIR, DATA_DIR_QUOTES, DATA_DIR_CSVS, DATA_DIR_CACHE, DATA_DIR_PARQUET, DATA_DIR_PANEL]
 
 for dir in dirs:
     dir.mkdir(exist_ok=True, parents=True)
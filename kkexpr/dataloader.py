@@ -1,4 +1,7 @@
-from pathlib import WindowsPath
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, WindowsPath
 
 import numpy as np
 import pandas as pd
@@ -7,7 +10,11 @@ from datetime import datetime
 import requests
 from tqdm import tqdm
 import abc
-from kkexpr.expr import calc_expr
+from kkexpr import config, dtypes
+from kkexpr.expr import _as_values, compile_expr, iter_exprs, required_history
+from kkexpr.panel import Panel
+from kkexpr.parallel import calc_exprs_parallel, calc_exprs_sharded
+from kkexpr.store import PanelStore
 
 
 class Dataloader:
@@ -21,88 +28,430 @@ class Dataloader:
         self.end_date = end_date
 
     @abc.abstractmethod
-    def _load_dfs(self):
+    def _load_dfs(self, start=None, end=None):
         pass
 
+    def _load_df(self, fields=None, start=None, end=None):
+        # 读取 [start, end] 的行情（None 为不限）：以日期为索引、带 symbol 列，按日期排好序；fields 为稍后要计算的表达式
+        return self._concat_dfs(self._load_dfs(start, end))
+
+    def _load_history(self, fields=None, lookback=0, horizon=0, start=None, end=None):
+        """读取 [start, end]（默认 [start_date, end_date]）的行情，前后多带 lookback、horizon 个交易日（见 load_history）。"""
+        start = start if start is not None else self.start_date
+        end = end if end is not None else self.end_date
+        return load_history(lambda lo, hi: self._load_df(fields, lo, hi), start, end, lookback, horizon)
+
     def _concat_dfs(self, dfs: list):
         df = pd.concat(dfs)
         #df.dropna(inplace=True)
-        df.sort_index(inplace=True)
+        if not df.index.is_monotonic_increasing:
+            # 各标的已按日期排好，稳定排序只需归并这些有序段，同一天内保持标的的先后
+            df.sort_index(inplace=True, kind='stable')
         return df
 
-    def _reset_index(self, df: pd.DataFrame):
-        trade_calendar = list(set(df.index))
-        trade_calendar.sort()
+    def load(self, fields=None, names=None, backend='pandas', n_jobs=1, chunksize=None, shard_by='field',
+             cache=None, align=True, ffill_limit=None, sink=None, return_df=False):
+        """
+        加载行情并计算因子。n_jobs > 1 时用进程池并行计算，行情通过共享内存传给子进程：
+        shard_by='field' 按字段切分，chunksize 为每个任务包含的字段数；
+        shard_by='symbol' 按标的切分，每个进程对一段标的计算全部字段，适合深层的时间序列表达式。
+        cache 为 FactorCache 时先查磁盘缓存，只计算缓存里没有的日期。
+        align 为 True 时先用 align_calendar 把各标的对齐到统一的交易日历（停牌日向前填充，最多 ffill_limit 天），
+        并增加布尔列 valid 标出当天是否真有行情。
+        float32 精度策略下（见 kkexpr.dtypes）数值列存成 float32、symbol 列存成分类类型。
+        需要的预热历史由表达式自动分析（expr.required_history）：只多读最长回看窗口所需的交易日，
+        用到未来数据的标签（如 shift(close, -5)）在 end_date 之后多读相应的交易日，结果再裁回 [start_date, end_date]。
+        sink 为 kkexpr.sink 中的写出目标时，每个因子算完就写出并释放，不再拼成整张表，返回写出的行数；
+        return_df 为 True 时仍同时返回 DataFrame。
+        """
+        lookback, horizon = required_history(fields, names) if fields else (0, 0)
+        df = self._load_history(fields, lookback, horizon)
+        return self._evaluate(df, fields, names, self.start_date, self.end_date, backend, n_jobs, chunksize, shard_by,
+                              cache, align, ffill_limit, sink, return_df)
 
-        def _ffill_df(sub_df: pd.DataFrame):
-            df_new = sub_df.reindex(trade_calendar, method='ffill')
-            return df_new
+    def iter_blocks(self, fields, names, block_days=365, backend='pandas', n_jobs=1, chunksize=None,
+                    shard_by='field', cache=None, align=True, ffill_limit=None, sink=None):
+        """
+        分块计算：把 [start_date, end_date] 按自然日切成 block_days 天一块，每块连同表达式需要的回看、前视一起读取，
+        算完只产出块内的行（格式与 load 的返回值相同）。峰值内存取决于块的长度而不是整段历史的长度，
+        各块拼起来与整段 load 的结果一致。其余参数与 load 相同；给出 sink 时每块写一段，产出的是每块写出的行数。
 
-        df = df.groupby('symbol', group_keys=False).apply(lambda sub_df: _ffill_df(sub_df))
-        return df
+        对齐日历时每块多读 ffill_limit 个交易日，向前填充跨块边界时也不变；ffill_limit 为 None 时，
+        在块起点之前停牌超过回看窗口的标的，块起点处不会被填充。
+        CSV 行情每块都要重读整份文件，块多时宜用 Parquet 或内存映射的面板库。
+        """
+        lookback, horizon = required_history(fields, names)
+        if align and ffill_limit:
+            lookback = max(lookback, ffill_limit)
+        start, end = pd.Timestamp(self.start_date), _end_of_day(self.end_date)
+        edges = list(pd.date_range(start.normalize(), end, freq='{}D'.format(block_days))) + [end + _TICK]
+        edges[0] = start
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            hi = hi - _TICK  # 块的右端不含下一块的起点
+            df = self._load_history(fields, lookback, horizon, lo, hi)
+            if df.empty:
+                continue
+            out = self._evaluate(df, fields, names, lo, hi, backend, n_jobs, chunksize, shard_by, cache, align,
+                                 ffill_limit, sink)
+            if sink is not None or len(out):
+                yield out
 
-    def load(self, fields=None, names=None):
-        dfs = self._load_dfs()
-        df = self._concat_dfs(dfs)
+    def load_chunked(self, fields, names, sink, block_days=365, **kwargs):
+        """
+        分块计算（见 iter_blocks），返回写出的总行数。sink 为 kkexpr.sink 中的写出目标时每块写一段、
+        每个因子算完即写出；也可以是任意可调用对象，每块的结果 DataFrame 交给 sink(df) 后即释放。
+        """
+        if hasattr(sink, 'begin'):
+            return sum(self.iter_blocks(fields, names, block_days, sink=sink, **kwargs))
+        rows = 0
+        for df in self.iter_blocks(fields, names, block_days, **kwargs):
+            sink(df)
+            rows += len(df)
+        return rows
 
-        # df = self._reset_index(df)
+    def _evaluate(self, df, fields, names, start, end, backend='pandas', n_jobs=1, chunksize=None, shard_by='field',
+                  cache=None, align=True, ffill_limit=None, sink=None, return_df=False):
+        if align:
+            df, valid = align_calendar(df, ffill_limit)
+            df['valid'] = valid
+        df = dtypes.compact_frame(df)
 
         if not fields or not names or len(fields) == 0 or len(fields) != len(names):
             return df
         else:
 
-            dfs_expr = []
-
             cols = []
-            count = 0
             df.set_index([df.index, 'symbol'], inplace=True)
-            for field, name in tqdm(zip(fields, names)):
-                # print(field)
-
-                se = calc_expr(df, field)
-                count += 1
-                if count < 10:
-                    df[name] = se
-                else:
-                    se.name = name
-                    cols.append(se)
+            if cache is not None:
+                results = cache.calc_exprs(df, fields, names, backend, source=self.path)
+            elif n_jobs > 1 and shard_by == 'symbol':
+                results = calc_exprs_sharded(df, fields, names, n_jobs, backend=backend)
+            elif n_jobs > 1:
+                results = calc_exprs_parallel(df, fields, names, n_jobs, chunksize, backend)
+            else:
+                results = self._calc_exprs(df, fields, names, backend)
+            if sink is not None:
+                return self._write(df, names, results, start, end, sink, return_df)
+            for name, se in tqdm(zip(names, results), total=len(fields)):
+                cols.append(se.rename(name))
             if len(cols):
                 df_cols = pd.concat(cols, axis=1)
                 df = pd.concat([df, df_cols], axis=1)
 
-            df_all = df.loc[self.start_date: self.end_date].copy()
+            df_all = df.loc[start: end].copy()
             # print(df_all.index.levels[0])
             df_all['symbol'] = df_all.index.droplevel(0)
             # df_all['symbol'] = df_all.index.levels[0]
             df_all.index = df_all.index.droplevel(1)
             return df_all
 
+    def _calc_exprs(self, df, fields, names, backend):
+        # 整个因子集合并成一个 DAG 求值，公共子表达式只算一次
+        return iter_exprs(df, fields, names, backend)
+
+    def _write(self, df, names, results, start, end, sink, return_df=False):
+        # 只写 [start, end] 内的行；每个因子写出后即释放，return_df 时才留下来拼表
+        dates = df.index.get_level_values(0)
+        in_range = (dates >= pd.Timestamp(start)) & (dates <= _end_of_day(end))
+        sink.begin(df.index[in_range])
+        cols = []
+        for name, se in tqdm(zip(names, results), total=len(names)):
+            values = _as_values(se, df.index).astype(dtypes.FLOAT, copy=False)[in_range]
+            sink.write(name, values)
+            if return_df:
+                cols.append(pd.Series(values, index=df.index[in_range], name=name))
+            del se, values
+        if not return_df:
+            return int(in_range.sum())
+        df_all = pd.concat([df[in_range]] + cols, axis=1)
+        df_all['symbol'] = df_all.index.droplevel(0)
+        df_all.index = df_all.index.droplevel(1)
+        return df_all
+
 
 class CSVDataloader(Dataloader):
-    def __init__(self, path: WindowsPath, symbols, start_date='20100101', end_date=datetime.now().strftime('%Y%m%d')):
+    """
+    每个标的一个 CSV 的行情目录（data/quotes、data/csvs 的格式）。
+
+    文件在线程池里并发读取（n_jobs 个线程，read_csv 的解析不占 GIL）。date 列为 YYYYMMDD 整数时直接用整数运算
+    换算成日期，否则按 date_format 整列解析，格式不符时退回逐个推断。文件本身按日期正序或倒序排好时不再排序。
+    读完后 self.stats 记录每个文件的行数、字节数、耗时和吞吐量。
+    """
+
+    def __init__(self, path: WindowsPath, symbols, start_date='20100101', end_date=datetime.now().strftime('%Y%m%d'),
+                 n_jobs=8, date_format='%Y%m%d'):
         super(CSVDataloader, self).__init__(path, symbols, start_date, end_date)
+        self.n_jobs = n_jobs
+        self.date_format = date_format
+        self.stats = None
+
+    def _parse_dates(self, dates):
+        if self.date_format == '%Y%m%d' and pd.api.types.is_integer_dtype(dates):
+            parsed = _parse_yyyymmdd(dates.values)
+            if parsed is not None:
+                return pd.Series(parsed, index=dates.index)
+        try:
+            return pd.to_datetime(dates.astype(str), format=self.date_format)
+        except (ValueError, TypeError):
+            return pd.to_datetime(dates.astype(str))
 
-    def _read_csv(self, symbol):
-        file = symbol + '.csv'
-        df = pd.read_csv(self.path.joinpath(file), index_col=None)
-        df['date'] = df['date'].apply(lambda x: str(x))
-        df.set_index('date', inplace=True)
+    def _read_csv(self, symbol, start=None, end=None):
+        file = self.path.joinpath(symbol + '.csv')
+        df = pd.read_csv(file, index_col=None)
+        df.set_index(self._parse_dates(df.pop('date')).rename('date'), inplace=True)
         df['symbol'] = symbol
-        df.index = pd.to_datetime(df.index)
-        df.sort_index(inplace=True, ascending=True)
-        df = df.loc[self.start_date:, :]
-        return df
+        if df.index.is_monotonic_decreasing and not df.index.is_monotonic_increasing:
+            df = df.iloc[::-1]  # 倒序存放的文件直接翻转
+        elif not df.index.is_monotonic_increasing:
+            df.sort_index(inplace=True, kind='stable')
+        lo = df.index.searchsorted(start) if start is not None else 0
+        hi = df.index.searchsorted(end, side='right') if end is not None else len(df)
+        return df.iloc[lo:hi]
+
+    def _read_csv_timed(self, symbol, start=None, end=None):
+        clock = time.perf_counter()
+        df = self._read_csv(symbol, start, end)
+        seconds = time.perf_counter() - clock
+        size = self.path.joinpath(symbol + '.csv').stat().st_size
+        return df, dict(symbol=symbol, rows=len(df), bytes=size, seconds=seconds,
+                        mb_per_s=size / 1024 ** 2 / seconds if seconds else np.nan)
+
+    def _load_dfs(self, start=None, end=None):
+        if self.n_jobs > 1 and len(self.symbols) > 1:
+            with ThreadPoolExecutor(self.n_jobs) as pool:
+                results = list(pool.map(lambda s: self._read_csv_timed(s, start, end), self.symbols))
+        else:
+            results = [self._read_csv_timed(s, start, end) for s in self.symbols]
+        self.stats = pd.DataFrame([stat for _, stat in results], columns=_STATS_COLUMNS)
+        return [df for df, _ in results]
+
+
+_STATS_COLUMNS = ['symbol', 'rows', 'bytes', 'seconds', 'mb_per_s']
+# 估计多读范围时，一个交易日按 1.5 个自然日算，另加 10 天余量覆盖长假
+_DAYS_PER_BAR = 1.5
+_HISTORY_SLACK = 10
+# 读到的第一个（最后一个）交易日离读取边界不超过这么远，就认为边界外还有数据
+_HISTORY_GAP = pd.Timedelta(days=31)
+# 与 pd.to_datetime 解析字符串得到的精度保持一致（pandas 3 起为 us，之前为 ns）
+_DATETIME_DTYPE = pd.to_datetime(pd.Series(['20000101']), format='%Y%m%d').dtype
+
+
+def _parse_yyyymmdd(values):
+    # 20240102 这样的整数拆成年月日直接算出 datetime64，比逐个解析字符串快一个数量级；不是合法日期时返回 None
+    year, rest = np.divmod(values.astype(np.int64), 10000)
+    month, day = np.divmod(rest, 100)
+    months = (year - 1970) * 12 + month - 1
+    dates = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1)
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & (dates.astype('datetime64[M]') == months.astype('datetime64[M]'))
+    if not valid.all():
+        return None
+    return dates.astype(_DATETIME_DTYPE)
+
+
+# 比任何 bar 的间隔都短的时间，用来表示左闭右开区间的右端（不用纳秒：日期索引可能是 us、s 精度）
+_TICK = pd.Timedelta(seconds=1)
+
+
+def _end_of_day(date):
+    # 只给到日期的结束时间包含当天全部的 bar（分钟线）
+    date = pd.Timestamp(date)
+    return date + pd.Timedelta(days=1) - _TICK if date == date.normalize() else date
+
+
+def history_range(start, end, lookback=0, horizon=0, scale=1, bars_per_day=1):
+    """
+    为回看 lookback、前视 horizon 根 bar 估计要读取的自然日范围，返回 (开始, 结束)；
+    scale 为估计不够时的放大倍数，bars_per_day 为每个交易日的 bar 数（日线为 1）。
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+
+    def pad(bars):
+        if not bars:
+            return pd.Timedelta(0)
+        return pd.Timedelta(days=math.ceil(bars / bars_per_day * _DAYS_PER_BAR * scale) + _HISTORY_SLACK)
+
+    return start - pad(lookback), end + pad(horizon)
+
+
+def load_history(read, start, end, lookback=0, horizon=0, bars_per_day=1):
+    """
+    读取 [start, end] 的行情，前面多带 lookback 根 bar、后面多带 horizon 根 bar。
+    read(fetch_start, fetch_end) 返回这段时间的行情，按时间排序，行索引（双层索引时为第一层）为时间。
+
+    交易日历事先未知，先按自然日估计多读的范围（见 history_range）；读到的 bar 不够、而更早（更晚）处还有数据时加倍重读，
+    加倍后不够的一侧没读到新的 bar 就停止，最后按读到的日历裁掉多出来的部分。
+    """
+    start, end = pd.Timestamp(start), _end_of_day(end)
+    scale = 1
+    n_before = n_after = -1
+    while True:
+        fetch_start, fetch_end = history_range(start, end, lookback, horizon, scale, bars_per_day)
+        df = read(fetch_start, fetch_end)
+        if df is None or df.empty:
+            return df
+        times = pd.DatetimeIndex(df.index.get_level_values(0))
+        dates = times.unique().sort_values()
+        # 加倍后不够的一侧没读到新的 bar，说明那一侧已到数据的尽头（如 end_date 就是最新一天），不再重读
+        before, after = (dates < start).sum(), (dates > end).sum()
+        short = n_before < before < lookback and dates[0] - fetch_start <= _HISTORY_GAP
+        short |= n_after < after < horizon and fetch_end - dates[-1] <= _HISTORY_GAP
+        if not short:
+            break
+        n_before, n_after = before, after
+        scale *= 2
+    before, after = dates[dates < start], dates[dates > end]
+    lo = start if not lookback else (before[-lookback] if len(before) > lookback else dates[0])
+    hi = end if not horizon else (after[horizon - 1] if len(after) >= horizon else dates[-1])
+    return df[(times >= lo) & (times <= hi)]
+
+
+def align_calendar(df: pd.DataFrame, limit=None):
+    """
+    把长表（以日期为索引、带 symbol 列）对齐到统一的交易日历，日历为所有标的出现过的日期。
+
+    一次展开成 (日期 × 标的) 的面板，每个格子记下截至当天最近一条真实行情所在的行，
+    再按这些行号一次取出整张表：停牌日沿用之前最近一条行情，距离超过 limit 天（None 不限）的不补，
+    首条行情之前的日期也不补。返回 (对齐后的长表, valid)，长表按日期、标的排序；
+    valid 为逐行对应的布尔数组，True 为当天真有行情，False 为向前填充出来的行。
+    """
+    panel = Panel(pd.MultiIndex.from_arrays([df.index, df['symbol']]))
+    steps = np.arange(panel.shape[0])[:, None]
+    last = np.maximum.accumulate(np.where(panel.mask, steps, -1), axis=0)
+    keep = last >= 0
+    if limit is not None:
+        keep &= steps - last <= limit
+    rows, cols = np.nonzero(keep)
+    source = np.empty(panel.shape, dtype=np.intp)
+    source[panel.rows, panel.cols] = np.arange(len(df))
+    out = df.iloc[source[last[rows, cols], cols]]
+    out.index = pd.Index(panel.dates[rows], name=df.index.name)
+    return out, panel.mask[rows, cols]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError('Parquet 行情需要安装 pyarrow: pip install pyarrow')
+    return pyarrow
+
+
+class ParquetDataloader(Dataloader):
+    """
+    从按年分区的 Parquet 行情库读取（目录结构 year=2024/*.parquet，由 csv_to_parquet 生成）。
+
+    日期、标的的过滤和列裁剪都下推给 pyarrow：只扫描覆盖 [start_date, end_date] 的年份分区，
+    只读 symbols 的行和表达式用到的列，读出来就是整张长表，不再逐个标的拼接。
+    读取范围按表达式的回看、前视自动向两端扩展（见 Dataloader.load）。
+    """
+
+    def __init__(self, path=None, symbols=None, start_date='20100101', end_date=datetime.now().strftime('%Y%m%d')):
+        super(ParquetDataloader, self).__init__(path or config.DATA_DIR_PARQUET, symbols, start_date, end_date)
+
+    def _columns(self, schema_names, fields):
+        if not fields:
+            return None
+        used = set()
+        for field in fields:
+            used |= compile_expr(field).columns
+        return ['date', 'symbol'] + [c for c in schema_names if c in used and c not in ('date', 'symbol', 'year')]
+
+    def _load_df(self, fields=None, start=None, end=None):
+        pa = _import_pyarrow()
+        ds = pa.dataset
+        dataset = ds.dataset(self.path, format='parquet', partitioning='hive')
+        end = pd.Timestamp(end if end is not None else self.end_date)
+        # year 是分区字段，对它的过滤让 pyarrow 直接跳过范围外的分区文件
+        flt = (ds.field('year') <= end.year) & (ds.field('date') <= end)
+        if start is not None:
+            start = pd.Timestamp(start)
+            flt = flt & (ds.field('year') >= start.year) & (ds.field('date') >= start)
+        if self.symbols:
+            flt = flt & ds.field('symbol').isin(list(self.symbols))
+        table = dataset.to_table(columns=self._columns(dataset.schema.names, fields), filter=flt)
+        df = table.to_pandas()
+        df = df.drop(columns=['year'], errors='ignore')
+        df.sort_values(['date', 'symbol'], inplace=True, kind='stable')
+        return df.set_index('date')
+
+
+def csv_to_parquet(src=None, dst=None, symbols=None):
+    """
+    把每个标的一个 CSV 的行情目录（data/quotes、data/csvs 的格式）一次性转成按年分区的 Parquet 行情库。
+
+    src 默认 config.DATA_DIR_QUOTES，dst 默认 config.DATA_DIR_PARQUET；symbols 为空时转换目录下全部文件。
+    date 列存为时间戳，文件名即标的代码（CSV 里已有 symbol 列时以它为准）。
+    dst 里已有行情时，symbols 中标的的行情被替换，其他标的保留。返回写入的行数（含保留下来的行）。
+    """
+    pa = _import_pyarrow()
+    src, dst = Path(src or config.DATA_DIR_QUOTES), Path(dst or config.DATA_DIR_PARQUET)
+    files = [src.joinpath(s + '.csv') for s in symbols] if symbols else sorted(src.glob('*.csv'))
+    dfs = []
+    for file in files:
+        df = pd.read_csv(file, dtype={'date': str})
+        if 'symbol' not in df.columns:
+            df['symbol'] = file.stem
+        df['date'] = pd.to_datetime(df['date'], format='%Y%m%d')
+        dfs.append(df)
+    if not dfs:
+        return 0
+    df = pd.concat(dfs, ignore_index=True)
+    df['year'] = df['date'].dt.year
+    if symbols and any(dst.glob('year=*/*.parquet')):
+        # 只转换部分标的时，涉及的年份分区整个重写，先把这些分区里其他标的的行情读出来一起写回
+        dataset = pa.dataset.dataset(dst, format='parquet', partitioning='hive')
+        flt = pa.dataset.field('year').isin(sorted(df['year'].unique().tolist()))
+        flt = flt & ~pa.dataset.field('symbol').isin(sorted(df['symbol'].unique().tolist()))
+        df = pd.concat([dataset.to_table(filter=flt).to_pandas(), df], ignore_index=True)
+        df['year'] = df['date'].dt.year
+    df.sort_values(['symbol', 'date'], inplace=True, kind='stable')
+    pa.dataset.write_dataset(pa.Table.from_pandas(df, preserve_index=False), dst, format='parquet',
+                             partitioning=['year'], partitioning_flavor='hive',
+                             existing_data_behavior='delete_matching')
+    return len(df)
+
+
+class MmapDataloader(Dataloader):
+    """
+    从内存映射的面板库读取（PanelStore.write / PanelStore.from_dataloader 生成）。
+
+    行情以只读方式映射，多个进程同时读同一份库时共用页缓存；只取表达式用到的字段。
+    库里存的是未对齐的原始行情，load 时与其他加载器一样用 align_calendar 对齐日历、标出 valid。
+    backend='panel' 时因子直接在映射的 (日期 × 标的) 数组上计算，不经过长表展开；
+    对齐日历补出的停牌日在数组上向前填充，float32 精度策略下数组转成 float32。
+    """
+
+    def __init__(self, path=None, symbols=None, start_date='20100101', end_date=datetime.now().strftime('%Y%m%d')):
+        super(MmapDataloader, self).__init__(path or config.DATA_DIR_PANEL, symbols, start_date, end_date)
+        self.store = PanelStore(self.path)
+
+    def _fields(self, fields):
+        if not fields:
+            return None
+        used = set()
+        for field in fields:
+            used |= compile_expr(field).columns
+        return [f for f in self.store.fields if f in used]
 
-    def _load_dfs(self):
-        dfs = []
-        for s in self.symbols:
-            df = self._read_csv(s)
-            dfs.append(df)
-        return dfs
+    def _load_df(self, fields=None, start=None, end=None):
+        return self.store.load(self._fields(fields), start, end, self.symbols)
 
+    def _calc_exprs(self, df, fields, names, backend):
+        if backend != 'panel' or df.empty:
+            return super(MmapDataloader, self)._calc_exprs(df, fields, names, backend)
+        dates = df.index.get_level_values(0)
+        start, end = dates[0], dates[-1]
+        # 长表面板的日历、标的与库里选中的部分一致时，直接用映射的数组；对齐日历补出的停牌日在数组上向前填充
+        panel = Panel.from_index(df.index)
+        rows, cols = self.store._select(start, end, self.symbols)
+        if not (np.array_equal(panel.dates, self.store.dates[rows])
+                and np.array_equal(panel.symbols.astype(str), self.store.symbols[cols].astype(str))):
+            return super(MmapDataloader, self)._calc_exprs(df, fields, names, backend)
+        arrays = self.store.arrays(self._fields(fields), start, end, self.symbols, ffill=panel.mask)
+        return iter_exprs(df, fields, names, backend, arrays={f: dtypes.cast(arr) for f, arr in arrays.items()})
 
 if __name__ == '__main__':
-    import config
     import numpy as np
 
     fields = ['signed_power(signed_power(close, 40)*ts_max(low, 20)/ts_rank(open, 40)-low-10, 40)']
@@ -0,0 +1,62 @@
+"""
+数值精度策略。
+
+默认 float64。切换成 float32 后（set_float_dtype('float32') 或 with float_dtype('float32'): ...），
+加载器读出的行情列、面板后端展开的输入和每一步的中间结果都存成 float32，内存减半，
+同样的 cache line 能装下两倍的元素；滚动求和等内核内部的累加量仍是 float64，只在写出结果时转回 float32。
+float32 模式下加载器同时把 symbol 列存成分类类型：每行只存一个整数编码，标的代码单独存一张表。
+"""
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+FLOAT = np.float64
+
+
+def set_float_dtype(dtype):
+    global FLOAT
+    dtype = np.dtype(dtype).type
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('只支持 float32 或 float64: {}'.format(dtype))
+    FLOAT = dtype
+
+
+def get_float_dtype():
+    return FLOAT
+
+
+@contextmanager
+def float_dtype(dtype):
+    previous = FLOAT
+    set_float_dtype(dtype)
+    try:
+        yield
+    finally:
+        set_float_dtype(previous)
+
+
+def is_compact():
+    return FLOAT is np.float32
+
+
+def cast(value):
+    """把浮点数组（或数组的元组）转成当前精度，其他值原样返回。"""
+    if isinstance(value, tuple):
+        return tuple(cast(v) for v in value)
+    if isinstance(value, np.ndarray) and value.dtype.kind == 'f' and value.dtype != FLOAT:
+        return value.astype(FLOAT)
+    return value
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """float32 模式下把长表的数值列转成 float32、symbol 列转成分类类型；float64 模式下原样返回。"""
+    if not is_compact():
+        return df
+    columns = {}
+    for col in df.columns:
+        if col == 'symbol':
+            columns[col] = df[col].astype('category')
+        elif pd.api.types.is_float_dtype(df[col]) or pd.api.types.is_integer_dtype(df[col]):
+            columns[col] = df[col].astype(FLOAT)
+    return df.assign(**columns) if columns else df
@@ -1,26 +1,504 @@
+import ast
+import inspect
+import operator
+import weakref
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 from kkexpr.expr_functions import *
+from kkexpr.panel import Panel
+
+_BIN_OPS = {
+    ast.Add: ('+', operator.add),
+    ast.Sub: ('-', operator.sub),
+    ast.Mult: ('*', operator.mul),
+    ast.Div: ('/', operator.truediv),
+    ast.FloorDiv: ('//', operator.floordiv),
+    ast.Mod: ('%', operator.mod),
+    ast.Pow: ('**', operator.pow),
+    ast.BitAnd: ('&', operator.and_),
+    ast.BitOr: ('|', operator.or_),
+    ast.BitXor: ('^', operator.xor),
+}
+
+_UNARY_OPS = {
+    ast.USub: ('-', operator.neg),
+    ast.UAdd: ('+', operator.pos),
+    ast.Invert: ('~', operator.invert),
+}
+
+_CMP_OPS = {
+    ast.Lt: ('<', operator.lt),
+    ast.LtE: ('<=', operator.le),
+    ast.Gt: ('>', operator.gt),
+    ast.GtE: ('>=', operator.ge),
+    ast.Eq: ('==', operator.eq),
+    ast.NotEq: ('!=', operator.ne),
+}
+
+# 满足交换律的运算，规范化时按 key 排序操作数，使 a+b 与 b+a 共享同一子树
+_COMMUTATIVE = {'+', '*'}
+
+
+class ExprNode:
+    """计划树节点。key 是规范化后的表达式文本，相同子树的 key 相同。"""
+    key = ''
+    children = ()
+
+    def evaluate(self, ctx):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return self.key
+
+
+class Column(ExprNode):
+    def __init__(self, name):
+        self.name = name
+        self.key = name
+
+    def evaluate(self, ctx):
+        return ctx.column(self.name)
+
+
+class Const(ExprNode):
+    def __init__(self, value):
+        self.value = value
+        self.key = repr(value)
+
+    def evaluate(self, ctx):
+        return self.value
+
+
+class Call(ExprNode):
+    def __init__(self, name, func, args, kwargs):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.children = args + tuple(node for _, node in kwargs)
+        params = [arg.key for arg in args] + ['{}={}'.format(k, node.key) for k, node in kwargs]
+        self.key = '{}({})'.format(name, ', '.join(params))
+
+    def evaluate(self, ctx):
+        args = [ctx.eval(arg) for arg in self.args]
+        kwargs = {k: ctx.eval(node) for k, node in self.kwargs}
+        return ctx.call(self.func, args, kwargs)
+
+
+class BinOp(ExprNode):
+    def __init__(self, symbol, func, left, right):
+        self.symbol = symbol
+        self.func = func
+        self.left = left
+        self.right = right
+        self.children = (left, right)
+        self.key = '({} {} {})'.format(left.key, symbol, right.key)
+
+    def evaluate(self, ctx):
+        return self.func(ctx.eval(self.left), ctx.eval(self.right))
+
+
+class UnaryOp(ExprNode):
+    def __init__(self, symbol, func, operand):
+        self.symbol = symbol
+        self.func = func
+        self.operand = operand
+        self.children = (operand,)
+        self.key = '({}{})'.format(symbol, operand.key)
+
+    def evaluate(self, ctx):
+        return self.func(ctx.eval(self.operand))
+
+
+class ExprPlan:
+    """一个表达式编译后的执行计划：列、算子在编译期解析完毕，求值时直接遍历树。"""
+
+    def __init__(self, expr: str, root: ExprNode):
+        self.expr = expr
+        self.root = root
+        self.columns = _collect_columns(root)
+
+    @property
+    def key(self):
+        return self.root.key
+
+    @property
+    def lookback(self):
+        """算出第一个完整的值需要的历史 bar 数：嵌套的窗口逐层相加。"""
+        return _history(self.root)[0]
+
+    @property
+    def horizon(self):
+        """用到的未来 bar 数（shift 等取负的周期），即标签在末尾缺失的行数。"""
+        return _history(self.root)[1]
+
+    def evaluate(self, df: pd.DataFrame, backend='pandas', memo=None):
+        ctx = _CONTEXTS[backend](df, _count_refs([self.root]), memo)
+        return ctx.evaluate_root(self.root)
+
+    def __repr__(self):
+        return 'ExprPlan({})'.format(self.key)
+
+
+class EvalContext:
+    """
+    一次求值的上下文，负责把列名解析为 df 中的列，并缓存子表达式结果。
+
+    refs 记录每个节点还会被读取的次数，计数归零后立即释放缓存，
+    所以公共子表达式只算一次，而中间结果不会一直占着内存。
+    memo 为 SubexprMemo 时，子表达式结果还会跨多次求值保留在内存里。
+    """
+
+    def __init__(self, df: pd.DataFrame, refs: Counter, memo=None):
+        self.df = df
+        self.refs = refs
+        self.memo = memo
+        self.cache = {}
+        self.outputs = {}
+
+    def column(self, name):
+        if name in self.outputs:  # 前面已算出的因子，可按名字引用
+            return self.outputs[name]
+        if name in self.df.columns:
+            return self.df[name]
+        if name in globals():  # np、pd 等模块名
+            return globals()[name]
+        raise KeyError(name)
+
+    def call(self, func, args, kwargs):
+        return func(*args, **kwargs)
+
+    def evaluate_root(self, node: ExprNode):
+        return self.eval(node)
+
+    def eval(self, node: ExprNode):
+        if not node.children:
+            return node.evaluate(self)
+        key = node.key
+        if key in self.cache:
+            value = self.cache[key]
+        else:
+            value = self._compute(node)
+            self.cache[key] = value
+        self.refs[key] -= 1
+        if self.refs[key] <= 0:
+            del self.cache[key]
+        return value
+
+    def _compute(self, node: ExprNode):
+        # 引用了本次按名字算出的因子的子树，含义随调用而变，不跨调用缓存
+        if self.memo is None or (self.outputs and _collect_columns(node) & self.outputs.keys()):
+            return node.evaluate(self)
+        return self.memo.compute(self, node)
+
+    def release_children(self, node: ExprNode):
+        """node 的值没有经过计算就得到了（缓存命中），它对子节点的读取不会发生，相应的引用计数要扣掉。"""
+        for child in node.children:
+            if not child.children:
+                continue
+            self.refs[child.key] -= 1
+            if self.refs[child.key] > 0:
+                continue
+            if child.key in self.cache:
+                del self.cache[child.key]
+            else:
+                self.release_children(child)  # 子节点也不会再被计算了
+
+
+class PanelContext(EvalContext):
+    """
+    面板后端：列在第一次读取时展开成 (日期 × 标的) 二维数组，中间结果全程保持数组，
+    只在输出时还原成原来的双层索引序列。有面板实现的算子直接在数组上计算，
+    其余算子临时还原成序列调用。
+    """
+
+    def __init__(self, df: pd.DataFrame, refs: Counter, memo=None):
+        super(PanelContext, self).__init__(df, refs, memo)
+        self.panel = Panel.from_index(df.index)
+        self.arrays = {}
+
+    def column(self, name):
+        if name in self.arrays and name not in self.outputs:  # 已展开的列，或调用方直接给出的数组
+            return self.arrays[name]
+        value = super(PanelContext, self).column(name)
+        if type(value) is not pd.Series:
+            return value
+        if name not in self.arrays:
+            self.arrays[name] = self.panel.to_array(value)
+        return self.arrays[name]
 
-def expr_transform(df, expr):
-    # close/shift(close,5) -1
-    for col in df.columns:
-        expr = expr.replace(col, 'df["{}"]'.format(col))
-    return expr
+    def _is_panel(self, value):
+        return isinstance(value, np.ndarray) and value.shape == self.panel.shape
 
+    def _to_series(self, value):
+        return self.panel.to_series(value) if self._is_panel(value) else value
 
-def calc_expr(df: pd.DataFrame, expr: str):  # correlation(rank(open),rank(volume))
+    def call(self, func, args, kwargs):
+        panel_func = getattr(func, 'panel_func', None)
+        if panel_func is not None:
+            return self.panel.apply(panel_func, *args, **kwargs)
+        if isinstance(func, np.ufunc) or func in _ELEMENTWISE_FUNCS:
+            return func(*args, **kwargs)  # 逐元素的算子直接作用在数组上
+        # 其余算子（calc_by_symbol 包装的、decay_linear 这类没有面板实现的）一律还原成序列调用
+        args = [self._to_series(arg) for arg in args]
+        kwargs = {k: self._to_series(v) for k, v in kwargs.items()}
+        ret = func(*args, **kwargs)
+        if type(ret) is pd.Series or (isinstance(ret, np.ndarray) and ret.shape == (len(self.panel.index),)):
+            return self.panel.to_array(ret)
+        return ret
+
+    def evaluate_root(self, node: ExprNode):
+        with np.errstate(all='ignore'):
+            value = self.eval(node)
+        return self.panel.to_series(value) if self._is_panel(value) else value
+
+
+# 在宽面板数组上与在长表序列上结果相同的逐元素算子（另有全部 numpy ufunc），面板后端不必还原成序列
+_ELEMENTWISE_FUNCS = (np.where, greater, less, Sub, Add, Mul, Div)
+
+_CONTEXTS = {'pandas': EvalContext, 'panel': PanelContext}
+
+
+def _count_refs(roots, stop=()):
+    # 统计合并后的 DAG 里每个节点被读取的次数（父节点的边数 + 作为输出的次数）
+    # stop 中的节点结果已知，不再向下统计它们的子节点
+    refs = Counter(root.key for root in roots)
+    seen = set()
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        if node.key in seen:
+            continue
+        seen.add(node.key)
+        if node.key in stop:
+            continue
+        for child in node.children:
+            refs[child.key] += 1
+            stack.append(child)
+    return refs
+
+
+def _collect_columns(root: ExprNode):
+    columns = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Column):
+            columns.add(node.name)
+        stack.extend(node.children)
+    return frozenset(columns)
+
+
+# 周期参数取负时向未来取值的算子
+_SHIFT_OPS = frozenset(['ts_delay', 'ts_delta', 'ts_pct_change', 'shift', 'roc'])
+# 窗口参数之外自带固定回看的算子
+_EXTRA_LOOKBACK = {'cross_up': 1, 'cross_down': 1}
+# expr_functions 里窗口、周期参数的名字（ts_mean(se, d)、ts_std(se, periods=5)、shift(se, N)、decay_linear(series, window)）
+_WINDOW_PARAMS = ('d', 'N', 'periods', 'window')
+
+
+def required_history(exprs, names=None):
+    """
+    一组表达式合计需要的 (回看, 前视) bar 数。
+
+    names 给出时，按名字引用前面因子的表达式会把被引用因子的回看、前视累加进来。
+    """
+    known = {}
+    lookback = horizon = 0
+    for expr, name in zip(exprs, names or [None] * len(exprs)):
+        back, fwd = _history(compile_expr(expr).root, known)
+        if name:
+            known[name] = (back, fwd)
+        lookback, horizon = max(lookback, back), max(horizon, fwd)
+    return lookback, horizon
+
+
+def _history(node: ExprNode, known=None, memo=None):
+    memo = {} if memo is None else memo
+    if node.key in memo:
+        return memo[node.key]
+    if isinstance(node, Column):
+        result = (known or {}).get(node.name, (0, 0))
+    else:
+        back = fwd = 0
+        for child in node.children:
+            b, f = _history(child, known, memo)
+            back, fwd = max(back, b), max(fwd, f)
+        if isinstance(node, Call):
+            b, f = _own_history(node)
+            back, fwd = back + b, fwd + f
+        result = (back, fwd)
+    memo[node.key] = result
+    return result
+
+
+def _own_history(node: Call):
+    # 算子自身的 (回看, 前视)：窗口 w 的滚动算子回看 w-1 根，周期 p 的 shift 类算子回看 p 根（p < 0 时前视 -p 根）
+    if node.name in _EXTRA_LOOKBACK:
+        return _EXTRA_LOOKBACK[node.name], 0
+    window = _window_param(node)
+    if window is None:
+        return 0, 0
+    if node.name in _SHIFT_OPS:
+        return (window, 0) if window >= 0 else (0, -window)
+    return max(window - 1, 0), 0
+
+
+def _window_param(node: Call):
+    # 按签名绑定参数（含默认值），取名为窗口、周期的参数；没有这样的参数（rank、scale……）时为 None
+    try:
+        signature = inspect.signature(node.func)
+        bound = signature.bind(*node.args, **dict(node.kwargs))
+    except (TypeError, ValueError):
+        return None
+    for param in signature.parameters.values():
+        if param.name not in _WINDOW_PARAMS:
+            continue
+        value = bound.arguments.get(param.name, param.default)
+        if isinstance(value, UnaryOp) and value.symbol == '-' and isinstance(value.operand, Const):
+            value = -value.operand.value
+        elif isinstance(value, Const):
+            value = value.value
+        if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+            return int(value)
+    return None
+
+
+def _resolve_func(node: ast.AST):
+    # 支持 ts_mean(...) 以及 np.where(...) 这类带模块前缀的调用
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in globals():
+            return name, globals()[name]
+        import builtins
+        if hasattr(builtins, name):
+            return name, getattr(builtins, name)
+        raise NameError('未定义的算子: {}'.format(name))
+    elif isinstance(node, ast.Attribute):
+        owner_name, owner = _resolve_func(node.value)
+        name = '{}.{}'.format(owner_name, node.attr)
+        if not hasattr(owner, node.attr):
+            raise NameError('未定义的算子: {}'.format(name))
+        return name, getattr(owner, node.attr)
+    raise TypeError(f'Unsupported callee type: {type(node)}')
+
+
+# 所有编译过的节点按 key 驻留，相同子树在不同表达式之间也是同一个对象
+_NODES = weakref.WeakValueDictionary()
+
+
+def _intern(node: ExprNode) -> ExprNode:
+    return _NODES.setdefault(node.key, node)
+
+
+def _build(node: ast.AST) -> ExprNode:
+    return _intern(_build_node(node))
+
+
+def _build_node(node: ast.AST) -> ExprNode:
+    if isinstance(node, ast.BinOp):
+        symbol, func = _BIN_OPS[type(node.op)]
+        left, right = _build(node.left), _build(node.right)
+        if symbol in _COMMUTATIVE and right.key < left.key:
+            left, right = right, left
+        return BinOp(symbol, func, left, right)
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        symbol, func = _UNARY_OPS[type(node.op)]
+        return UnaryOp(symbol, func, _build(node.operand))
+    elif isinstance(node, ast.Compare):
+        # a < b < c 按 Python 语义展开为 (a < b) & (b < c)
+        left = _build(node.left)
+        result = None
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _build(comparator)
+            symbol, func = _CMP_OPS[type(op)]
+            cmp = _intern(BinOp(symbol, func, left, right))
+            result = cmp if result is None else _intern(BinOp('&', operator.and_, result, cmp))
+            left = right
+        return result
+    elif isinstance(node, ast.Call):
+        name, func = _resolve_func(node.func)
+        args = tuple(_build(arg) for arg in node.args)
+        kwargs = tuple((kw.arg, _build(kw.value)) for kw in node.keywords)
+        return Call(name, func, args, kwargs)
+    elif isinstance(node, ast.Name):
+        return Column(node.id)
+    elif isinstance(node, ast.Constant):
+        return Const(node.value)
+    elif isinstance(node, ast.Attribute):
+        _, value = _resolve_func(node)
+        return Const(value)
+    raise TypeError(f'Unsupported AST node type: {type(node)}')
+
+
+@lru_cache(maxsize=4096)
+def compile_expr(expr: str) -> ExprPlan:
+    """把表达式文本编译为 ExprPlan，按文本缓存，重复调用不再重新解析。"""
+    root = _build(ast.parse(expr.strip(), mode='eval').body)
+    return ExprPlan(expr, root)
+
+
+def calc_expr(df: pd.DataFrame, expr: str, backend='pandas', memo=None):  # correlation(rank(open),rank(volume))
     # 列若存在，就直接返回
     if expr in list(df.columns):
         return df[expr]
 
-    expr = expr_transform(df, expr)
+    return compile_expr(expr).evaluate(df, backend, memo)
 
-    # try:
-    se = eval(expr)
-    return se
-    # except:
-    # import traceback
-    # traceback.print_exc()
-    # raise NameError('{}——eval异常'.format(expr))
-    # shift(close,1) -> shift(df['close'],1)
-    return None
+
+def iter_exprs(df: pd.DataFrame, exprs, names=None, backend='pandas', memo=None, arrays=None):
+    """
+    把一组表达式合并成一个 DAG 后逐个求值，相同子树只计算一次。
+
+    names 给出时，后面的表达式可以按名字引用前面表达式的结果。
+    结果按 exprs 的顺序逐个产出。backend='panel' 时在宽面板数组上求值。
+    memo 为 SubexprMemo 时，与之前的调用共享的子树直接从内存里取。
+    arrays 只用于面板后端：列名到已按 df.index 展开好的 (日期 × 标的) 数组（如 PanelStore 映射的数组），
+    这些列不必出现在 df 里。
+    """
+    names = names or [None] * len(exprs)
+    roots = {}
+    for expr in exprs:
+        if expr not in df.columns:
+            roots[expr] = compile_expr(expr).root
+    ctx = _CONTEXTS[backend](df, _count_refs([roots[expr] for expr in exprs if expr in roots]), memo)
+    if arrays:
+        ctx.arrays.update(arrays)
+    # 只留下会被后面的表达式按名字引用的结果，其余产出后由调用方决定是否保留
+    referenced = set().union(*(compile_expr(expr).columns for expr in roots))
+    for expr, name in zip(exprs, names):
+        se = df[expr] if expr not in roots else ctx.evaluate_root(roots[expr])
+        if name and name in referenced:
+            ctx.outputs[name] = se
+        yield se
+
+
+def calc_exprs(df: pd.DataFrame, exprs, names=None, backend='pandas', memo=None, arrays=None):
+    return list(iter_exprs(df, exprs, names, backend, memo, arrays))
+
+
+def _as_values(se, index):
+    if isinstance(se, pd.Series) and not se.index.equals(index):
+        se = se.reindex(index)
+    return np.broadcast_to(np.asarray(se, dtype=np.float64), (len(index),))
+
+
+def _split_fields(df, fields, names):
+    # 引用了其他因子名字的字段（如 rank(roc_2)）依赖前面的结果，单独挑出来
+    name_set = set(names)
+    independent, dependent = [], []
+    for pos, field in enumerate(fields):
+        deps = compile_expr(field).columns & name_set if field not in df.columns else ()
+        (dependent if deps else independent).append(pos)
+    return independent, dependent
+
+
+def _calc_dependent(df, fields, names, results, independent, dependent, backend):
+    computed = {names[pos]: results[pos] for pos in independent}
+    df_all = pd.concat([df, pd.DataFrame(computed, index=df.index)], axis=1) if computed else df
+    for pos, se in zip(dependent, iter_exprs(df_all, [fields[p] for p in dependent],
+                                             [names[p] for p in dependent], backend)):
+        results[pos] = se
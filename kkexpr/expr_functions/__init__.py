@@ -35,7 +35,7 @@ def list_funcs(mod):
     for name, func in name_funcs.items():
         if name[0] == '_':
             continue
-        if name in ['calc_by_date', 'calc_by_symbol', 'wraps']:
+        if name in ['calc_by_date', 'calc_by_symbol', 'calc_panel_by_date', 'calc_panel_by_symbol', 'wraps']:
             continue
 
         funcs.append(name)
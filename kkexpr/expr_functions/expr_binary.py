@@ -3,6 +3,14 @@ import pandas as pd
 from kkexpr.expr_functions.expr_utils import calc_by_symbol
 
 
+def greater(left, right):
+    return np.maximum(left, right)
+
+
+def less(left, right):
+    return np.minimum(left, right)
+
+
 @calc_by_symbol
 def cross_up(left, right):
     left = pd.Series(left)
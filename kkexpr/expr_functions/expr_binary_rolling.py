@@ -1,21 +1,13 @@
-import numpy as np
-import pandas as pd
-from .expr_utils import calc_by_symbol
+from kkexpr import kernels
+from .expr_utils import calc_panel_by_symbol
 
 
-@calc_by_symbol
-def ts_corr(left: pd.Series, right: pd.Series, periods=20):
-    res = left.rolling(window=periods).corr(right)
-    # left.rolling(window=periods).apply(func=func,right)
-    res.loc[
-        np.isclose(left.rolling(periods, min_periods=1).std(), 0, atol=2e-05)
-        | np.isclose(right.rolling(periods, min_periods=1).std(), 0, atol=2e-05)
-        ] = np.nan
-    return res
+@calc_panel_by_symbol
+def ts_corr(left, right, periods=20):
+    # 任一序列窗口内近似为常数（标准差 <= 2e-5）时相关系数无意义，置为 NaN
+    return kernels.rolling_corr_cov(left, right, periods)[0]
 
 
-@calc_by_symbol
-def ts_cov(left: pd.Series, right: pd.Series, periods=10):
-    res = left.rolling(window=periods).cov(right)
-    return res
-
+@calc_panel_by_symbol
+def ts_cov(left, right, periods=10):
+    return kernels.rolling_corr_cov(left, right, periods)[1]
@@ -1,7 +1,8 @@
 # 在因子表达式里用，但GA里暂时不用的算子函数
 import numpy as np
 import pandas as pd
-from kkexpr.expr_functions.expr_utils import calc_by_symbol
+from kkexpr import kernels
+from kkexpr.expr_functions.expr_utils import calc_by_symbol, calc_panel_by_symbol
 
 
 @calc_by_symbol
@@ -33,31 +34,10 @@ def scale(x, a=1):
     return x * scale_factor  # 应用缩放因子
 
 
-@calc_by_symbol
+@calc_panel_by_symbol
 def slope_pair(se_left, se_right, N=18):
-    slopes = []
-    R2 = []
-    # 计算斜率值
-    for i in range(len(se_left)):
-        if i < (N - 1):
-            slopes.append(np.nan)
-            R2.append(np.nan)
-        else:
-            x = se_right[i - N + 1:i + 1]
-            y = se_left[i - N + 1:i + 1]
-            slope, intercept = np.polyfit(x, y, 1)
-
-            # lr = LinearRegression().fit(np.array(x).reshape(-1, 1), y)
-            ## y_pred = lr.predict(x.reshape(-1, 1))
-            # beta = lr.coef_[0]
-            # r2 = r2_score(y, y_pred)
-            if slope is np.nan:
-                print(slope)
-            slopes.append(slope)
-            # R2.append(r2)
-    slopes = pd.Series(slopes)
-    slopes.index = se_left.index
-    return slopes
+    # se_left 对 se_right 的滚动回归斜率
+    return kernels.rolling_ols(se_left, se_right, N)[0]
 
 
 def decay_linear(series, window):
@@ -73,29 +53,12 @@ def decay_linear(series, window):
     return decay
 
 
-@calc_by_symbol
-def zscore(se: pd.Series, N):
-    def _zscore(x):
-
-        try:
-            x.dropna(inplace=True)
-            # print('sub', x)
-            value = (x[-1] - x.mean()) / x.std()
-            if value:
-                return value
-        except:
-            return -1
-
-    # print(se)
-    ret = se.rolling(window=N).apply(lambda x: _zscore(x))
-    return ret
+@calc_panel_by_symbol
+def shift(se, N):
+    return kernels.shift(se, N)
 
-@calc_by_symbol
-def shift(se: pd.Series, N):
-    return se.shift(N)
-
-@calc_by_symbol
-def roc(se: pd.Series, N):
-    return se / shift(se, N) - 1
+@calc_panel_by_symbol
+def roc(se, N):
+    return kernels.pct_change(se, N)
 
 
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
-from kkexpr.expr_functions.expr_utils import calc_by_date, calc_by_symbol
+from kkexpr import kernels
+from kkexpr.expr_functions.expr_utils import calc_by_symbol, calc_panel_by_date
 
 
 @calc_by_symbol
@@ -25,7 +26,6 @@ def inv(x: pd.Series):
         return pd.Series(se, index=x.index)
 
 
-@calc_by_date
-def rank(se: pd.Series):
-    ret = se.rank(pct=True)
-    return ret
+@calc_panel_by_date
+def rank(se):
+    return kernels.rank_pct(se)
@@ -1,88 +1,114 @@
 import numpy as np
-import pandas as pd
-from kkexpr.expr_functions.expr_utils import calc_by_symbol
+from kkexpr import kernels
+from kkexpr.expr_functions.expr_utils import calc_panel_by_symbol
 
-@calc_by_symbol
-def ts_delay(se: pd.Series, periods=5):  # 滞后N天的序列
-    return se.shift(periods=periods)
+@calc_panel_by_symbol
+def ts_delay(se, periods=5):  # 滞后N天的序列
+    return kernels.shift(se, periods)
 
 
-@calc_by_symbol
-def ts_delta(se: pd.Series, periods=20):  # 当前序列与滞后N天之差
-    se_result = se - se.shift(periods=periods)
-    return se_result
+@calc_panel_by_symbol
+def ts_delta(se, periods=20):  # 当前序列与滞后N天之差
+    return kernels.delta(se, periods)
 
 
-@calc_by_symbol
-def ts_mean(se: pd.Series, d):
-    return se.rolling(window=d).mean()
+@calc_panel_by_symbol
+def ts_mean(se, d):
+    return kernels.rolling_mean(se, d)
 
 
-@calc_by_symbol
-def ts_median(se: pd.Series, d):
-    return se.rolling(window=d).median()
+@calc_panel_by_symbol
+def ts_median(se, d):
+    return kernels.rolling_median(se, d)
 
 
-@calc_by_symbol
-def ts_pct_change(se: pd.Series, N):
-    return se / se.shift(N) - 1
+@calc_panel_by_symbol
+def ts_quantile(se, d, q=0.5):
+    return kernels.rolling_quantile(se, d, q)
 
 
-@calc_by_symbol
-def ts_max(se: pd.Series, periods=5):
-    return se.rolling(window=periods).max()
+@calc_panel_by_symbol
+def ts_pct_change(se, N):
+    return kernels.pct_change(se, N)
 
 
-@calc_by_symbol
-def ts_min(se: pd.Series, periods=5):
-    return se.rolling(window=periods).min()
+@calc_panel_by_symbol
+def ts_max(se, periods=5):
+    return kernels.rolling_max(se, periods)
 
 
-@calc_by_symbol
+@calc_panel_by_symbol
+def ts_min(se, periods=5):
+    return kernels.rolling_min(se, periods)
+
+
+@calc_panel_by_symbol
 def ts_maxmin(X, d):
-    return (X - ts_min(X, d)) / (ts_max(X, d) - ts_min(X, d))
+    max_values, min_values = kernels.rolling_max_min(X, d)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (X - min_values) / (max_values - min_values)
 
 
-@calc_by_symbol
-def ts_sum(se: pd.Series, N):
-    ret = se.rolling(N).sum()
-    return ret
+@calc_panel_by_symbol
+def ts_sum(se, N):
+    return kernels.rolling_sum(se, N)
 
 
-@calc_by_symbol
+@calc_panel_by_symbol
 def ts_std(se, periods=5):
-    return se.rolling(window=periods).std()
+    return kernels.rolling_std(se, periods)
+
+
+@calc_panel_by_symbol
+def zscore(se, N, min_periods=None):
+    # 窗口有效值不足 min_periods（默认 N）或窗口标准差为 0 时为 NaN
+    return kernels.rolling_zscore(se, N, min_periods)
+
+
+@calc_panel_by_symbol
+def ts_slope(se, d):  # 对时间序号做滚动回归的斜率
+    return kernels.rolling_ols(se, window=d)[0]
+
+
+@calc_panel_by_symbol
+def ts_rsquare(se, d):
+    return kernels.rolling_ols(se, window=d)[2]
+
+
+@calc_panel_by_symbol
+def ts_resi(se, d):  # 回归在窗口最后一根 bar 上的残差
+    return kernels.rolling_ols(se, window=d)[3]
 
 
-@calc_by_symbol
+@calc_panel_by_symbol
 def ts_skew(X, d):
-    return X.rolling(window=d).skew()
+    return kernels.rolling_skew(X, d)
 
 
-@calc_by_symbol
+@calc_panel_by_symbol
 def ts_kurt(X, d):
-    return X.rolling(window=d).kurt()
+    return kernels.rolling_kurt(X, d)
 
 #
-@calc_by_symbol
-def ts_argmin(se: pd.Series, periods=5):
-    return se.rolling(periods, min_periods=1).apply(lambda x: x.argmin())
+@calc_panel_by_symbol
+def ts_argmin(se, periods=5):
+    return kernels.rolling_argmin(se, periods)
 
 
-@calc_by_symbol
-def ts_argmax(se: pd.Series, periods=5):
-    return se.rolling(periods, min_periods=1).apply(lambda x: x.argmax())
+@calc_panel_by_symbol
+def ts_argmax(se, periods=5):
+    return kernels.rolling_argmax(se, periods)
 
 
-@calc_by_symbol
+@calc_panel_by_symbol
 def ts_argmaxmin(X, d):
-    return ts_argmax(X, d) - ts_argmin(X, d)
+    argmax, argmin = kernels.rolling_argmax_argmin(X, d)
+    return argmax - argmin
 
 
-@calc_by_symbol
-def ts_rank(se: pd.Series, periods=9):
-    ret = se.rolling(window=periods).rank(pct=True)
-    return ret
+@calc_panel_by_symbol
+def ts_rank(se, periods=9):
+    return kernels.rolling_rank(se, periods)
 
 # @calc_by_symbol
 # def ts_product(se: pd.Series, d):
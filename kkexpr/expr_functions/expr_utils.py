@@ -1,5 +1,6 @@
 from functools import wraps
 import pandas as pd
+from kkexpr.panel import Panel
 
 
 def calc_by_date(func):
@@ -27,6 +28,7 @@ def calc_by_date(func):
             print('len(args)==0',func)
         return ret
 
+    wrapper.calc_by = 'date'
     return wrapper
 
 
@@ -76,4 +78,43 @@ def calc_by_symbol(func):
             return None
         return ret
 
+    wrapper.calc_by = 'symbol'
     return wrapper
+
+
+
+def _align(se: pd.Series, index):
+    if se.index is index or se.index.equals(index):
+        return se
+    return se.reindex(index)
+
+
+def _calc_by_panel(func, axis):
+    # func 接收 (日期 × 标的) 二维数组；序列参数先展开成面板，算完再还原为原索引的序列
+    func.panel_axis = axis
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        se_args = [arg for arg in args if type(arg) is pd.Series]
+        if not se_args:
+            return func(*args, **kwargs)
+        panel = Panel.from_index(se_args[0].index)
+        args = [panel.to_array(_align(arg, panel.index)) if type(arg) is pd.Series else arg for arg in args]
+        ret = panel.apply(func, *args, **kwargs)
+        if isinstance(ret, tuple):
+            return tuple(panel.to_series(r) for r in ret)
+        return panel.to_series(ret)
+
+    wrapper.panel_func = func
+    wrapper.panel_axis = axis
+    return wrapper
+
+
+def calc_panel_by_symbol(func):
+    """时间序列算子，按标的沿时间轴在整个面板上一次计算。"""
+    return _calc_by_panel(func, 'symbol')
+
+
+def calc_panel_by_date(func):
+    """截面算子，按日期在整个面板上一次计算。"""
+    return _calc_by_panel(func, 'date')
@@ -49,14 +49,20 @@ class Alpha158(AlphaBase):
         fields += ["shift(close, %d)/close" % d for d in windows]
         names += ["ROC%d" % d for d in windows]
 
-        fields += ["mean(close, %d)/close" % d for d in windows]
+        fields += ["ts_mean(close, %d)/close" % d for d in windows]
         names += ["MA%d" % d for d in windows]
 
-        fields += ["std(close, %d)/close" % d for d in windows]
+        fields += ["ts_std(close, %d)/close" % d for d in windows]
         names += ["STD%d" % d for d in windows]
 
-        #fields += ["slope(close, %d)/close" % d for d in windows]
-        #names += ["BETA%d" % d for d in windows]
+        fields += ["ts_slope(close, %d)/close" % d for d in windows]
+        names += ["BETA%d" % d for d in windows]
+
+        fields += ["ts_rsquare(close, %d)" % d for d in windows]
+        names += ["RSQR%d" % d for d in windows]
+
+        fields += ["ts_resi(close, %d)/close" % d for d in windows]
+        names += ["RESI%d" % d for d in windows]
 
         fields += ["ts_max(high, %d)/close" % d for d in windows]
         names += ["MAX%d" % d for d in windows]
@@ -64,14 +70,14 @@ class Alpha158(AlphaBase):
         fields += ["ts_min(low, %d)/close" % d for d in windows]
         names += ["MIN%d" % d for d in windows]
 
-        fields += ["quantile(close, %d, 0.8)/close" % d for d in windows]
+        fields += ["ts_quantile(close, %d, 0.8)/close" % d for d in windows]
         names += ["QTLU%d" % d for d in windows]
 
-        fields += ["quantile(close, %d, 0.2)/close" % d for d in windows]
+        fields += ["ts_quantile(close, %d, 0.2)/close" % d for d in windows]
         names += ["QTLD%d" % d for d in windows]
 
-        #fields += ["ts_rank(close, %d)" % d for d in windows]
-        #names += ["RANK%d" % d for d in windows]
+        fields += ["ts_rank(close, %d)" % d for d in windows]
+        names += ["RANK%d" % d for d in windows]
 
         fields += ["(close-ts_min(low, %d))/(ts_max(high, %d)-ts_min(low, %d)+1e-12)" % (d, d, d) for d in windows]
         names += ["RSV%d" % d for d in windows]
@@ -85,70 +91,70 @@ class Alpha158(AlphaBase):
         fields += ["(ts_argmax(high, %d)-ts_argmin(low, %d))/%d" % (d, d, d) for d in windows]
         names += ["IMXD%d" % d for d in windows]
 
-        fields += ["correlation(close, log(volume+1), %d)" % d for d in windows]
+        fields += ["ts_corr(close, log(volume+1), %d)" % d for d in windows]
         names += ["CORR%d" % d for d in windows]
 
-        fields += ["correlation(close/shift(close,1), log(volume/shift(volume, 1)+1), %d)" % d for d in windows]
+        fields += ["ts_corr(close/shift(close,1), log(volume/shift(volume, 1)+1), %d)" % d for d in windows]
         names += ["CORD%d" % d for d in windows]
 
-        fields += ["mean(close>shift(close, 1), %d)" % d for d in windows]
+        fields += ["ts_mean(close>shift(close, 1), %d)" % d for d in windows]
         names += ["CNTP%d" % d for d in windows]
 
-        fields += ["mean(close<shift(close, 1), %d)" % d for d in windows]
+        fields += ["ts_mean(close<shift(close, 1), %d)" % d for d in windows]
         names += ["CNTN%d" % d for d in windows]
 
-        fields += ["mean(close>shift(close, 1), %d)-mean(close<shift(close, 1), %d)" % (d, d) for d in windows]
+        fields += ["ts_mean(close>shift(close, 1), %d)-ts_mean(close<shift(close, 1), %d)" % (d, d) for d in windows]
         names += ["CNTD%d" % d for d in windows]
 
         fields += [
-            "sum(greater(close-shift(close, 1), 0), %d)/(sum(abs(close-shift(close, 1)), %d)+1e-12)" % (d, d)
+            "ts_sum(greater(close-shift(close, 1), 0), %d)/(ts_sum(abs(close-shift(close, 1)), %d)+1e-12)" % (d, d)
             for d in windows
         ]
         names += ["SUMP%d" % d for d in windows]
 
         fields += [
-            "sum(greater(shift(close, 1)-close, 0), %d)/(sum(abs(close-shift(close, 1)), %d)+1e-12)" % (d, d)
+            "ts_sum(greater(shift(close, 1)-close, 0), %d)/(ts_sum(abs(close-shift(close, 1)), %d)+1e-12)" % (d, d)
             for d in windows
         ]
         names += ["SUMN%d" % d for d in windows]
 
         fields += [
-            "(sum(greater(close-shift(close, 1), 0), %d)-sum(greater(shift(close, 1)-close, 0), %d))"
-            "/(sum(abs(close-shift(close, 1)), %d)+1e-12)" % (d, d, d)
+            "(ts_sum(greater(close-shift(close, 1), 0), %d)-ts_sum(greater(shift(close, 1)-close, 0), %d))"
+            "/(ts_sum(abs(close-shift(close, 1)), %d)+1e-12)" % (d, d, d)
             for d in windows
         ]
         names += ["SUMD%d" % d for d in windows]
 
-        fields += ["mean(volume, %d)/(volume+1e-12)" % d for d in windows]
+        fields += ["ts_mean(volume, %d)/(volume+1e-12)" % d for d in windows]
         names += ["VMA%d" % d for d in windows]
 
-        fields += ["std(volume, %d)/(volume+1e-12)" % d for d in windows]
+        fields += ["ts_std(volume, %d)/(volume+1e-12)" % d for d in windows]
         names += ["VSTD%d" % d for d in windows]
 
         fields += [
-            "std(abs(close/shift(close, 1)-1)*volume, %d)/(mean(abs(close/shift(close, 1)-1)*volume, %d)+1e-12)"
+            "ts_std(abs(close/shift(close, 1)-1)*volume, %d)/(ts_mean(abs(close/shift(close, 1)-1)*volume, %d)+1e-12)"
             % (d, d)
             for d in windows
         ]
         names += ["WVMA%d" % d for d in windows]
 
         fields += [
-            "sum(greater(volume-shift(volume, 1), 0), %d)/(sum(abs(volume-shift(volume, 1)), %d)+1e-12)"
+            "ts_sum(greater(volume-shift(volume, 1), 0), %d)/(ts_sum(abs(volume-shift(volume, 1)), %d)+1e-12)"
             % (d, d)
             for d in windows
         ]
         names += ["VSUMP%d" % d for d in windows]
 
         fields += [
-            "sum(greater(shift(volume, 1)-volume, 0), %d)/(sum(abs(volume-shift(volume, 1)), %d)+1e-12)"
+            "ts_sum(greater(shift(volume, 1)-volume, 0), %d)/(ts_sum(abs(volume-shift(volume, 1)), %d)+1e-12)"
             % (d, d)
             for d in windows
         ]
         names += ["VSUMN%d" % d for d in windows]
 
         fields += [
-            "(sum(greater(volume-shift(volume, 1), 0), %d)-sum(greater(shift(volume, 1)-volume, 0), %d))"
-            "/(sum(abs(volume-shift(volume, 1)), %d)+1e-12)" % (d, d, d)
+            "(ts_sum(greater(volume-shift(volume, 1), 0), %d)-ts_sum(greater(shift(volume, 1)-volume, 0), %d))"
+            "/(ts_sum(abs(volume-shift(volume, 1)), %d)+1e-12)" % (d, d, d)
             for d in windows
         ]
         names += ["VSUMD%d" % d for d in windows]
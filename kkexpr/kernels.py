@@ -0,0 +1,424 @@
+"""
+面板算子内核。
+
+输入输出都是 (日期 × 标的) 的二维 float 数组，时间序列算子沿 axis=0 计算，
+一次调用处理全部标的。窗口语义与 pandas 的 rolling(window) 一致：
+窗口内不足 window 个有效值时结果为 NaN。
+float32 的输入也先转成 float64 再计算，前缀和的相消误差在 float32 下不可接受；
+结果由 Panel.apply 按精度策略转回（见 kkexpr.dtypes）。
+"""
+import math
+import os
+
+import numpy as np
+
+
+def _as_float(x):
+    return np.asarray(x, dtype=np.float64)
+
+
+def _window_diff(csum, window):
+    # 由前缀和得到长度为 window 的窗口和
+    out = csum.copy()
+    out[window:] -= csum[:-window]
+    return out
+
+
+# 前缀和每隔这么多行重新锚定：每段先减去本段的均值再累加，误差只随段长增长，与序列总长无关
+_BLOCK = 1024
+
+
+def _blocks(length, window):
+    """把行切成段，产出 (lo, start, end)：结果行 [start, end) 的窗口只用到 [lo, end) 的数据。"""
+    block = max(_BLOCK, window)
+    for start in range(0, length, block):
+        yield max(start - window + 1, 0), start, min(start + block, length)
+
+
+def _segment_offset(x, valid):
+    # 段内有效值的均值，全为 NaN 的列取 0
+    return np.where(valid, x, 0.0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+
+
+def rolling_moments(x, window, order=2):
+    """
+    返回窗口内的有效值个数、1 到 order 阶的幂和，以及中心化用的偏移：(count, s1, ..., s_order, offset)。
+
+    幂和是减去偏移之后的，offset 与 x 形状相同。前缀和按 _BLOCK 行分段，每段先减去本段的均值，
+    避免长序列（尤其是有趋势的序列）上 sum(x^2) - sum(x)^2/n 的相消误差。
+    """
+    x = _as_float(x)
+    valid = ~np.isnan(x)
+    count = _window_diff(np.cumsum(valid, axis=0, dtype=np.int64), window)
+    sums = [np.empty_like(x) for _ in range(order)]
+    offset = np.empty_like(x)
+    for lo, start, end in _blocks(len(x), window):
+        seg, ok = x[lo:end], valid[lo:end]
+        off = _segment_offset(seg, ok)
+        centered = np.where(ok, seg - off, 0.0)
+        power = centered
+        for k in range(order):
+            if k:
+                power = power * centered
+            sums[k][start:end] = _window_diff(np.cumsum(power, axis=0), window)[start - lo:]
+        offset[start:end] = off
+    return (count, *sums, offset)
+
+
+def _full(count, window):
+    full = count >= window
+    full[:window - 1] = False
+    return full
+
+
+def rolling_sum(x, window):
+    count, s1, _, offset = rolling_moments(x, window)
+    return np.where(_full(count, window), s1 + window * offset, np.nan)
+
+
+def rolling_mean(x, window):
+    count, s1, _, offset = rolling_moments(x, window)
+    return np.where(_full(count, window), s1 / window + offset, np.nan)
+
+
+def rolling_var(x, window, ddof=1):
+    count, s1, s2, _ = rolling_moments(x, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (s2 - s1 * s1 / window) / (window - ddof)
+    var = np.maximum(var, 0.0)
+    return np.where(_full(count, window) & (window > ddof), var, np.nan)
+
+
+def rolling_std(x, window, ddof=1):
+    return np.sqrt(rolling_var(x, window, ddof))
+
+
+def _moment_result(x, window, count, var, value, uniform, min_window):
+    # 与 pandas 一致：窗口内全是同一个值时取 uniform（偏度 0、峰度 -3），方差不超过 1e-14 时为 NaN
+    if window < min_window:
+        return np.full(np.shape(value), np.nan)
+    max_values, min_values = rolling_max_min(x, window)
+    value = np.where(var <= 1e-14, np.nan, value)
+    value = np.where(max_values == min_values, uniform, value)
+    return np.where(_full(count, window), value, np.nan)
+
+
+def rolling_skew(x, window):
+    """窗口偏度（无偏修正），与 rolling(window).skew() 一致，由 1~3 阶幂和的前缀和一次算出。"""
+    count, s1, s2, s3, _ = rolling_moments(x, window, 3)
+    n = float(window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = s1 / n
+        b = s2 / n - a * a
+        c = s3 / n - 3 * a * s2 / n + 2 * a ** 3
+        value = np.sqrt(n * (n - 1)) / (n - 2) * c / b ** 1.5
+    return _moment_result(x, window, count, b, value, 0.0, 3)
+
+
+def rolling_kurt(x, window):
+    """窗口超额峰度（无偏修正），与 rolling(window).kurt() 一致，由 1~4 阶幂和的前缀和一次算出。"""
+    count, s1, s2, s3, s4, _ = rolling_moments(x, window, 4)
+    n = float(window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = s1 / n
+        b = s2 / n - a * a
+        d = s4 / n - 4 * a * s3 / n + 6 * a * a * s2 / n - 3 * a ** 4
+        value = ((n * n - 1) * d / (b * b) - 3 * (n - 1) ** 2) / ((n - 2) * (n - 3))
+    return _moment_result(x, window, count, b, value, -3.0, 4)
+
+
+def shift(x, periods):
+    x = _as_float(x)
+    out = np.full_like(x, np.nan)
+    if periods == 0:
+        out[:] = x
+    elif periods > 0:
+        out[periods:] = x[:-periods]
+    else:
+        out[:periods] = x[-periods:]
+    return out
+
+
+def delta(x, periods):
+    return _as_float(x) - shift(x, periods)
+
+
+def pct_change(x, periods):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _as_float(x) / shift(x, periods) - 1
+
+
+def rank_pct(x):
+    """
+    截面百分比排名，沿 axis=1 对每一行排名，一次排序处理全部日期。
+
+    与 pandas 的 rank(pct=True) 一致：并列取平均名次，NaN 不参与排名且结果为 NaN，
+    百分比的分母是该行的有效值个数。
+    """
+    x = _as_float(x)
+    valid = ~np.isnan(x)
+    n = x.shape[1]
+    order = np.argsort(x, axis=1, kind='stable')  # NaN 排在最后
+    sorted_x = np.take_along_axis(x, order, axis=1)
+    pos = np.broadcast_to(np.arange(n), x.shape)
+    # 并列组的起点与终点：起点处值与前一个不同，终点处值与后一个不同
+    new_group = np.ones(x.shape, dtype=bool)
+    new_group[:, 1:] = sorted_x[:, 1:] != sorted_x[:, :-1]
+    end_group = np.ones(x.shape, dtype=bool)
+    end_group[:, :-1] = new_group[:, 1:]
+    start = np.maximum.accumulate(np.where(new_group, pos, 0), axis=1)
+    end = np.minimum.accumulate(np.where(end_group, pos, n - 1)[:, ::-1], axis=1)[:, ::-1]
+    ranks = np.empty(x.shape)
+    np.put_along_axis(ranks, order, (start + end) / 2.0 + 1.0, axis=1)
+    count = valid.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid, ranks / count, np.nan)
+
+
+def _rolling_max_index(x, window):
+    """
+    van Herk / Gil-Werman 滑动最大值：把序列按 window 切块，块内前缀最大与后缀最大
+    各用一次 accumulate 求出，任一窗口都由相邻两块的后缀与前缀拼成，
+    每个元素摊还 O(1)，与窗口长度无关。
+
+    返回窗口最大值（窗口内全为 NaN 时为 -inf）以及它在序列中的位置，
+    并列时取最早出现的位置。前 window-1 个窗口是从 0 开始的不完整窗口。
+    """
+    x = _as_float(x)
+    x = np.where(np.isnan(x), -np.inf, x)
+    length = len(x)
+    n_blocks = -(-length // window)
+    padded = np.full((n_blocks * window,) + x.shape[1:], -np.inf)
+    padded[:length] = x
+    blocks = padded.reshape((n_blocks, window) + x.shape[1:])
+    pos = np.arange(n_blocks * window).reshape((n_blocks, window) + (1,) * (x.ndim - 1))
+    pos = np.broadcast_to(pos, blocks.shape)
+
+    # 块内前缀：只有严格变大时才更新位置，保证并列取最早
+    prefix = np.maximum.accumulate(blocks, axis=1)
+    rises = np.ones(blocks.shape, dtype=bool)
+    rises[:, 1:] = blocks[:, 1:] > prefix[:, :-1]
+    prefix_idx = np.maximum.accumulate(np.where(rises, pos, 0), axis=1)
+
+    # 块内后缀：从后往前，不小于后面的最大值就更新位置
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1]
+    leads = np.ones(blocks.shape, dtype=bool)
+    leads[:, :-1] = blocks[:, :-1] >= suffix[:, 1:]
+    big = n_blocks * window
+    suffix_idx = np.minimum.accumulate(np.where(leads, pos, big)[:, ::-1], axis=1)[:, ::-1]
+
+    shape = (n_blocks * window,) + x.shape[1:]
+    prefix, prefix_idx = prefix.reshape(shape)[:length], prefix_idx.reshape(shape)[:length]
+    suffix, suffix_idx = suffix.reshape(shape)[:length], suffix_idx.reshape(shape)[:length]
+
+    values, index = prefix.copy(), prefix_idx.copy()
+    if length < window:
+        return values, index
+    head = suffix[:length - window + 1]
+    tail = prefix[window - 1:]
+    take_head = head >= tail
+    values[window - 1:] = np.where(take_head, head, tail)
+    index[window - 1:] = np.where(take_head, suffix_idx[:length - window + 1], prefix_idx[window - 1:])
+    return values, index
+
+
+def _rolling_count(x, window):
+    return _window_diff(np.cumsum(~np.isnan(x), axis=0, dtype=np.int64), window)
+
+
+def _window_start(length, window, ndim):
+    start = np.maximum(np.arange(length) - window + 1, 0)
+    return start.reshape((length,) + (1,) * (ndim - 1))
+
+
+def _max_with_min(x, window):
+    # 把 x 和 -x 拼在一起做一遍，同时得到最大值和最小值
+    x = _as_float(x)
+    if x.ndim == 1:
+        x = x[:, None]
+    n = x.shape[1]
+    values, index = _rolling_max_index(np.concatenate([x, -x], axis=1), window)
+    return values[:, :n], index[:, :n], -values[:, n:], index[:, n:]
+
+
+def rolling_max(x, window):
+    x = _as_float(x)
+    values, _ = _rolling_max_index(x, window)
+    return np.where(_full(_rolling_count(x, window), window), values, np.nan)
+
+
+def rolling_min(x, window):
+    return -rolling_max(-_as_float(x), window)
+
+
+def rolling_max_min(x, window):
+    """一遍同时算出窗口最大值与最小值，窗口不满或含 NaN 时为 NaN。"""
+    x = _as_float(x)
+    max_values, _, min_values, _ = _max_with_min(x, window)
+    full = _full(_rolling_count(x, window), window).reshape(max_values.shape)
+    return (np.where(full, max_values, np.nan).reshape(x.shape),
+            np.where(full, min_values, np.nan).reshape(x.shape))
+
+
+def _relative_index(x, window, index):
+    # 相对窗口起点的位置；min_periods=1，窗口内全为 NaN 时为 NaN
+    valid = _rolling_count(x, window) > 0
+    rel = index - _window_start(len(x), window, index.ndim)
+    return np.where(valid, rel, np.nan)
+
+
+def rolling_argmax(x, window):
+    x = _as_float(x)
+    _, index = _rolling_max_index(x, window)
+    return _relative_index(x, window, index)
+
+
+def rolling_argmin(x, window):
+    return rolling_argmax(-_as_float(x), window)
+
+
+def rolling_argmax_argmin(x, window):
+    """一遍同时算出窗口内最大值、最小值的位置。"""
+    x = _as_float(x)
+    _, max_index, _, min_index = _max_with_min(x, window)
+    x2 = x.reshape(max_index.shape)
+    return (_relative_index(x2, window, max_index).reshape(x.shape),
+            _relative_index(x2, window, min_index).reshape(x.shape))
+
+
+def rolling_zscore(x, window, min_periods=None):
+    """
+    滚动 z-score：(x_t - 窗口均值) / 窗口标准差(ddof=1)，由窗口和、平方和闭式求得。
+
+    NaN 策略：窗口内有效值少于 min_periods（默认等于 window）时为 NaN，
+    当前值为 NaN 时为 NaN，窗口标准差为 0（常数窗口）时为 NaN。
+    """
+    x = _as_float(x)
+    min_periods = window if min_periods is None else max(int(min_periods), 2)
+    count, s1, s2, offset = rolling_moments(x, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = s1 / count
+        ss = s2 - s1 * mean
+        # 中心化后的平方和相对自身几乎为 0，视为常数窗口
+        degenerate = ss <= 1e-12 * s2
+        std = np.sqrt(np.maximum(ss, 0.0) / (count - 1))
+        z = (x - offset - mean) / std
+    ok = (count >= min_periods) & ~degenerate
+    ok[:min_periods - 1] = False
+    return np.where(ok, z, np.nan)
+
+
+def rolling_comoments(x, y, window):
+    """
+    两个序列成对有效时的窗口一阶、二阶矩（与 rolling_moments 一样分段中心化）。
+
+    返回 count, sx, sy, sxx, syy, sxy, (ox, oy)，其中 ox、oy 是中心化用的偏移量，与输入形状相同。
+    """
+    x, y = np.broadcast_arrays(_as_float(x), _as_float(y))
+    valid = ~(np.isnan(x) | np.isnan(y))
+    count = _window_diff(np.cumsum(valid, axis=0, dtype=np.int64), window)
+    sums = [np.empty(x.shape) for _ in range(5)]
+    ox, oy = np.empty(x.shape), np.empty(x.shape)
+    for lo, start, end in _blocks(len(x), window):
+        ok = valid[lo:end]
+        offx, offy = _segment_offset(x[lo:end], ok), _segment_offset(y[lo:end], ok)
+        cx = np.where(ok, x[lo:end] - offx, 0.0)
+        cy = np.where(ok, y[lo:end] - offy, 0.0)
+        for k, a in enumerate((cx, cy, cx * cx, cy * cy, cx * cy)):
+            sums[k][start:end] = _window_diff(np.cumsum(a, axis=0), window)[start - lo:]
+        ox[start:end], oy[start:end] = offx, offy
+    return (count, *sums, (ox, oy))
+
+
+def _time_index(y):
+    t = np.arange(len(y), dtype=np.float64)
+    return t.reshape((len(y),) + (1,) * (np.ndim(y) - 1))
+
+
+def rolling_ols(y, x=None, window=10):
+    """
+    滚动一元回归 y = intercept + slope * x，基于窗口累积矩一遍算完，每根 bar O(1)。
+
+    x 为 None 时对窗口内的时间序号 0..window-1 回归。
+    返回 slope, intercept, rsquare, resid；resid 是窗口最后一个点的残差。
+    窗口内成对有效值不足 window 个，或 x 在窗口内为常数时结果为 NaN。
+    """
+    y = _as_float(y)
+    by_time = x is None
+    if by_time:
+        x = _time_index(y)
+    count, sx, sy, sxx, syy, sxy, (ox, oy) = rolling_comoments(x, y, window)
+    x = np.broadcast_to(_as_float(x), y.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mx, my = sx / window, sy / window
+        var_x = sxx - sx * mx
+        var_y = syy - sy * my
+        cov = sxy - sx * my
+        slope = cov / var_x
+        intercept = (my + oy) - slope * (mx + ox)
+        rsquare = cov * cov / (var_x * var_y)
+        resid = y - (intercept + slope * x)
+        if by_time:
+            # 截距换算到窗口内的时间序号（窗口起点为 0）
+            intercept = intercept + slope * (x - window + 1)
+    ok = _full(count, window) & (var_x > 0)
+    return tuple(np.where(ok, v, np.nan) for v in (slope, intercept, rsquare, resid))
+
+
+def _rolling_frame(x, window):
+    # pandas 的窗口排序统计量由 C 实现的可索引跳表维护，每步插入/删除/查询都是 O(log w)；
+    # 整个面板作为一张宽表一次调用，不再逐标的 groupby
+    x = _as_float(x)
+    import pandas as pd
+    return pd.DataFrame(x.reshape(len(x), math.prod(x.shape[1:]))).rolling(window), x.shape
+
+
+def rolling_rank(x, window):
+    """当前值在窗口内的百分比排名（并列取平均），与 rolling(window).rank(pct=True) 一致。"""
+    rolling, shape = _rolling_frame(x, window)
+    return rolling.rank(pct=True).to_numpy().reshape(shape)
+
+
+def rolling_quantile(x, window, q):
+    """窗口分位数，线性插值，与 rolling(window).quantile(q) 一致。"""
+    rolling, shape = _rolling_frame(x, window)
+    return rolling.quantile(q).to_numpy().reshape(shape)
+
+
+def rolling_median(x, window):
+    rolling, shape = _rolling_frame(x, window)
+    return rolling.median().to_numpy().reshape(shape)
+
+
+def rolling_corr_cov(x, y, window, atol=2e-05):
+    """
+    一遍算出滚动相关系数、协方差(ddof=1)，以及近似常数窗口的掩码。
+
+    任一序列在窗口内的标准差不超过 atol 时视为退化，相关系数置为 NaN。
+    窗口内成对有效值不足 window 个时结果为 NaN。
+    """
+    count, sx, sy, sxx, syy, sxy, _ = rolling_comoments(x, y, window)
+    full = _full(count, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_x = np.maximum(sxx - sx * sx / window, 0.0)
+        var_y = np.maximum(syy - sy * sy / window, 0.0)
+        cov = sxy - sx * sy / window
+        corr = cov / np.sqrt(var_x * var_y)
+        ddof = window - 1
+        degenerate = (np.sqrt(var_x / ddof) <= atol) | (np.sqrt(var_y / ddof) <= atol)
+    corr = np.where(full & ~degenerate, np.clip(corr, -1.0, 1.0), np.nan)
+    cov = np.where(full, cov / (window - 1), np.nan) if window > 1 else np.full(cov.shape, np.nan)
+    return corr, cov, full & degenerate
+
+
+# 安装了 numba 时，时间序列内核换成 JIT 编译的并行版本（设置 KKEXPR_DISABLE_NUMBA=1 可关闭）
+BACKEND = 'numpy'
+if not os.environ.get('KKEXPR_DISABLE_NUMBA'):
+    try:
+        from kkexpr import kernels_numba as _jit
+    except ImportError:
+        _jit = None
+    if _jit is not None:
+        numpy_kernels = {name: globals()[name] for name in _jit.__all__}
+        globals().update({name: getattr(_jit, name) for name in _jit.__all__})
+        BACKEND = 'numba'
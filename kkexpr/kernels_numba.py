@@ -0,0 +1,527 @@
+"""
+Numba JIT 版本的时间序列内核，与 kkexpr.kernels 中的同名函数语义一致。
+
+每个内核对标的列做 prange 并行，每列内部按时间顺序维护窗口状态：
+滚动和用增量加减（每 _BLOCK 行按本段均值重新锚定），极值用单调队列，排序统计量用按值编号的树状数组。
+编译结果通过 cache=True 缓存在磁盘上（位置可用 NUMBA_CACHE_DIR 指定），
+冷启动时不必重新编译每个内核。float32 的输入原样传入（见 kkexpr.dtypes），
+窗口累加量仍是 float64，输出为 float64。
+
+本模块只在安装了 numba 时由 kkexpr.kernels 导入。
+"""
+import math
+
+import numpy as np
+from numba import njit, prange
+
+_JIT = dict(parallel=True, cache=True, nogil=True)
+_JIT_SERIAL = dict(cache=True, nogil=True)
+
+
+# 每隔这么多行重新锚定窗口累加量，与 kkexpr.kernels._BLOCK 相同：
+# 偏移换成本段的均值，再按新的偏移重算窗口里已有的值，累加误差不随序列总长增长
+_BLOCK = 1024
+
+
+@njit(**_JIT_SERIAL)
+def _segment_offset(x, j, i, window):
+    # 第 i 行开始的一段（连同它之前 window-1 行）有效值的均值，与 kernels._blocks 的分段一致
+    block = max(_BLOCK, window)
+    total = 0.0
+    n = 0
+    for k in range(max(i - window + 1, 0), min(i + block, x.shape[0])):
+        v = x[k, j]
+        if not np.isnan(v):
+            total += v
+            n += 1
+    return total / n if n > 0 else 0.0
+
+
+@njit(**_JIT_SERIAL)
+def _anchor(i, window):
+    return i % max(_BLOCK, window) == 0
+
+
+@njit(**_JIT_SERIAL)
+def _higher_moment(s1, s2, s3, s4, n, kind):
+    # 偏度、超额峰度的无偏修正公式，与 pandas 的 rolling skew/kurt 一致
+    a = s1 / n
+    b = s2 / n - a * a
+    if b <= 1e-14:
+        return np.nan
+    c = s3 / n - 3 * a * s2 / n + 2 * a ** 3
+    if kind == 4:
+        return np.sqrt(n * (n - 1)) / (n - 2) * c / b ** 1.5
+    d = s4 / n - 4 * a * s3 / n + 6 * a * a * s2 / n - 3 * a ** 4
+    return ((n * n - 1) * d / (b * b) - 3 * (n - 1) ** 2) / ((n - 2) * (n - 3))
+
+
+@njit(**_JIT)
+def _rolling_moments_2d(x, window, ddof, kind):
+    # kind: 0 sum, 1 mean, 2 var, 3 std, 4 skew, 5 kurt
+    length, n = x.shape
+    out = np.full((length, n), np.nan)
+    higher = kind >= 4
+    for j in prange(n):
+        offset = 0.0
+        count = 0
+        s1 = 0.0
+        s2 = 0.0
+        s3 = 0.0
+        s4 = 0.0
+        same = 0  # 截至当前连续相同的值的个数，整个窗口都相同时偏度为 0、峰度为 -3
+        for i in range(length):
+            if _anchor(i, window):
+                offset = _segment_offset(x, j, i, window)
+                s1 = 0.0
+                s2 = 0.0
+                s3 = 0.0
+                s4 = 0.0
+                for k in range(max(i - window, 0), i):  # 含马上要移出窗口的 i - window
+                    v = x[k, j]
+                    if not np.isnan(v):
+                        c = v - offset
+                        s1 += c
+                        s2 += c * c
+                        if higher:
+                            s3 += c * c * c
+                            s4 += c * c * c * c
+            v = x[i, j]
+            if not np.isnan(v):
+                c = v - offset
+                count += 1
+                s1 += c
+                s2 += c * c
+                if higher:
+                    s3 += c * c * c
+                    s4 += c * c * c * c
+                    same = same + 1 if i > 0 and v == x[i - 1, j] else 1
+            if i >= window:
+                v = x[i - window, j]
+                if not np.isnan(v):
+                    c = v - offset
+                    count -= 1
+                    s1 -= c
+                    s2 -= c * c
+                    if higher:
+                        s3 -= c * c * c
+                        s4 -= c * c * c * c
+            if i < window - 1 or count < window:
+                continue
+            if kind == 0:
+                out[i, j] = s1 + window * offset
+            elif kind == 1:
+                out[i, j] = s1 / window + offset
+            elif higher:
+                if window >= kind - 1:  # 偏度至少 3 个值，峰度至少 4 个
+                    if same >= window:
+                        out[i, j] = 0.0 if kind == 4 else -3.0
+                    else:
+                        out[i, j] = _higher_moment(s1, s2, s3, s4, float(window), kind)
+            elif window > ddof:
+                var = max((s2 - s1 * s1 / window) / (window - ddof), 0.0)
+                out[i, j] = var if kind == 2 else np.sqrt(var)
+    return out
+
+
+@njit(**_JIT)
+def _rolling_zscore_2d(x, window, min_periods):
+    length, n = x.shape
+    out = np.full((length, n), np.nan)
+    for j in prange(n):
+        offset = 0.0
+        count = 0
+        s1 = 0.0
+        s2 = 0.0
+        for i in range(length):
+            if _anchor(i, window):
+                offset = _segment_offset(x, j, i, window)
+                s1 = 0.0
+                s2 = 0.0
+                for k in range(max(i - window, 0), i):  # 含马上要移出窗口的 i - window
+                    w = x[k, j]
+                    if not np.isnan(w):
+                        s1 += w - offset
+                        s2 += (w - offset) * (w - offset)
+            v = x[i, j]
+            if not np.isnan(v):
+                c = v - offset
+                count += 1
+                s1 += c
+                s2 += c * c
+            if i >= window:
+                w = x[i - window, j]
+                if not np.isnan(w):
+                    c = w - offset
+                    count -= 1
+                    s1 -= c
+                    s2 -= c * c
+            if i < min_periods - 1 or count < min_periods or np.isnan(v):
+                continue
+            mean = s1 / count
+            ss = s2 - s1 * mean
+            if ss <= 1e-12 * s2:
+                continue
+            out[i, j] = (v - offset - mean) / np.sqrt(max(ss, 0.0) / (count - 1))
+    return out
+
+
+@njit(**_JIT_SERIAL)
+def _pair_offset(x, y, j, i, window, by_time):
+    # 成对有效的值在这一段里的均值，分段同 _segment_offset
+    block = max(_BLOCK, window)
+    ox = 0.0
+    oy = 0.0
+    m = 0
+    for k in range(max(i - window + 1, 0), min(i + block, y.shape[0])):
+        xv = float(k) if by_time else x[k, j]
+        yv = y[k, j]
+        if not (np.isnan(xv) or np.isnan(yv)):
+            ox += xv
+            oy += yv
+            m += 1
+    if m > 0:
+        ox /= m
+        oy /= m
+    return ox, oy
+
+
+@njit(**_JIT)
+def _rolling_pair_2d(x, y, window, by_time, atol):
+    # 成对滚动矩，输出 corr, cov, slope, intercept, rsquare, resid
+    length, n = y.shape
+    out = np.full((6, length, n), np.nan)
+    for j in prange(n):
+        ox = 0.0
+        oy = 0.0
+        count = 0
+        sx = 0.0
+        sy = 0.0
+        sxx = 0.0
+        syy = 0.0
+        sxy = 0.0
+        for i in range(length):
+            if _anchor(i, window):
+                ox, oy = _pair_offset(x, y, j, i, window, by_time)
+                sx = 0.0
+                sy = 0.0
+                sxx = 0.0
+                syy = 0.0
+                sxy = 0.0
+                for k in range(max(i - window, 0), i):  # 含马上要移出窗口的 i - window
+                    xo = float(k) if by_time else x[k, j]
+                    yo = y[k, j]
+                    if not (np.isnan(xo) or np.isnan(yo)):
+                        cx = xo - ox
+                        cy = yo - oy
+                        sx += cx
+                        sy += cy
+                        sxx += cx * cx
+                        syy += cy * cy
+                        sxy += cx * cy
+            xv = float(i) if by_time else x[i, j]
+            yv = y[i, j]
+            if not (np.isnan(xv) or np.isnan(yv)):
+                cx = xv - ox
+                cy = yv - oy
+                count += 1
+                sx += cx
+                sy += cy
+                sxx += cx * cx
+                syy += cy * cy
+                sxy += cx * cy
+            if i >= window:
+                k = i - window
+                xo = float(k) if by_time else x[k, j]
+                yo = y[k, j]
+                if not (np.isnan(xo) or np.isnan(yo)):
+                    cx = xo - ox
+                    cy = yo - oy
+                    count -= 1
+                    sx -= cx
+                    sy -= cy
+                    sxx -= cx * cx
+                    syy -= cy * cy
+                    sxy -= cx * cy
+            if i < window - 1 or count < window:
+                continue
+            var_x = max(sxx - sx * sx / window, 0.0)
+            var_y = max(syy - sy * sy / window, 0.0)
+            cov = sxy - sx * sy / window
+            if window > 1:
+                out[1, i, j] = cov / (window - 1)
+                degenerate = (np.sqrt(var_x / (window - 1)) <= atol) or (np.sqrt(var_y / (window - 1)) <= atol)
+                if not degenerate:
+                    out[0, i, j] = min(max(cov / np.sqrt(var_x * var_y), -1.0), 1.0)
+            if var_x > 0:
+                slope = cov / var_x
+                intercept = (sy / window + oy) - slope * (sx / window + ox)
+                out[2, i, j] = slope
+                out[4, i, j] = cov * cov / (var_x * var_y)
+                out[5, i, j] = yv - (intercept + slope * xv)
+                if by_time:
+                    intercept += slope * (i - window + 1)
+                out[3, i, j] = intercept
+    return out
+
+
+@njit(**_JIT)
+def _rolling_extremum_2d(x, window, sign):
+    """
+    单调队列求窗口极值（sign=1 最大，sign=-1 最小）及其位置。
+
+    队列里保存下标，对应的值严格单调，相等时保留更早的下标，
+    所以队首就是窗口内最早出现的极值。每个元素进出队列各一次。
+    返回 values（窗口需满且无 NaN）、index（相对窗口起点，min_periods=1）。
+    """
+    length, n = x.shape
+    values = np.full((length, n), np.nan)
+    index = np.full((length, n), np.nan)
+    for j in prange(n):
+        queue = np.empty(length, dtype=np.int64)
+        head = 0
+        tail = 0
+        count = 0
+        for i in range(length):
+            v = x[i, j]
+            if not np.isnan(v):
+                count += 1
+                while tail > head and sign * x[queue[tail - 1], j] < sign * v:
+                    tail -= 1
+                queue[tail] = i
+                tail += 1
+            if i >= window:
+                if not np.isnan(x[i - window, j]):
+                    count -= 1
+                while tail > head and queue[head] <= i - window:
+                    head += 1
+            if tail > head:
+                start = max(i - window + 1, 0)
+                index[i, j] = queue[head] - start
+                if i >= window - 1 and count == window:
+                    values[i, j] = x[queue[head], j]
+    return values, index
+
+
+@njit(**_JIT_SERIAL)
+def _dense_ranks(col):
+    # 有效值按大小编号 1..m（相等的值同号），NaN 编号为 0；返回 (编号, 各编号对应的值)
+    length = len(col)
+    ranks = np.zeros(length, np.int64)
+    idx = np.empty(length, np.int64)
+    count = 0
+    for i in range(length):
+        if not np.isnan(col[i]):
+            idx[count] = i
+            count += 1
+    idx = idx[:count]
+    values = np.empty(count)
+    for k in range(count):
+        values[k] = col[idx[k]]
+    order = np.argsort(values)
+    uniq = np.empty(count)
+    m = 0
+    for k in range(count):
+        v = values[order[k]]
+        if m == 0 or v != uniq[m - 1]:
+            uniq[m] = v
+            m += 1
+        ranks[idx[order[k]]] = m
+    return ranks, uniq[:m]
+
+
+@njit(**_JIT_SERIAL)
+def _tree_add(tree, r, delta):
+    while r < len(tree):
+        tree[r] += delta
+        r += r & -r
+
+
+@njit(**_JIT_SERIAL)
+def _tree_prefix(tree, r):
+    # 编号不超过 r 的值的个数
+    total = 0
+    while r > 0:
+        total += tree[r]
+        r -= r & -r
+    return total
+
+
+@njit(**_JIT_SERIAL)
+def _tree_kth(tree, k, top):
+    # 第 k 小（从 1 数起）的值的编号；top 为不超过编号总数的最大的 2 的幂
+    pos = 0
+    step = top
+    while step > 0:
+        nxt = pos + step
+        if nxt < len(tree) and tree[nxt] < k:
+            pos = nxt
+            k -= tree[nxt]
+        step >>= 1
+    return pos + 1
+
+
+@njit(**_JIT)
+def _rolling_order_stat_2d(x, window, q, kind):
+    """
+    按值编号的树状数组：每列先把有效值排序编号（相等的值同号），窗口内各编号的个数记在树状数组里。
+    移入、移出一个值和查询排名、第 k 小都是 O(log m)（m 为这一列不同取值的个数），与窗口长度无关；
+    每列另有一次 O(n log n) 的排序。
+    kind: 0 当前值的百分比排名（并列取平均），1 分位数（线性插值）。
+    """
+    length, n = x.shape
+    out = np.full((length, n), np.nan)
+    for j in prange(n):
+        ranks, uniq = _dense_ranks(x[:, j])
+        m = len(uniq)
+        tree = np.zeros(m + 1, np.int64)
+        top = 1
+        while top * 2 <= m:
+            top *= 2
+        size = 0
+        for i in range(length):
+            if i >= window and ranks[i - window] > 0:
+                _tree_add(tree, ranks[i - window], -1)
+                size -= 1
+            r = ranks[i]
+            if r > 0:
+                _tree_add(tree, r, 1)
+                size += 1
+            if size < window:
+                continue
+            if kind == 0:
+                if r == 0:
+                    continue
+                less = _tree_prefix(tree, r - 1)
+                equal = _tree_prefix(tree, r) - less
+                out[i, j] = (less + (equal + 1) / 2.0) / size
+            else:
+                pos = q * (size - 1)
+                lo = int(np.floor(pos))
+                hi = min(lo + 1, size - 1)
+                a = uniq[_tree_kth(tree, lo + 1, top) - 1]
+                b = uniq[_tree_kth(tree, hi + 1, top) - 1]
+                out[i, j] = a + (b - a) * (pos - lo)
+    return out
+
+
+def _as_2d(x):
+    # float32 输入不转换，直接编译一份 float32 的版本读取；内核里的累加量总是 float64
+    x = np.asarray(x)
+    if x.dtype != np.float32:
+        x = x.astype(np.float64, copy=False)
+    # 列数显式给出：空输入 reshape(0, -1) 无法推断列数
+    return np.ascontiguousarray(x.reshape(len(x), math.prod(x.shape[1:]))), x.shape
+
+
+def rolling_sum(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_moments_2d(x2, window, 1, 0).reshape(shape)
+
+
+def rolling_mean(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_moments_2d(x2, window, 1, 1).reshape(shape)
+
+
+def rolling_var(x, window, ddof=1):
+    x2, shape = _as_2d(x)
+    return _rolling_moments_2d(x2, window, ddof, 2).reshape(shape)
+
+
+def rolling_std(x, window, ddof=1):
+    x2, shape = _as_2d(x)
+    return _rolling_moments_2d(x2, window, ddof, 3).reshape(shape)
+
+
+def rolling_skew(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_moments_2d(x2, window, 1, 4).reshape(shape)
+
+
+def rolling_kurt(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_moments_2d(x2, window, 1, 5).reshape(shape)
+
+
+def rolling_zscore(x, window, min_periods=None):
+    x2, shape = _as_2d(x)
+    min_periods = window if min_periods is None else max(int(min_periods), 2)
+    return _rolling_zscore_2d(x2, window, min_periods).reshape(shape)
+
+
+def _pair(y, x, window, atol=2e-05):
+    y2, shape = _as_2d(y)
+    by_time = x is None
+    x2 = y2 if by_time else _as_2d(np.broadcast_to(np.asarray(x, dtype=np.float64), shape))[0]
+    return _rolling_pair_2d(x2, y2, window, by_time, atol), shape
+
+
+def rolling_corr_cov(x, y, window, atol=2e-05):
+    out, shape = _pair(y, x, window, atol)
+    corr, cov = out[0].reshape(shape), out[1].reshape(shape)
+    count_ok = ~np.isnan(cov)
+    return corr, cov, count_ok & np.isnan(corr)
+
+
+def rolling_ols(y, x=None, window=10):
+    out, shape = _pair(y, x, window)
+    return tuple(out[k].reshape(shape) for k in (2, 3, 4, 5))
+
+
+def rolling_max(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_extremum_2d(x2, window, 1.0)[0].reshape(shape)
+
+
+def rolling_min(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_extremum_2d(x2, window, -1.0)[0].reshape(shape)
+
+
+def rolling_max_min(x, window):
+    # 把 x 和 -x 拼成一张表，一次调用同时得到最大值和最小值
+    x2, shape = _as_2d(x)
+    values, _ = _rolling_extremum_2d(np.concatenate((x2, -x2), axis=1), window, 1.0)
+    n = x2.shape[1]
+    return values[:, :n].reshape(shape), -values[:, n:].reshape(shape)
+
+
+def rolling_argmax(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_extremum_2d(x2, window, 1.0)[1].reshape(shape)
+
+
+def rolling_argmin(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_extremum_2d(x2, window, -1.0)[1].reshape(shape)
+
+
+def rolling_argmax_argmin(x, window):
+    x2, shape = _as_2d(x)
+    _, index = _rolling_extremum_2d(np.concatenate((x2, -x2), axis=1), window, 1.0)
+    n = x2.shape[1]
+    return index[:, :n].reshape(shape), index[:, n:].reshape(shape)
+
+
+def rolling_rank(x, window):
+    x2, shape = _as_2d(x)
+    return _rolling_order_stat_2d(x2, window, 0.0, 0).reshape(shape)
+
+
+def rolling_quantile(x, window, q):
+    x2, shape = _as_2d(x)
+    return _rolling_order_stat_2d(x2, window, float(q), 1).reshape(shape)
+
+
+def rolling_median(x, window):
+    return rolling_quantile(x, window, 0.5)
+
+
+__all__ = [
+    'rolling_sum', 'rolling_mean', 'rolling_var', 'rolling_std', 'rolling_skew', 'rolling_kurt', 'rolling_zscore',
+    'rolling_corr_cov', 'rolling_ols',
+    'rolling_max', 'rolling_min', 'rolling_max_min',
+    'rolling_argmax', 'rolling_argmin', 'rolling_argmax_argmin',
+    'rolling_rank', 'rolling_quantile', 'rolling_median',
+]
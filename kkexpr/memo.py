@@ -0,0 +1,89 @@
+"""
+子表达式结果的进程内缓存。
+
+一次 calc_expr/iter_exprs 内部的公共子表达式已经只算一次，但调用结束后中间结果就被丢掉了；
+遗传算法的一代个体、Alpha158 里反复出现的 shift(close, d)/close 这类子树，
+在接连的调用之间会被重复计算。SubexprMemo 按 (数据, 计算后端, 精度策略, 子树的规范 key) 保留这些中间结果，
+总大小不超过 max_bytes。
+
+淘汰用 GreedyDual-Size：每个条目的优先级是 “当前水位 + 计算耗时 / 字节数”，
+命中时刷新，淘汰优先级最低的条目并把水位抬到它的优先级。
+所以久未使用的条目会被淘汰，算得快、占得多的条目比算得慢、占得少的条目先被淘汰。
+
+数据按 DataFrame 对象区分，对象被回收后相应的条目随之清除；
+同一个 DataFrame 的列在两次调用之间被原地修改时，需要先调用 clear()。
+"""
+import itertools
+import time
+import weakref
+
+import numpy as np
+
+from kkexpr import dtypes
+
+
+class SubexprMemo:
+    def __init__(self, max_bytes=1024 ** 3):
+        self.max_bytes = max_bytes
+        self.entries = {}  # key -> [value, nbytes, cost, priority]
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._level = 0.0
+        self._tokens = {}
+        self._ids = itertools.count()
+
+    def _token(self, df):
+        token = self._tokens.get(id(df))
+        if token is None:
+            token = self._tokens[id(df)] = next(self._ids)
+            weakref.finalize(df, self._forget, id(df), token)
+        return token
+
+    def _forget(self, df_id, token):
+        self._tokens.pop(df_id, None)
+        for key in [key for key in self.entries if key[0] == token]:
+            self._remove(key)
+
+    def compute(self, ctx, node):
+        """返回节点在 ctx 上的值，缓存里有就直接取，没有就计算后放进缓存。"""
+        key = (self._token(ctx.df), type(ctx).__name__, np.dtype(dtypes.get_float_dtype()).name, node.key)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry[3] = self._level + entry[2] / entry[1]
+            ctx.release_children(node)
+            return entry[0]
+        self.misses += 1
+        start = time.perf_counter()
+        value = node.evaluate(ctx)
+        self.put(key, value, time.perf_counter() - start)
+        return value
+
+    def put(self, key, value, cost):
+        nbytes = getattr(value, 'nbytes', None)
+        if not nbytes or nbytes > self.max_bytes:  # 标量、元组，或单个就超出预算的结果不缓存
+            return
+        if key in self.entries:
+            self._remove(key)
+        while self.entries and self.nbytes + nbytes > self.max_bytes:
+            victim = min(self.entries, key=lambda k: self.entries[k][3])
+            self._level = self.entries[victim][3]
+            self._remove(victim)
+            self.evictions += 1
+        self.entries[key] = [value, nbytes, cost, self._level + cost / nbytes]
+        self.nbytes += nbytes
+
+    def _remove(self, key):
+        self.nbytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    hit_rate=self.hits / total if total else 0.0,
+                    entries=len(self.entries), nbytes=self.nbytes, max_bytes=self.max_bytes)
@@ -0,0 +1,111 @@
+"""
+宽面板布局：把 (date, symbol) 双层索引的长表序列展开为 (日期 × 标的) 的二维数组。
+
+索引只分解一次，之后列与结果在数组和序列之间来回转换都是一次花式索引；
+时间序列算子在二维数组上沿 axis=0 一次算完所有标的，不再逐个标的 groupby。
+"""
+import numpy as np
+import pandas as pd
+
+from kkexpr import dtypes
+
+
+class Panel:
+    def __init__(self, index: pd.Index):
+        self.index = index
+        if isinstance(index, pd.MultiIndex) and index.nlevels == 2:
+            self.dates, self.rows = self._factorize(index, 0)
+            self.symbols, self.cols = self._factorize(index, 1)
+        else:  # 单标的序列
+            self.dates, self.rows = self._factorize(index, None)
+            self.symbols, self.cols = pd.Index([None]), np.zeros(len(index), dtype=np.intp)
+        self.shape = (len(self.dates), len(self.symbols))
+        self.mask = np.zeros(self.shape, dtype=bool)
+        self.mask[self.rows, self.cols] = True
+        self.has_gaps = self._has_gaps(self.mask)
+        self._order = None
+
+    @staticmethod
+    def _factorize(index, level):
+        if level is None:
+            values = index
+        else:
+            # 层级有序时直接用 MultiIndex 自带的 codes，省掉一次哈希分解；
+            # 行序不是按该层排好的索引，去掉未用的值后层级可能变成无序，要在之后再判断
+            trimmed = index.remove_unused_levels()
+            if trimmed.levels[level].is_monotonic_increasing:
+                return trimmed.levels[level], np.asarray(trimmed.codes[level], dtype=np.intp)
+            values = index.get_level_values(level)
+        codes, uniques = pd.factorize(values, sort=True)
+        return pd.Index(uniques), codes.astype(np.intp)
+
+    @staticmethod
+    def _has_gaps(mask):
+        # 每个标的的有效行在日历上是否连续（上市前、退市后的缺失不算缺口）
+        if not mask.size:
+            return False
+        count = mask.sum(axis=0)
+        first = mask.argmax(axis=0)
+        last = len(mask) - 1 - mask[::-1].argmax(axis=0)
+        return bool(np.any((count > 0) & (last - first + 1 != count)))
+
+    @classmethod
+    def from_index(cls, index: pd.Index) -> 'Panel':
+        # 同一个索引对象反复出现（df 的各列、算子的中间结果），只分解一次
+        global _last_panel
+        if _last_panel is None or _last_panel.index is not index:
+            _last_panel = cls(index)
+        return _last_panel
+
+    def to_array(self, se) -> np.ndarray:
+        arr = np.full(self.shape, np.nan, dtype=dtypes.FLOAT)
+        arr[self.rows, self.cols] = np.asarray(se, dtype=dtypes.FLOAT)
+        return arr
+
+    def to_series(self, arr, name=None) -> pd.Series:
+        arr = np.asarray(arr)
+        if arr.ndim == 0:
+            arr = np.broadcast_to(arr, self.shape)
+        return pd.Series(arr[self.rows, self.cols], index=self.index, name=name)
+
+    def _compact_order(self):
+        # 把每列的有效行按时间顺序挪到最前面，停牌缺口被挤掉，与逐标的计算的序列一致
+        if self._order is None:
+            self._order = np.argsort(~self.mask, axis=0, kind='stable')
+        return self._order
+
+    def compact(self, arr):
+        return np.take_along_axis(arr, self._compact_order(), axis=0)
+
+    def expand(self, arr):
+        out = np.empty_like(arr)
+        np.put_along_axis(out, self._compact_order(), arr, axis=0)
+        out[~self.mask] = np.nan if out.dtype.kind == 'f' else 0
+        return out
+
+    def apply_by_symbol(self, func, *args, **kwargs):
+        """时间序列算子：沿 axis=0 计算，有停牌缺口时先压实再展开。"""
+        if not self.has_gaps:
+            return func(*args, **kwargs)
+        args = [self.compact(arg) if _is_panel_array(arg, self.shape) else arg for arg in args]
+        ret = func(*args, **kwargs)
+        if isinstance(ret, tuple):
+            return tuple(self.expand(r) for r in ret)
+        return self.expand(ret)
+
+    def apply_by_date(self, func, *args, **kwargs):
+        """截面算子：沿 axis=1 计算，缺失的格子本身是 NaN，不需要额外处理。"""
+        return func(*args, **kwargs)
+
+    def apply(self, func, *args, **kwargs):
+        # 内核内部可能用 float64 计算，结果按当前精度策略存放
+        if getattr(func, 'panel_axis', 'symbol') == 'date':
+            return dtypes.cast(self.apply_by_date(func, *args, **kwargs))
+        return dtypes.cast(self.apply_by_symbol(func, *args, **kwargs))
+
+
+_last_panel = None
+
+
+def _is_panel_array(arg, shape):
+    return isinstance(arg, np.ndarray) and arg.shape == shape
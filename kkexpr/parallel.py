@@ -0,0 +1,350 @@
+"""
+多进程并行计算因子。
+
+输入面板放在共享内存里（数值列按列连续存放，双层索引以 codes 的形式存放），
+子进程直接在共享内存上重建 DataFrame，不需要把整张表 pickle 给每个进程；
+计算结果也写回一块共享内存，主进程按字段顺序取回。
+共享的数值和结果都按主进程当时的精度策略存放（见 kkexpr.dtypes），子进程启动时沿用同一策略。
+
+两种切分方式：
+- calc_exprs_parallel 按字段切分，每个进程算一部分因子；
+- calc_exprs_sharded 按标的切分，每个进程对一段标的算全部因子，截面算子和作用在整个数组上的算子是同步点。
+"""
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from kkexpr import dtypes
+from kkexpr.expr import (Call, _CONTEXTS, _ELEMENTWISE_FUNCS, _as_values, _calc_dependent, _count_refs,
+                         _split_fields, compile_expr, iter_exprs)
+from kkexpr.panel import Panel
+
+
+class SharedArray:
+    """一块共享内存上的 ndarray；spec 可以 pickle 给子进程，用 attach 取回同一块内存。"""
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def from_array(cls, arr):
+        arr = np.asarray(arr)
+        shared = cls(arr.shape, arr.dtype)
+        shared.array[...] = arr
+        return shared
+
+    @property
+    def spec(self):
+        return self.shm.name, self.shape, self.dtype.str
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        return cls(shape, dtype, name=name)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedFrame:
+    """
+    把 (date, symbol) 双层索引的 DataFrame 放进共享内存。
+
+    只共享数值列，按当前精度（dtypes.get_float_dtype()）存放，列之间互不干扰地按列连续存放；
+    索引保存为两级的 levels 和 codes。
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        index = df.index.remove_unused_levels()
+        self.columns = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+        self.levels = [index.levels[0], index.levels[1]]
+        self.names = list(index.names)
+        self.values = SharedArray((len(self.columns), len(df)), dtypes.get_float_dtype())
+        for i, col in enumerate(self.columns):
+            self.values.array[i] = df[col].to_numpy(dtype=self.values.dtype)
+        self.codes = [SharedArray.from_array(np.asarray(c, dtype=np.int64)) for c in index.codes]
+        self.shared = [self.values] + self.codes
+
+    @property
+    def spec(self):
+        return dict(columns=self.columns, levels=self.levels, names=self.names,
+                    values=self.values.spec, codes=[c.spec for c in self.codes])
+
+    @staticmethod
+    def attach(spec):
+        """在子进程里重建 DataFrame，数值直接引用共享内存，不复制。"""
+        values = SharedArray.attach(spec['values'])
+        codes = [SharedArray.attach(c) for c in spec['codes']]
+        index = pd.MultiIndex(levels=spec['levels'], codes=[c.array for c in codes],
+                              names=spec['names'], verify_integrity=False)
+        df = pd.DataFrame(values.array.T, index=index, columns=spec['columns'], copy=False)
+        return df, [values] + codes
+
+    def close(self):
+        for shared in self.shared:
+            shared.close()
+
+
+_worker = {}
+
+
+def _spawn():
+    # 统一用 spawn：主进程里 numba/BLAS 的线程池已启动时 fork 出的子进程可能死锁
+    return multiprocessing.get_context('spawn')
+
+
+def _float_dtype():
+    # 精度策略是模块级的设置，spawn 出的子进程不会继承，按名字传过去
+    return np.dtype(dtypes.get_float_dtype()).name
+
+
+def _init_worker(frame_spec, out_spec, backend, float_dtype):
+    dtypes.set_float_dtype(float_dtype)
+    df, handles = SharedFrame.attach(frame_spec)
+    out = SharedArray.attach(out_spec)
+    _worker.update(df=df, out=out, handles=handles + [out], backend=backend)
+
+
+def _eval_chunk(positions, fields):
+    # 同一块里的字段仍然合并求值，共享子表达式
+    df, out = _worker['df'], _worker['out']
+    for pos, se in zip(positions, iter_exprs(df, fields, backend=_worker['backend'])):
+        out.array[pos] = _as_values(se, df.index)
+    return positions
+
+
+def calc_exprs_parallel(df: pd.DataFrame, fields, names, n_jobs=4, chunksize=None, backend='pandas'):
+    """
+    用进程池并行计算一组因子，返回与 fields 顺序一致的 Series 列表（值为当前精度）。
+
+    相邻的字段分在同一块里，块内仍做公共子表达式消除；chunksize 默认使每个进程分到约 4 块。
+    引用了其他因子名字的字段（如 rank(roc_2)）依赖前面的结果，放到最后在主进程里顺序计算。
+    """
+    names = list(names)
+    independent, dependent = _split_fields(df, fields, names)
+    results = [None] * len(fields)
+    if independent:
+        chunksize = chunksize or max(1, math.ceil(len(independent) / (n_jobs * 4)))
+        frame = SharedFrame(df)
+        out = SharedArray((len(fields), len(df)), dtypes.get_float_dtype())
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=_spawn(), initializer=_init_worker,
+                                     initargs=(frame.spec, out.spec, backend, _float_dtype())) as pool:
+                futures = []
+                for start in range(0, len(independent), chunksize):
+                    positions = independent[start:start + chunksize]
+                    futures.append(pool.submit(_eval_chunk, positions, [fields[p] for p in positions]))
+                for future in futures:
+                    future.result()
+            for pos in independent:
+                results[pos] = pd.Series(out.array[pos].copy(), index=df.index, name=names[pos])
+        finally:
+            frame.close()
+            out.close()
+
+    if dependent:
+        _calc_dependent(df, fields, names, results, independent, dependent, backend)
+    return results
+
+
+def _is_barrier(node):
+    # 逐元素的算子和按标的计算的时间序列算子可以在各分片上独立计算，其余算子都是按标的分片执行的同步点：
+    # 截面算子需要同一天全部标的的数据，scale、decay_linear 这类不按标的分组的算子作用在整个数组上
+    if not isinstance(node, Call):
+        return False
+    if isinstance(node.func, np.ufunc) or node.func in _ELEMENTWISE_FUNCS:
+        return False
+    return 'symbol' not in (getattr(node.func, 'panel_axis', None), getattr(node.func, 'calc_by', None))
+
+
+def _next_stage(roots, known):
+    """
+    找出下一轮的计算任务，返回 (targets, barriers)。
+
+    targets 的子树里没有未算出的同步算子（见 _is_barrier），可以按标的分片独立计算；
+    barriers 是参数都将在本轮算出的同步算子，随后在主进程里对整张表计算。
+    """
+    blocked = {}  # 节点的子树里是否还有未算出的同步算子
+    targets, barriers = {}, {}
+
+    def visit(node):
+        if node.key in known or not node.children:
+            return False
+        if node.key not in blocked:
+            child_blocked = [visit(child) for child in node.children]
+            if _is_barrier(node):
+                if not any(child_blocked):
+                    barriers[node.key] = node
+                    targets.update((c.key, c) for c in node.children if c.children and c.key not in known)
+                blocked[node.key] = True
+            else:
+                blocked[node.key] = any(child_blocked)
+        return blocked[node.key]
+
+    for root in roots:
+        if root.key not in known and not visit(root):
+            targets[root.key] = root
+    return list(targets.values()), list(barriers.values())
+
+
+def _known_inputs(nodes, known):
+    # 计算 nodes 时会直接读取的已知节点
+    keys, seen, stack = [], set(), list(nodes)
+    while stack:
+        node = stack.pop()
+        if node.key in seen:
+            continue
+        seen.add(node.key)
+        if node.key in known:
+            keys.append(node.key)
+        else:
+            stack.extend(node.children)
+    return keys
+
+
+def _seed(ctx, key, values):
+    # 已知节点按列交给上下文，读取时和普通列一样转换（面板后端展开成二维数组），且不会被释放
+    ctx.outputs[key] = pd.Series(values, index=ctx.df.index)
+    ctx.cache[key] = ctx.column(key)
+    ctx.refs[key] = math.inf
+
+
+def _evaluate_nodes(df, nodes, known, backend):
+    """在 df 上计算 nodes，known 为 {节点 key: 与 df 行对齐的数组}。"""
+    ctx = _CONTEXTS[backend](df, _count_refs(nodes, stop=known))
+    for key, values in known.items():
+        _seed(ctx, key, values)
+    with np.errstate(all='ignore'):
+        for node in nodes:
+            yield _as_values(ctx.evaluate_root(node), df.index)
+
+
+def _find_nodes(exprs, keys):
+    # 子进程里按文本重新编译表达式，再按 key 找回节点，避免 pickle 节点对象
+    index, stack = {}, [compile_expr(expr).root for expr in exprs]
+    while stack:
+        node = stack.pop()
+        if node.key not in index:
+            index[node.key] = node
+            stack.extend(node.children)
+    return [index[key] for key in keys]
+
+
+def _init_shard_worker(frame_spec, backend, float_dtype):
+    dtypes.set_float_dtype(float_dtype)
+    df, handles = SharedFrame.attach(frame_spec)
+    _worker.update(df=df, handles=handles, backend=backend, stage=None)
+
+
+def _stage_arrays(known_spec, out_spec):
+    # 每一轮的输入、输出共享内存在子进程里只连接一次，进入下一轮时断开上一轮的
+    stage = _worker['stage']
+    if stage is None or stage[0] != (known_spec, out_spec):
+        if stage is not None:
+            for shared in stage[1:]:
+                if shared is not None:
+                    shared.close()
+        known = SharedArray.attach(known_spec) if known_spec else None
+        stage = _worker['stage'] = ((known_spec, out_spec), known, SharedArray.attach(out_spec))
+    return stage[1], stage[2]
+
+
+def _eval_shard(rows, exprs, target_keys, known_keys, known_spec, out_spec):
+    known, out = _stage_arrays(known_spec, out_spec)
+    lo, hi = rows
+    shard = _worker['df'].iloc[lo:hi]
+    nodes = _find_nodes(exprs, target_keys)
+    inputs = {key: known.array[i, lo:hi] for i, key in enumerate(known_keys)}
+    for i, values in enumerate(_evaluate_nodes(shard, nodes, inputs, _worker['backend'])):
+        out.array[i, lo:hi] = values
+    return rows
+
+
+def _shard_rows(cols, n_shards):
+    # 按行数大致均分，切分点对齐到标的的边界，同一标的不会跨分片
+    n = len(cols)
+    starts = np.r_[0, np.flatnonzero(np.diff(cols)) + 1, n]
+    cuts = starts[np.searchsorted(starts, np.arange(1, n_shards) * n / n_shards)]
+    edges = np.unique(np.r_[0, cuts, n])
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def calc_exprs_sharded(df: pd.DataFrame, fields, names, n_jobs=4, n_shards=None, backend='pandas'):
+    """
+    按标的分片并行计算一组因子，返回与 fields 顺序一致的 Series 列表（值为当前精度）。
+
+    行情按 (标的, 日期) 排序后放进共享内存，每个分片是其中连续的一段行，子进程直接在这一段上
+    计算整棵表达式。截面算子（rank 等按日期计算的算子）和 scale 这类作用在整个数组上的算子是同步点：
+    先分片算出它的参数，汇总后在主进程里按原来的行序对整张表计算，再把结果作为已知节点交给下一轮。
+    只含时间序列算子的表达式一轮即可算完。n_shards 默认等于 n_jobs。
+    """
+    names = list(names)
+    independent, dependent = _split_fields(df, fields, names)
+    results = [None] * len(fields)
+    if independent:
+        panel = Panel.from_index(df.index)
+        order = np.lexsort((panel.rows, panel.cols))
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        sdf = df.iloc[order]
+        shards = _shard_rows(panel.cols[order], n_shards or n_jobs)
+        exprs = [fields[pos] for pos in independent]
+        roots = [compile_expr(expr).root for expr in exprs]
+        known = {}  # 节点 key -> 按 sdf 行顺序排列的结果
+        frame = SharedFrame(sdf)
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=_spawn(), initializer=_init_shard_worker,
+                                     initargs=(frame.spec, backend, _float_dtype())) as pool:
+                while True:
+                    targets, barriers = _next_stage(roots, known)
+                    if not targets and not barriers:
+                        break
+                    if targets:
+                        known.update(_run_stage(pool, shards, exprs, targets, known, len(sdf)))
+                    for node in barriers:
+                        # 在原来的行序上计算：作用在整个数组上的算子的结果与行序有关
+                        inputs = {key: known[key][inverse] for key in _known_inputs(node.children, known)}
+                        values = next(_evaluate_nodes(df, [node], inputs, backend))
+                        known[node.key] = dtypes.cast(values[order])
+        finally:
+            frame.close()
+        for pos, root in zip(independent, roots):
+            results[pos] = pd.Series(known[root.key][inverse], index=df.index, name=names[pos])
+
+    if dependent:
+        _calc_dependent(df, fields, names, results, independent, dependent, backend)
+    return results
+
+
+def _run_stage(pool, shards, exprs, targets, known, n_rows):
+    known_keys = _known_inputs(targets, known)
+    inputs = SharedArray.from_array(dtypes.cast(np.stack([known[key] for key in known_keys]))) if known_keys else None
+    out = SharedArray((len(targets), n_rows), dtypes.get_float_dtype())
+    try:
+        target_keys = [node.key for node in targets]
+        known_spec = inputs.spec if inputs is not None else None
+        futures = [pool.submit(_eval_shard, rows, exprs, target_keys, known_keys, known_spec, out.spec)
+                   for rows in shards]
+        for future in futures:
+            future.result()
+        return {key: out.array[i].copy() for i, key in enumerate(target_keys)}
+    finally:
+        out.close()
+        if inputs is not None:
+            inputs.close()
@@ -0,0 +1,118 @@
+"""
+因子结果的写出目标（sink）。
+
+Dataloader.load(..., sink=...) 与 load_chunked(..., sink) 每算完一个因子就把它写出并释放，
+不再把所有因子拼成一张大表。结果按列存放，每列一个目录，每段一个文件，各列的同名文件逐行对应：
+
+    root/date/part-00000.<fmt>
+    root/symbol/part-00000.<fmt>
+    root/<因子名>/part-00000.<fmt>
+
+整段 load 写一段，分块计算每块写一段。root 下已有同格式的结果时默认报错，overwrite=True 时先删掉再写。
+ParquetSink、FeatherSink 需要 pyarrow，NpySink 只用 numpy；
+读回用对应类的 read(root, names)，得到与 load 返回值相同格式的 DataFrame。
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from kkexpr.dataloader import _import_pyarrow
+
+_INDEX_COLUMNS = ('date', 'symbol')
+
+
+class Sink:
+    """begin(index) 开始一段，write(name, values) 写一列，close() 收尾。"""
+    suffix = ''
+
+    def __init__(self, root, overwrite=False):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        parts = list(self.root.glob('*/part-*' + self.suffix))
+        if parts and not overwrite:
+            raise FileExistsError('{} 下已有写出的结果，覆盖请传入 overwrite=True'.format(self.root))
+        for path in parts:
+            path.unlink()
+        self.part = -1
+        self.rows = 0
+
+    def begin(self, index: pd.MultiIndex):
+        self.part += 1
+        self.rows += len(index)
+        self.write('date', np.asarray(index.get_level_values(0)))
+        self.write('symbol', np.asarray(index.get_level_values(1).astype(str), dtype=str))
+
+    def write(self, name, values):
+        path = self.root / name
+        path.mkdir(exist_ok=True)
+        self._save(path / 'part-{:05d}{}'.format(self.part, self.suffix), name, np.asarray(values))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _save(self, path, name, values):
+        raise NotImplementedError
+
+    @classmethod
+    def _load(cls, path, name):
+        raise NotImplementedError
+
+    @classmethod
+    def read(cls, root, names=None) -> pd.DataFrame:
+        """读回写出的结果：以日期为索引、带 symbol 列和各因子列；names 为空时读全部因子。"""
+        root = Path(root)
+        if names is None:
+            names = sorted(p.name for p in root.iterdir() if p.is_dir() and p.name not in _INDEX_COLUMNS)
+        dfs = []
+        for path in sorted((root / 'date').glob('part-*' + cls.suffix)):
+            columns = {name: cls._load(root / name / path.name, name) for name in ('symbol',) + tuple(names)}
+            dfs.append(pd.DataFrame(columns, index=pd.Index(cls._load(path, 'date'), name='date')))
+        return pd.concat(dfs) if dfs else pd.DataFrame(columns=['symbol'] + list(names))
+
+
+class NpySink(Sink):
+    suffix = '.npy'
+
+    def _save(self, path, name, values):
+        np.save(path, values)
+
+    @classmethod
+    def _load(cls, path, name):
+        return np.load(path)
+
+
+class ParquetSink(Sink):
+    suffix = '.parquet'
+
+    def _save(self, path, name, values):
+        pa = _import_pyarrow()
+        import pyarrow.parquet as pq
+        pq.write_table(pa.table({name: values}), path)
+
+    @classmethod
+    def _load(cls, path, name):
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+        return pq.read_table(path).column(0).to_numpy()
+
+
+class FeatherSink(Sink):
+    suffix = '.feather'
+
+    def _save(self, path, name, values):
+        pa = _import_pyarrow()
+        import pyarrow.feather as feather
+        feather.write_feather(pa.table({name: values}), path)
+
+    @classmethod
+    def _load(cls, path, name):
+        _import_pyarrow()
+        import pyarrow.feather as feather
+        return feather.read_table(path).column(0).to_numpy()
@@ -0,0 +1,154 @@
+"""
+内存映射的行情面板库。
+
+一个目录存一份行情：每个数值字段一个 (日期 × 标的) 的 float64 二维 .npy 文件（与精度策略无关，
+float32 策略下取出后再按 dtypes.cast 转换），
+另有三个索引文件：dates.npy（日期）、symbols.npy（标的代码，已排序）、mask.npy（哪些格子有行情）。
+读取时用 np.load(mmap_mode='r') 只读映射，打开几乎不花时间，多个研究进程共用操作系统的页缓存，
+不会各自把行情解析、复制一份。按日期区间、全部标的取出的是映射上的视图；
+面板后端（backend='panel'）可以直接在这些数组上求值，不再经过长表展开。
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from kkexpr import config, dtypes
+from kkexpr.expr import compile_expr, iter_exprs
+from kkexpr.panel import Panel
+
+_INDEX_FILES = ('dates', 'symbols', 'mask')
+
+
+class PanelStore:
+    """root 为面板库目录，默认 config.DATA_DIR_PANEL。"""
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root is not None else config.DATA_DIR_PANEL
+        self.dates = pd.DatetimeIndex(np.load(self.root / 'dates.npy'))
+        self.symbols = pd.Index(np.load(self.root / 'symbols.npy'))
+        self.mask = np.load(self.root / 'mask.npy', mmap_mode='r')
+        self.fields = sorted(p.stem for p in self.root.glob('*.npy') if p.stem not in _INDEX_FILES)
+        self._arrays = {}
+
+    @classmethod
+    def write(cls, df: pd.DataFrame, root=None) -> 'PanelStore':
+        """
+        把行情写成面板库并返回打开后的 PanelStore。
+
+        df 为 Dataloader 读出的长表（以日期为索引、带 symbol 列），或 (date, symbol) 双层索引的长表。
+        只保存数值列，一律存成 float64；对齐日历加上的 valid 列不保存（mask 已记录哪些格子有行情）。
+        目录里已有的同名字段被覆盖。
+        """
+        root = Path(root) if root is not None else config.DATA_DIR_PANEL
+        root.mkdir(parents=True, exist_ok=True)
+        if not isinstance(df.index, pd.MultiIndex):
+            df = df.set_index([pd.to_datetime(df.index), 'symbol'])
+        panel = Panel(df.index)
+        arrays = {'dates': np.asarray(panel.dates),
+                  'symbols': np.asarray(panel.symbols.astype(str), dtype=str),
+                  'mask': panel.mask}
+        for col in df.columns:
+            if col != 'valid' and pd.api.types.is_numeric_dtype(df[col]):
+                arr = np.full(panel.shape, np.nan)
+                arr[panel.rows, panel.cols] = df[col].to_numpy(dtype=np.float64)
+                arrays[col] = arr
+        for name, arr in arrays.items():
+            # 先写临时文件再替换，正在映射旧文件的进程不受影响
+            tmp = root / (name + '.tmp')
+            with open(tmp, 'wb') as f:
+                np.save(f, arr)
+            os.replace(tmp, root / (name + '.npy'))
+        return cls(root)
+
+    @classmethod
+    def from_dataloader(cls, loader, root=None) -> 'PanelStore':
+        """
+        用任意 Dataloader（CSV、Parquet……）读出的原始行情建库。不对齐日历：停牌日不存成行情，
+        MmapDataloader 读取时再像其他加载器一样对齐。
+        """
+        return cls.write(loader.load(align=False), root)
+
+    def array(self, field) -> np.ndarray:
+        """字段的只读映射，形状为 (日期数, 标的数)。"""
+        if field not in self._arrays:
+            if field not in self.fields:
+                raise KeyError(field)
+            self._arrays[field] = np.load(self.root / (field + '.npy'), mmap_mode='r')
+        return self._arrays[field]
+
+    def _select(self, start_date=None, end_date=None, symbols=None):
+        # 日期是连续切片（映射上的视图）；只有指定了标的或有空行空列时才会花式索引出副本
+        start = self.dates.searchsorted(pd.Timestamp(start_date)) if start_date else 0
+        end = self.dates.searchsorted(pd.Timestamp(end_date), side='right') if end_date else len(self.dates)
+        rows = slice(start, end)
+        cols = slice(None)
+        if symbols:
+            cols = np.sort(self.symbols.get_indexer([str(s) for s in symbols]))
+            cols = cols[cols >= 0]
+        mask = self.mask[rows][:, cols]
+        # 整行、整列都缺失的日期和标的不会出现在长表的索引里，去掉后面板才与之对齐
+        keep_rows, keep_cols = mask.any(axis=1), mask.any(axis=0)
+        if not keep_rows.all():
+            rows = np.arange(start, end)[keep_rows]
+        if not keep_cols.all():
+            cols = np.arange(len(self.symbols))[cols][keep_cols]
+        return rows, cols
+
+    def _take(self, arr, rows, cols):
+        arr = arr[rows]
+        return arr if isinstance(cols, slice) else arr[:, cols]
+
+    def index(self, start_date=None, end_date=None, symbols=None) -> pd.MultiIndex:
+        """选中范围内有行情的 (date, symbol) 双层索引，先按日期再按标的排序。"""
+        rows, cols = self._select(start_date, end_date, symbols)
+        r, c = np.nonzero(self._take(self.mask, rows, cols))
+        dates, symbols = self.dates[rows], self.symbols[cols]
+        return pd.MultiIndex.from_arrays([dates[r], symbols[c]], names=['date', 'symbol'])
+
+    def arrays(self, fields=None, start_date=None, end_date=None, symbols=None, ffill=None) -> dict:
+        """
+        选中范围内各字段的 (日期 × 标的) 数组，与 index() 给出的面板对齐。
+
+        ffill 为同形状的布尔数组（对齐日历后长表的面板 mask）时，其中停牌的格子取该标的之前最近一条行情，
+        与 align_calendar 的向前填充一致，此时返回副本；ffill 与库里的 mask 相同时仍返回映射上的视图。
+        """
+        rows, cols = self._select(start_date, end_date, symbols)
+        fields = fields if fields is not None else self.fields
+        mask = self._take(self.mask, rows, cols)
+        if ffill is None or np.array_equal(ffill, mask):
+            return {f: self._take(self.array(f), rows, cols) for f in fields}
+        steps = np.arange(len(mask))[:, None]
+        last = np.maximum.accumulate(np.where(mask, steps, -1), axis=0)
+        r, c = np.nonzero(ffill)
+        source = last[r, c]
+        arrays = {}
+        for f in fields:
+            arr = self._take(self.array(f), rows, cols)
+            filled = np.full(arr.shape, np.nan, dtype=arr.dtype)
+            filled[r, c] = arr[source, c]
+            arrays[f] = filled
+        return arrays
+
+    def load(self, fields=None, start_date=None, end_date=None, symbols=None) -> pd.DataFrame:
+        """读成与 Dataloader 相同的长表：以日期为索引、带 symbol 列。"""
+        rows, cols = self._select(start_date, end_date, symbols)
+        mask = self._take(self.mask, rows, cols)
+        index = self.index(start_date, end_date, symbols)
+        df = pd.DataFrame({f: self._take(self.array(f), rows, cols)[mask]
+                           for f in (fields if fields is not None else self.fields)}, index=index)
+        return df.reset_index('symbol')
+
+    def calc_exprs(self, exprs, names=None, start_date=None, end_date=None, symbols=None):
+        """
+        直接在映射的数组上用面板后端计算一组表达式，返回 (date, symbol) 双层索引的序列。
+        只读取表达式用到的字段。
+        """
+        used = set()
+        for expr in exprs:
+            used |= compile_expr(expr).columns
+        fields = [f for f in self.fields if f in used]
+        df = pd.DataFrame(index=self.index(start_date, end_date, symbols))
+        arrays = {f: dtypes.cast(arr) for f, arr in self.arrays(fields, start_date, end_date, symbols).items()}
+        return list(iter_exprs(df, exprs, names, backend='panel', arrays=arrays))
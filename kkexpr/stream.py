@@ -0,0 +1,562 @@
+"""
+逐 bar 增量计算因子。
+
+StreamEngine 把一组表达式编译成与批量计算相同的 DAG，每个时间序列算子节点持有一份
+按标的展开的滚动状态（窗口缓冲区、滚动和等），每来一根 bar 的截面只用新值更新状态，
+耗时与标的数成正比，与历史长度无关：
+
+- ts_sum / ts_mean / ts_std / zscore / ts_skew / ts_kurt、对时间的回归（ts_slope / ts_rsquare / ts_resi）、
+  ts_corr / ts_cov / slope_pair 维护滚动幂和，每个标的每 window 根 bar 用缓冲区重算一次，避免累积误差；
+- ts_delay / ts_delta / ts_pct_change 只取缓冲区里 d 根之前的值；
+- 极值及其位置（ts_max / ts_min / ts_maxmin / ts_argmax / ts_argmin / ts_argmaxmin）维护单调队列；
+- 以上每根 bar 的开销都是 O(1)，与窗口长度无关。只有 ts_rank、ts_median、ts_quantile 仍在长度为 window 的
+  缓冲区上对全部标的向量化计算，每根 bar O(window)；
+- rank 等截面算子在当根 bar 的截面上计算。
+
+某根 bar 里没有出现的标的（停牌）状态不前进，与批量计算时逐标的压实序列的语义一致，
+所以逐 bar 的结果与 calc_exprs 的批量结果一致（浮点舍入误差以内）。
+唯一的例外是对滚动结果再做排名、而不同标的的滚动结果在数学上恰好相等的情形：
+两边的舍入误差不同，并列可能被拆成不同的先后。
+"""
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from kkexpr import kernels
+from kkexpr.expr import BinOp, Call, Column, Const, ExprNode, UnaryOp, compile_expr
+
+
+class _StreamOp:
+    """流式算子：update 接收当根 bar 各输入的向量（长度为标的数）和出现的标的，返回输出向量。"""
+    state = ()  # 滚动状态的属性名
+
+    def update(self, present, *values):
+        raise NotImplementedError
+
+
+class _Rolling(_StreamOp):
+    """每个标的一个长度为 window 的环形缓冲区，count 为该标的已推入的 bar 数。"""
+    state = ('buf', 'count')
+
+    def __init__(self, n, window, series=1):
+        self.window = int(window)
+        if self.window < 1:
+            raise ValueError('窗口长度必须为正: {}'.format(window))
+        self.buf = np.full((series, self.window, n), np.nan)
+        self.count = np.zeros(n, dtype=np.int64)
+
+    def update(self, present, *values):
+        idx = np.flatnonzero(present)
+        slot = self.count[idx] % self.window
+        old = self.buf[:, slot, idx]
+        new = np.stack([np.broadcast_to(np.asarray(v, dtype=np.float64), present.shape)[idx] for v in values])
+        self.buf[:, slot, idx] = new
+        self.count[idx] += 1
+        out = np.full(len(present), np.nan)
+        out[idx] = self._value(idx, old, new)
+        return out
+
+    def _ordered(self, idx):
+        # 按时间顺序排列的窗口 (series, window, k)，最早的在前；推入不足 window 根时前面是 NaN
+        rows = (self.count[idx] + np.arange(self.window)[:, None]) % self.window
+        return self.buf[:, rows, idx]
+
+    def _value(self, idx, old, new):
+        raise NotImplementedError
+
+
+class _Delay(_Rolling):
+    def __init__(self, n, periods, kind='delay'):
+        if periods < 0:
+            raise ValueError('流式计算不能使用未来数据: 滞后期数 {}'.format(periods))
+        super(_Delay, self).__init__(n, periods + 1)
+        self.kind = kind
+
+    def _value(self, idx, old, new):
+        count = self.count[idx]
+        prev = self.buf[0, (count - self.window) % self.window, idx]
+        prev = np.where(count >= self.window, prev, np.nan)
+        cur = new[0]
+        if self.kind == 'delta':
+            return cur - prev
+        if self.kind == 'pct':
+            return cur / prev - 1
+        return prev
+
+
+class _Moments(_Rolling):
+    """
+    滚动矩：累加以 offset 为中心的一到四阶幂和 s1..s4，以及按窗口内时间序号 0..window-1 加权的和 st，
+    每根 bar 只做 O(1) 的加减。offset 先取每个标的第一个有效值，每推入 window 根换成窗口均值并重算一次，
+    滚动加减的误差不会一直累积。
+    """
+    state = _Rolling.state + ('valid', 's1', 's2', 's3', 's4', 'st', 'offset', 'run')
+
+    def __init__(self, n, window, kind, min_periods=None):
+        super(_Moments, self).__init__(n, window)
+        self.kind = kind
+        self.min_periods = self.window if min_periods is None else max(int(min_periods), 2)
+        self.valid = np.zeros(n, dtype=np.int64)
+        for name in ('s1', 's2', 's3', 's4', 'st'):
+            setattr(self, name, np.zeros(n))
+        self.offset = np.full(n, np.nan)
+        self.run = np.zeros(n, dtype=np.int64)  # 截至当根连续相等的有效值个数，用来判断窗口是否全是同一个值
+
+    def _accumulate(self, idx, old, new):
+        cur, out = new[0], old[0]
+        unset = np.isnan(self.offset[idx]) & ~np.isnan(cur)
+        self.offset[idx[unset]] = cur[unset]
+        offset = self.offset[idx]
+        c_new = np.where(np.isnan(cur), 0.0, cur - offset)
+        c_old = np.where(np.isnan(out), 0.0, out - offset)
+        # 窗口前移一格：留下的值时间序号各减一，最早的一根移出，新的一根序号为 window-1
+        self.st[idx] += c_old - self.s1[idx] + (self.window - 1) * c_new
+        for values, c, sign in ((cur, c_new, 1), (out, c_old, -1)):
+            c2 = c * c
+            self.valid[idx] += sign * ~np.isnan(values)
+            self.s1[idx] += sign * c
+            self.s2[idx] += sign * c2
+            self.s3[idx] += sign * c2 * c
+            self.s4[idx] += sign * c2 * c2
+        resync = idx[self.count[idx] % self.window == 0]
+        if len(resync):
+            win = self.buf[0][:, resync]  # count 是 window 的整数倍时，缓冲区正好按时间顺序排列
+            ok = ~np.isnan(win)
+            valid = ok.sum(axis=0)
+            total = np.where(ok, win, 0.0).sum(axis=0)
+            self.offset[resync] = np.where(valid > 0, total / np.maximum(valid, 1), self.offset[resync])
+            c = np.where(ok, win - self.offset[resync], 0.0)
+            c2 = c * c
+            self.valid[resync] = valid
+            self.s1[resync] = c.sum(axis=0)
+            self.s2[resync] = c2.sum(axis=0)
+            self.s3[resync] = (c2 * c).sum(axis=0)
+            self.s4[resync] = (c2 * c2).sum(axis=0)
+            self.st[resync] = np.arange(self.window) @ c
+
+    def _value(self, idx, old, new):
+        self._accumulate(idx, old, new)
+        w, count, valid = self.window, self.count[idx], self.valid[idx]
+        s1, s2, offset = self.s1[idx], self.s2[idx], self.offset[idx]
+        cur = new[0]
+        if self.kind == 'zscore':
+            mean = s1 / valid
+            ss = s2 - s1 * mean
+            ok = (count >= self.min_periods) & (valid >= self.min_periods) & ~np.isnan(cur) & (ss > 1e-12 * s2)
+            return np.where(ok, (cur - offset - mean) / np.sqrt(np.maximum(ss, 0) / (valid - 1)), np.nan)
+        full = (count >= w) & (valid == w)
+        if self.kind == 'sum':
+            value = s1 + w * offset
+        elif self.kind == 'mean':
+            value = s1 / w + offset
+        elif self.kind == 'std':
+            value = np.sqrt(np.maximum((s2 - s1 * s1 / w) / (w - 1), 0.0)) if w > 1 else np.full(len(idx), np.nan)
+        elif self.kind in ('skew', 'kurt'):
+            prev = old[0] if w == 1 else self.buf[0, (count - 2) % w, idx]
+            self.run[idx] = np.where(np.isnan(cur), 0, np.where(cur == prev, self.run[idx] + 1, 1))
+            value = _skew_kurt(s1, s2, self.s3[idx], self.s4[idx], w, self.kind, self.run[idx] >= w)
+        else:  # 对时间序号 0..window-1 的回归：slope / rsquare / resi
+            value = _time_ols(s1, s2, self.st[idx], cur - offset, w, self.kind)
+        return np.where(full, value, np.nan)
+
+
+class _Pair(_Rolling):
+    """成对滚动矩：输入 (y, x)，两者都有效的 bar 才计入。"""
+    state = _Rolling.state + ('valid', 'sx', 'sy', 'sxx', 'syy', 'sxy', 'ox', 'oy')
+
+    def __init__(self, n, window, kind, atol=2e-05):
+        super(_Pair, self).__init__(n, window, series=2)
+        self.kind = kind
+        self.atol = atol
+        self.valid = np.zeros(n, dtype=np.int64)
+        for name in ('sx', 'sy', 'sxx', 'syy', 'sxy'):
+            setattr(self, name, np.zeros(n))
+        self.ox = np.full(n, np.nan)
+        self.oy = np.full(n, np.nan)
+
+    def _sums(self, y, x, idx):
+        ok = ~(np.isnan(x) | np.isnan(y))
+        cx = np.where(ok, x - self.ox[idx], 0.0)
+        cy = np.where(ok, y - self.oy[idx], 0.0)
+        return ok.sum(axis=0) if ok.ndim > 1 else ok, cx, cy
+
+    def _accumulate(self, idx, old, new):
+        unset = np.isnan(self.ox[idx]) & ~(np.isnan(new[0]) | np.isnan(new[1]))
+        self.oy[idx[unset]] = new[0][unset]
+        self.ox[idx[unset]] = new[1][unset]
+        for (y, x), sign in ((new, 1), (old, -1)):
+            ok, cx, cy = self._sums(y, x, idx)
+            self.valid[idx] += sign * ok
+            self.sx[idx] += sign * cx
+            self.sy[idx] += sign * cy
+            self.sxx[idx] += sign * cx * cx
+            self.syy[idx] += sign * cy * cy
+            self.sxy[idx] += sign * cx * cy
+        resync = idx[self.count[idx] % self.window == 0]
+        if len(resync):
+            ok, cx, cy = self._sums(self.buf[0][:, resync], self.buf[1][:, resync], resync)
+            self.valid[resync] = ok
+            self.sx[resync], self.sy[resync] = cx.sum(axis=0), cy.sum(axis=0)
+            self.sxx[resync], self.syy[resync] = (cx * cx).sum(axis=0), (cy * cy).sum(axis=0)
+            self.sxy[resync] = (cx * cy).sum(axis=0)
+
+    def _value(self, idx, old, new):
+        self._accumulate(idx, old, new)
+        w = self.window
+        sx, sy = self.sx[idx], self.sy[idx]
+        var_x = np.maximum(self.sxx[idx] - sx * sx / w, 0.0)
+        var_y = np.maximum(self.syy[idx] - sy * sy / w, 0.0)
+        cov = self.sxy[idx] - sx * sy / w
+        full = (self.count[idx] >= w) & (self.valid[idx] == w)
+        if self.kind == 'slope':
+            value = np.where(var_x > 0, cov / var_x, np.nan)
+        elif w < 2:
+            value = np.full(len(idx), np.nan)
+        elif self.kind == 'cov':
+            value = cov / (w - 1)
+        else:
+            degenerate = (np.sqrt(var_x / (w - 1)) <= self.atol) | (np.sqrt(var_y / (w - 1)) <= self.atol)
+            value = np.where(degenerate, np.nan, np.clip(cov / np.sqrt(var_x * var_y), -1.0, 1.0))
+        return np.where(full, value, np.nan)
+
+
+class _Extremum(_Rolling):
+    """
+    窗口极值与位置：每个标的一个单调队列（环形存放 bar 的序号，队首是窗口里的最大值），
+    新值从队尾挤掉不比它大的值，队首移出窗口时出队，每根 bar 均摊 O(1)。最小值对取反的值维护另一个队列。
+    并列时保留最早的位置，与批量的 argmax、argmin 一致。
+    """
+    state = _Rolling.state + ('valid', 'queue', 'head', 'tail')
+
+    def __init__(self, n, window, kind):
+        super(_Extremum, self).__init__(n, window)
+        self.kind = kind
+        signs = {'max': (1.0,), 'argmax': (1.0,), 'min': (-1.0,), 'argmin': (-1.0,)}
+        self.signs = signs.get(kind, (1.0, -1.0))
+        self.valid = np.zeros(n, dtype=np.int64)
+        self.queue = np.zeros((len(self.signs), self.window, n), dtype=np.int64)
+        self.head = np.zeros((len(self.signs), n), dtype=np.int64)
+        self.tail = np.zeros((len(self.signs), n), dtype=np.int64)
+
+    def _push(self, k, idx, cur, pos):
+        # 序号 pos 的值 cur 入队，返回队首的序号；队列为空（窗口里没有有效值）时为 -1
+        w, sign = self.window, self.signs[k]
+        queue, head, tail = self.queue[k], self.head[k], self.tail[k]
+        expired = idx[(tail[idx] > head[idx]) & (queue[head[idx] % w, idx] <= pos - w)]
+        head[expired] += 1
+        ok = ~np.isnan(cur)
+        active, value = idx[ok], sign * cur[ok]
+        while len(active):
+            back = (tail[active] - 1) % w
+            smaller = (tail[active] > head[active]) & (sign * self.buf[0, queue[back, active] % w, active] < value)
+            active, value = active[smaller], value[smaller]
+            tail[active] -= 1
+        queue[tail[idx[ok]] % w, idx[ok]] = pos[ok]
+        tail[idx[ok]] += 1
+        return np.where(tail[idx] > head[idx], queue[head[idx] % w, idx], -1)
+
+    def _value(self, idx, old, new):
+        w, count, cur = self.window, self.count[idx], new[0]
+        self.valid[idx] += ~np.isnan(cur)
+        self.valid[idx] -= ~np.isnan(old[0])
+        fronts = [self._push(k, idx, cur, count - 1) for k in range(len(self.signs))]
+        if self.kind.startswith('arg'):
+            # 相对窗口起点的位置，推入不足 window 根时窗口从第一根开始
+            start = np.maximum(count - w, 0)
+            pos = [np.where(front >= 0, front - start, np.nan) for front in fronts]
+            return pos[0] - pos[1] if self.kind == 'argmaxmin' else pos[0]
+        full = (count >= w) & (self.valid[idx] == w)
+        values = [self.buf[0, front % w, idx] for front in fronts]
+        if self.kind == 'maxmin':
+            high, low = values
+            value = (cur - low) / (high - low)
+        else:
+            value = values[0]
+        return np.where(full, value, np.nan)
+
+
+class _WindowStat(_Rolling):
+    """
+    直接在时间顺序的窗口上计算的排名、分位数：每根 bar 对全部标的做一次向量化的 O(window) 计算。
+    """
+
+    def __init__(self, n, window, kind, q=0.5):
+        super(_WindowStat, self).__init__(n, window)
+        self.kind = kind
+        self.q = float(q)
+
+    def _value(self, idx, old, new):
+        win = self._ordered(idx)[0]
+        w = self.window
+        full = (~np.isnan(win)).sum(axis=0) == w
+        if not full.any():
+            return np.full(len(idx), np.nan)
+        if self.kind == 'rank':
+            cur = win[-1]
+            less = (win < cur).sum(axis=0)
+            equal = (win == cur).sum(axis=0)
+            value = (less + (equal + 1) / 2.0) / w
+        else:
+            ordered = np.sort(win, axis=0)
+            pos = self.q * (w - 1)
+            lo = int(np.floor(pos))
+            hi = min(lo + 1, w - 1)
+            value = ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+        return np.where(full, value, np.nan)
+
+
+def _skew_kurt(s1, s2, s3, s4, n, kind, uniform):
+    # 与批量的 rolling_skew/kurt 相同：由窗口的幂和求中心矩，无偏修正；
+    # 窗口全是同一个值时 skew 为 0、kurt 为 -3，其余方差不超过 1e-14 的窗口为 NaN
+    if n < (3 if kind == 'skew' else 4):
+        return np.full(len(s1), np.nan)
+    a = s1 / n
+    b = s2 / n - a * a
+    if kind == 'skew':
+        c = s3 / n - 3 * a * s2 / n + 2 * a ** 3
+        value = np.sqrt(n * (n - 1)) / (n - 2) * c / b ** 1.5
+    else:
+        d = s4 / n - 4 * a * s3 / n + 6 * a * a * s2 / n - 3 * a ** 4
+        value = ((n * n - 1) * d / (b * b) - 3 * (n - 1) ** 2) / ((n - 2) * (n - 3))
+    value = np.where(b <= 1e-14, np.nan, value)
+    return np.where(uniform, 0.0 if kind == 'skew' else -3.0, value)
+
+
+def _time_ols(s1, s2, st, last, n, kind):
+    # 对时间序号 0..n-1 的回归，由以 offset 为中心的幂和 s1、s2 和时间加权和 st 算出；last 为最新一根减去 offset
+    sxx = n * (n * n - 1) / 12.0
+    if sxx <= 0:
+        return np.full(len(s1), np.nan)
+    cov = st - (n - 1) / 2.0 * s1
+    slope = cov / sxx
+    if kind == 'slope':
+        return slope
+    if kind == 'rsquare':
+        return cov * cov / (sxx * (s2 - s1 * s1 / n))
+    return last - (s1 / n + slope * (n - 1) / 2.0)
+
+
+class _Rank(_StreamOp):
+    def update(self, present, values):
+        values = np.where(present, np.asarray(values, dtype=np.float64), np.nan)
+        return kernels.rank_pct(values[None, :])[0]
+
+
+# 算子名 -> (序列参数个数, 构造函数)；其余参数与批量算子同名同默认值，必须是常数
+_STREAM_OPS = {
+    'ts_delay': (1, lambda n, periods: _Delay(n, periods)),
+    'shift': (1, lambda n, periods: _Delay(n, periods)),
+    'ts_delta': (1, lambda n, periods: _Delay(n, periods, 'delta')),
+    'ts_pct_change': (1, lambda n, periods: _Delay(n, periods, 'pct')),
+    'roc': (1, lambda n, periods: _Delay(n, periods, 'pct')),
+    'ts_sum': (1, lambda n, d: _Moments(n, d, 'sum')),
+    'ts_mean': (1, lambda n, d: _Moments(n, d, 'mean')),
+    'ts_std': (1, lambda n, d: _Moments(n, d, 'std')),
+    'zscore': (1, lambda n, d, min_periods: _Moments(n, d, 'zscore', min_periods)),
+    'ts_corr': (2, lambda n, d: _Pair(n, d, 'corr')),
+    'ts_cov': (2, lambda n, d: _Pair(n, d, 'cov')),
+    'slope_pair': (2, lambda n, d: _Pair(n, d, 'slope')),
+    'ts_max': (1, lambda n, d: _Extremum(n, d, 'max')),
+    'ts_min': (1, lambda n, d: _Extremum(n, d, 'min')),
+    'ts_maxmin': (1, lambda n, d: _Extremum(n, d, 'maxmin')),
+    'ts_argmax': (1, lambda n, d: _Extremum(n, d, 'argmax')),
+    'ts_argmin': (1, lambda n, d: _Extremum(n, d, 'argmin')),
+    'ts_argmaxmin': (1, lambda n, d: _Extremum(n, d, 'argmaxmin')),
+    'ts_rank': (1, lambda n, d: _WindowStat(n, d, 'rank')),
+    'ts_median': (1, lambda n, d: _WindowStat(n, d, 'quantile', 0.5)),
+    'ts_quantile': (1, lambda n, d, q: _WindowStat(n, d, 'quantile', q)),
+    'ts_skew': (1, lambda n, d: _Moments(n, d, 'skew')),
+    'ts_kurt': (1, lambda n, d: _Moments(n, d, 'kurt')),
+    'ts_slope': (1, lambda n, d: _Moments(n, d, 'slope')),
+    'ts_rsquare': (1, lambda n, d: _Moments(n, d, 'rsquare')),
+    'ts_resi': (1, lambda n, d: _Moments(n, d, 'resi')),
+    'rank': (1, lambda n: _Rank()),
+}
+
+# 快照格式或算子状态的布局变化时加一，旧快照随之失效
+_SNAPSHOT_VERSION = 2
+
+# 逐标的包装、但只是逐元素计算的算子，直接作用在截面向量上
+_ELEMENTWISE = {'abs', 'sqrt', 'log', 'inv', 'sign'}
+
+
+def _bind(node: Call):
+    """把调用节点的参数按批量算子的签名展开，返回 (序列参数节点, 常数参数值)。"""
+    series = _STREAM_OPS[node.name][0]
+    bound = inspect.signature(node.func).bind(*node.args, **dict(node.kwargs))
+    bound.apply_defaults()
+    values = list(bound.arguments.values())
+    params = []
+    for value in values[series:]:
+        if isinstance(value, Const):
+            value = value.value
+        elif isinstance(value, ExprNode):
+            raise ValueError('流式计算要求 {} 的参数为常数: {}'.format(node.name, value.key))
+        params.append(value)
+    return values[:series], params
+
+
+
+class StreamEngine:
+    """
+    逐 bar 增量计算一组因子。
+
+    engine = StreamEngine(fields, names, symbols)
+    engine.update(bar)  # bar 为一根 bar 的截面，以 symbol 为索引（或带 symbol 列）
+    engine.save(path)   # 保存滚动状态，重启后用 StreamEngine.load 接着更新
+
+    fields 可以是表达式文本或 Factor。names 给出时，后面的表达式可以按名字引用前面表达式的结果，
+    与 calc_exprs 相同。
+    """
+
+    def __init__(self, fields, names=None, symbols=()):
+        self.fields = [str(field) for field in fields]
+        self.names = list(names) if names is not None else list(self.fields)
+        self.symbols = pd.Index(symbols)
+        self.last_date = None
+        self.roots = [compile_expr(field).root for field in self.fields]
+        self.ops = {}  # 节点 key -> (流式算子, 序列参数节点)
+        stack = list(self.roots)
+        while stack:
+            node = stack.pop()
+            if node.key in self.ops:
+                continue
+            if isinstance(node, Call):
+                self.ops[node.key] = self._make_op(node)
+            stack.extend(node.children)
+
+    def _make_op(self, node: Call):
+        if node.name in _STREAM_OPS:
+            inputs, params = _bind(node)
+            return _STREAM_OPS[node.name][1](len(self.symbols), *params), inputs
+        if node.name in _ELEMENTWISE:
+            func = node.func.__wrapped__
+            return (lambda *args: np.asarray(func(pd.Series(args[0]), *args[1:]), dtype=np.float64)), None
+        if hasattr(node.func, 'calc_by') or hasattr(node.func, 'panel_func') or node.name in ('scale', 'decay_linear'):
+            raise ValueError('流式计算不支持的算子: {}'.format(node.name))
+        return node.func, None  # greater、np.where 等逐元素函数
+
+    @classmethod
+    def from_history(cls, fields, names, df: pd.DataFrame):
+        """用 (date, symbol) 双层索引的历史行情逐 bar 预热，返回可以接着 update 的引擎。"""
+        engine = cls(fields, names, df.index.get_level_values(1).unique().sort_values())
+        engine.replay(df, collect=False)
+        return engine
+
+    def replay(self, df: pd.DataFrame, collect=True):
+        """按日期逐 bar 推入 (date, symbol) 双层索引的行情，collect 时返回与 df 同索引的结果。"""
+        results = []
+        for date, bar in df.groupby(level=0, sort=True):
+            out = self.update(bar.droplevel(0), date)
+            if collect:
+                out.index = pd.MultiIndex.from_product([[date], out.index], names=df.index.names)
+                results.append(out)
+        if collect:
+            return pd.concat(results).reindex(df.index) if results else pd.DataFrame(columns=self.names)
+
+    def update(self, bar: pd.DataFrame, date=None) -> pd.DataFrame:
+        """推入一根 bar，返回出现在这根 bar 里的各标的的因子值。date 记录在快照里，便于确认从哪里接着推。"""
+        if 'symbol' in bar.columns:
+            bar = bar.set_index('symbol')
+        pos = self.symbols.get_indexer(bar.index)
+        if (pos < 0).any():
+            raise KeyError('未知标的: {}'.format(list(bar.index[pos < 0])))
+        present = np.zeros(len(self.symbols), dtype=bool)
+        present[pos] = True
+        env = _BarEnv(bar, pos, present)
+        with np.errstate(all='ignore'):
+            for root, name in zip(self.roots, self.names):
+                env.outputs[name] = self._eval(root, env)
+        if date is not None:
+            self.last_date = date
+        return pd.DataFrame({name: np.broadcast_to(env.outputs[name], present.shape)[pos] for name in self.names},
+                            index=bar.index)
+
+    @property
+    def plan_hash(self):
+        """表达式计划的指纹：表达式、名字、标的和每个有状态算子（含参数）都一致，快照才能复用。"""
+        ops = sorted('{}:{}'.format(key, type(op).__name__) for key, (op, _) in self.ops.items()
+                     if isinstance(op, _StreamOp))
+        plan = dict(version=_SNAPSHOT_VERSION, exprs=[root.key for root in self.roots], names=self.names,
+                    symbols=[str(s) for s in self.symbols], ops=ops)
+        return hashlib.sha1(json.dumps(plan, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _states(self):
+        # 有状态算子按 key 排序编号，快照里的数组名为 “编号/属性名”
+        stateful = sorted((key, op) for key, (op, _) in self.ops.items() if isinstance(op, _StreamOp) and op.state)
+        for i, (key, op) in enumerate(stateful):
+            for attr in op.state:
+                yield '{}/{}'.format(i, attr), op, attr
+
+    def save(self, path):
+        """把全部滚动状态写成一个 .npz 快照（先写临时文件再替换）。"""
+        arrays = {name: getattr(op, attr) for name, op, attr in self._states()}
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'wb') as f:
+            np.savez(f, __plan__=self.plan_hash,
+                     __last_date__=str(self.last_date) if self.last_date is not None else '', **arrays)
+        os.replace(tmp, path)
+
+    def restore(self, path):
+        """从快照恢复滚动状态；快照对应的表达式计划与当前不一致时抛 ValueError。"""
+        with np.load(path, allow_pickle=False) as snapshot:
+            if str(snapshot['__plan__']) != self.plan_hash:
+                raise ValueError('快照 {} 与当前的表达式计划不一致，需要用历史行情重新预热'.format(path))
+            for name, op, attr in self._states():
+                current = getattr(op, attr)
+                value = snapshot[name]
+                if value.shape != current.shape or value.dtype != current.dtype:
+                    raise ValueError('快照 {} 中 {} 的形状或类型与当前不一致'.format(path, name))
+                setattr(op, attr, value.copy())
+            last_date = str(snapshot['__last_date__'])
+        self.last_date = pd.Timestamp(last_date) if last_date else None
+        return self
+
+    @classmethod
+    def load(cls, path, fields, names=None, symbols=()):
+        return cls(fields, names, symbols).restore(path)
+
+    def _eval(self, node, env):
+        if node.key in env.values:
+            return env.values[node.key]
+        if isinstance(node, Column):
+            value = env.column(node.name)
+        elif isinstance(node, Const):
+            value = node.value
+        elif isinstance(node, BinOp):
+            value = node.func(self._eval(node.left, env), self._eval(node.right, env))
+        elif isinstance(node, UnaryOp):
+            value = node.func(self._eval(node.operand, env))
+        else:
+            op, inputs = self.ops[node.key]
+            if inputs is not None:
+                value = op.update(env.present, *[self._eval(arg, env) for arg in inputs])
+            else:
+                args = [self._eval(arg, env) for arg in node.args]
+                value = op(*args, **{k: self._eval(arg, env) for k, arg in node.kwargs})
+        env.values[node.key] = value
+        return value
+
+
+class _BarEnv:
+    """一根 bar 的求值环境：列展开成按全部标的排列的向量，缺席的标的为 NaN。"""
+
+    def __init__(self, bar, pos, present):
+        self.bar = bar
+        self.pos = pos
+        self.present = present
+        self.values = {}
+        self.outputs = {}
+
+    def column(self, name):
+        if name in self.outputs:
+            return self.outputs[name]
+        if name not in self.bar.columns:
+            raise KeyError(name)
+        values = np.full(len(self.present), np.nan)
+        values[self.pos] = self.bar[name].to_numpy(dtype=np.float64)
+        return values
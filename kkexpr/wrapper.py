@@ -2,7 +2,9 @@ import ast
 import re
 from typing import List, Union
 import pandas as pd
-from kkexpr.expr import calc_expr
+from kkexpr.dataloader import load_history
+from kkexpr.expr import calc_expr, compile_expr
+from kkexpr.stream import StreamEngine
 from kkdatac import get_price
 # Define the get_dependencies function
 def get_dependencies(expression: str) -> List[str]:
@@ -14,6 +16,12 @@ def get_dependencies(expression: str) -> List[str]:
     dependencies = list(set(matches))
     return dependencies
 
+def _bars_per_day(frequency):
+    # '1d' 为日线；'5m' 等分钟线按 A 股每天 240 分钟换算
+    m = re.fullmatch(r'(\d+)m', str(frequency))
+    return max(240 // int(m.group(1)), 1) if m else 1
+
+
 # Define the expression_tree function
 class ExprNode:
     def __init__(self, value: Union[str, ast.AST], left: 'ExprNode' = None, right: 'ExprNode' = None):
@@ -101,9 +109,33 @@ class Factor:
         df = get_price(order_book_ids=order_book_ids, frequency=frequency, start_date=start_date, end_date=end_date)
         return calc_expr(df, Factor.expression)
 
-    def execute(self, order_book_ids, frequency, start_date, end_date):
-        df = get_price(order_book_ids=order_book_ids, frequency=frequency, start_date=start_date, end_date=end_date)
-        return calc_expr(df, self.expression)
+    def execute(self, order_book_ids, frequency, start_date, end_date, cache=None):
+        """
+        计算 [start_date, end_date] 内的因子值。按表达式的回看、前视多取前后的行情（见 expr.required_history），
+        自然日估计的范围不够时加倍重取（见 dataloader.load_history），第一行就是完整的值，结果再裁回请求的区间。
+        """
+        plan = compile_expr(self.expression)
+
+        def read(fetch_start, fetch_end):
+            return get_price(order_book_ids=order_book_ids, frequency=frequency,
+                             start_date=fetch_start.strftime('%Y%m%d'), end_date=fetch_end.strftime('%Y%m%d'))
+
+        df = load_history(read, start_date, end_date, plan.lookback, plan.horizon, bars_per_day=_bars_per_day(frequency))
+        if cache is not None:  # FactorCache，只计算缓存里没有的日期
+            se = cache.calc_expr(df, self.expression, source=frequency)
+        else:
+            se = calc_expr(df, self.expression)
+        dates = pd.to_datetime(se.index.get_level_values(0)).normalize()
+        return se[(dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))]
+
+    def stream(self, symbols, snapshot=None):
+        """
+        返回逐 bar 计算这个因子的 StreamEngine。
+        snapshot 为之前 engine.save 写下的快照时直接恢复滚动状态，不必用历史行情重新预热。
+        """
+        if snapshot is not None:
+            return StreamEngine.load(snapshot, [self], [self.expression], symbols)
+        return StreamEngine([self], [self.expression], symbols)
     
 if __name__ == '__main__':
     # Predefined factors
@@ -0,0 +1,34 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+
+spec = importlib.util.spec_from_file_location(
+    'bench_factors', Path(__file__).resolve().parent.parent / 'benchmarks' / 'bench_factors.py')
+bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench)
+
+
+def test_synthetic_panel():
+    df = bench.make_panel(n_symbols=5, n_dates=40, seed=1)
+    assert len(df) == 200 and df.index.names == ['date', 'symbol']
+    assert (df['high'] >= df[['open', 'close']].max(axis=1)).all()
+    assert (df['low'] <= df[['open', 'close']].min(axis=1)).all()
+    np.testing.assert_allclose(df.xs('000000.SZ', level='symbol')['adv20'].iloc[19],
+                               df.xs('000000.SZ', level='symbol')['volume'].iloc[:20].mean())
+    assert len(bench.make_panel(n_symbols=5, n_dates=40, missing=0.2)) < 200
+
+
+def test_run_and_compare():
+    df = bench.make_panel(n_symbols=4, n_dates=80)
+    results = bench.run(df, backends=['panel'], repeat=1, pattern=r'op/panel/ts_mean$|alpha158|alpha101$|wq101/panel$',
+                        log=lambda *args: None)
+    assert set(results) == {'op/panel/ts_mean', 'alpha158/panel', 'wq101/panel/alpha101', 'wq101/panel'}
+    assert results['op/panel/ts_mean']['expr'] == 'ts_mean(close, 10)'
+    for record in results.values():
+        assert record['seconds'] > 0 and record['peak_bytes'] > 0
+
+    baseline = {key: dict(r, seconds=r['seconds'] / 10) for key, r in results.items()}
+    baseline['op/panel/ts_mean']['seconds'] = results['op/panel/ts_mean']['seconds']
+    table, regressions = bench.compare(results, baseline)
+    assert {row[0] for row in regressions} == set(results) - {'op/panel/ts_mean'}
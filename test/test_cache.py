@@ -0,0 +1,64 @@
+import numpy as np
+
+from kkexpr.cache import FactorCache
+from kkexpr.expr import calc_exprs
+from test_expr import make_df
+
+EXPRS = ['ts_mean(close, 5) / close', 'rank(ts_delta(volume, 3))', 'a * 2']
+NAMES = ['a', 'b', 'c']
+
+
+def assert_same(results, expected):
+    for se, ex in zip(results, expected):
+        np.testing.assert_allclose(se.values, ex.values.astype(float), rtol=1e-9)
+
+
+def test_cache_reuses_and_appends(tmp_path, monkeypatch):
+    cache = FactorCache(tmp_path, warmup=10)
+    df = make_df(80)
+    head = df[df.index.get_level_values(0) < df.index.levels[0][60]]
+    assert_same(cache.calc_exprs(head, EXPRS, NAMES), calc_exprs(head, EXPRS, NAMES))
+    assert len(list(tmp_path.iterdir())) == 2  # 引用因子名字的表达式不进缓存
+
+    # 新增日期只从缺失处往前预热 warmup 天重新计算
+    import kkexpr.cache
+    seen = []
+    iter_exprs = kkexpr.cache.iter_exprs
+    monkeypatch.setattr(kkexpr.cache, 'iter_exprs', lambda sub, *a, **k: seen.append(len(sub)) or iter_exprs(sub, *a, **k))
+    assert_same(cache.calc_exprs(df, EXPRS, NAMES), calc_exprs(df, EXPRS, NAMES))
+    assert seen == [30 * 3]
+    seen.clear()
+    assert_same(cache.calc_exprs(df, EXPRS, NAMES), calc_exprs(df, EXPRS, NAMES))
+    assert seen == []
+
+
+def test_cache_detects_revised_data(tmp_path):
+    cache = FactorCache(tmp_path, warmup=10)
+    df = make_df(80)
+    cache.calc_exprs(df, EXPRS, NAMES)
+    df.iloc[150, df.columns.get_loc('close')] *= 1.1
+    assert_same(cache.calc_exprs(df, EXPRS, NAMES), calc_exprs(df, EXPRS, NAMES))
+
+
+def test_cache_eviction(tmp_path):
+    df = make_df(80)
+    cache = FactorCache(tmp_path)
+    cache.calc_exprs(df, EXPRS, NAMES)
+    entry_size = cache.size() / 2
+    cache = FactorCache(tmp_path, max_bytes=entry_size * 2.5)
+    cache.calc_exprs(df, ['ts_max(close, 3)'])
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_cache_keyed_by_dtype_and_backend(tmp_path):
+    from kkexpr.dtypes import float_dtype
+    df = make_df(80)
+    exprs = ['ts_mean(close, 5) / close']
+    cache = FactorCache(tmp_path)
+    cache.calc_exprs(df, exprs)
+    cache.calc_exprs(df, exprs, backend='panel')
+    with float_dtype('float32'):
+        results = cache.calc_exprs(df.astype('float32'), exprs, backend='panel')
+        expected = calc_exprs(df.astype('float32'), exprs, backend='panel')
+    assert len(list(tmp_path.iterdir())) == 3
+    np.testing.assert_array_equal(results[0].values, expected[0].values.astype(float))
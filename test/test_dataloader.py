@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from kkexpr import dtypes
+from kkexpr.dataloader import (CSVDataloader, Dataloader, MmapDataloader, ParquetDataloader, align_calendar,
+                               csv_to_parquet)
+from kkexpr.expr import calc_exprs
+from kkexpr.store import PanelStore
+from test_expr import make_df
+from test_panel import make_gapped_df
+
+
+def write_quotes(path, n_dates=300, gaps=0.0):
+    # 与 data/quotes 相同的格式：每个标的一个 CSV，date 为 YYYYMMDD 整数，按日期倒序；gaps 为随机删掉（停牌）的行的比例
+    df = make_df(n_dates, symbols=['000001.SZ', '600000.SH', '510300.SH'])
+    if gaps:
+        df = df[np.random.default_rng(2).random(len(df)) >= gaps]
+    df['high'] = df[['open', 'close']].max(axis=1)
+    df['low'] = df[['open', 'close']].min(axis=1)
+    for symbol, sub in df.groupby(level=1):
+        sub = sub.droplevel(1).reset_index()
+        sub['date'] = sub['date'].dt.strftime('%Y%m%d').astype(int)
+        sub.insert(0, 'symbol', symbol)
+        sub.iloc[::-1].to_csv(path / (symbol + '.csv'), index=False)
+    return sorted(df.index.levels[1])
+
+
+def test_parquet_loader_matches_csv(tmp_path):
+    pytest.importorskip('pyarrow')
+    symbols = write_quotes(tmp_path)
+    assert csv_to_parquet(tmp_path, tmp_path / 'parquet') == 900
+    fields, names = ['ts_mean(close, 5) / open', 'rank(volume)'], ['a', 'b']
+    kwargs = dict(symbols=symbols[:2], start_date='20200301', end_date='20201231')
+    expected = CSVDataloader(tmp_path, **kwargs).load(fields, names)
+    loader = ParquetDataloader(tmp_path / 'parquet', **kwargs)
+    df = loader.load(fields, names)
+    assert set(df.columns) == {'open', 'close', 'volume', 'symbol', 'valid', 'a', 'b'}  # 只读表达式用到的列
+    expected = expected[df.columns].reset_index().sort_values(['date', 'symbol'])
+    pd.testing.assert_frame_equal(df.reset_index(), expected.reset_index(drop=True), check_dtype=False)
+    assert loader.load().index.min() >= pd.Timestamp('20200301')
+
+
+def test_csv_to_parquet_in_batches(tmp_path):
+    pytest.importorskip('pyarrow')
+    symbols = write_quotes(tmp_path)
+    dst = tmp_path / 'parquet'
+    assert csv_to_parquet(tmp_path, dst, symbols[:1]) == 300
+    assert csv_to_parquet(tmp_path, dst, symbols[1:]) == 900
+    assert csv_to_parquet(tmp_path, dst, symbols[1:2]) == 900  # 重转已有的标的不重复
+    kwargs = dict(symbols=symbols, start_date='20200101', end_date='20211231')
+    df = ParquetDataloader(dst, **kwargs).load(align=False)
+    expected = CSVDataloader(tmp_path, **kwargs).load(align=False)
+    assert len(df) == 900
+    pd.testing.assert_frame_equal(df.reset_index().sort_values(['date', 'symbol']).reset_index(drop=True),
+                                  expected[df.columns].reset_index().sort_values(['date', 'symbol'])
+                                  .reset_index(drop=True), check_dtype=False)
+
+
+def test_mmap_loader_matches_csv(tmp_path):
+    symbols = write_quotes(tmp_path)
+    store = PanelStore.from_dataloader(CSVDataloader(tmp_path, symbols), tmp_path / 'panel')
+    assert isinstance(store.array('close'), np.memmap)
+    fields, names = ['ts_mean(close, 5) / open', 'rank(volume)', 'a - b'], ['a', 'b', 'c']
+    kwargs = dict(symbols=symbols[1:], start_date='20200301', end_date='20201231')
+    expected = CSVDataloader(tmp_path, **kwargs).load(fields, names)
+    for backend in ['pandas', 'panel']:
+        df = MmapDataloader(tmp_path / 'panel', **kwargs).load(fields, names, backend=backend)
+        assert set(df.columns) == {'open', 'close', 'volume', 'symbol', 'valid', 'a', 'b', 'c'}
+        ex = expected[df.columns].reset_index().sort_values(['date', 'symbol'])
+        pd.testing.assert_frame_equal(df.reset_index(), ex.reset_index(drop=True), check_dtype=False)
+
+
+def test_mmap_round_trip_keeps_suspensions(tmp_path, monkeypatch):
+    symbols = write_quotes(tmp_path, gaps=0.05)
+    csv = CSVDataloader(tmp_path, symbols, start_date='20200101', end_date='20201231')
+    store = PanelStore.from_dataloader(csv, tmp_path / 'panel')
+    assert 'valid' not in store.fields
+    fields, names = ['ts_mean(close, 5)'], ['a']
+    fallback = []
+    calc_exprs_df = Dataloader._calc_exprs
+    monkeypatch.setattr(Dataloader, '_calc_exprs', lambda self, *a: fallback.append(a[-1]) or calc_exprs_df(self, *a))
+    for limit in [None, 1]:
+        expected = csv.load(fields, names, ffill_limit=limit)
+        assert (~expected['valid']).sum() > 0
+        for backend in ['pandas', 'panel']:
+            df = MmapDataloader(tmp_path / 'panel', symbols, start_date='20200101', end_date='20201231').load(
+                fields, names, backend=backend, ffill_limit=limit)
+            ex = expected[df.columns].reset_index().sort_values(['date', 'symbol'])
+            pd.testing.assert_frame_equal(df.reset_index(), ex.reset_index(drop=True), check_dtype=False)
+    assert 'panel' not in fallback  # 停牌日在映射的数组上填充，不退回长表展开
+
+
+def test_store_is_float64_under_float32_policy(tmp_path):
+    df = make_gapped_df()
+    with dtypes.float_dtype('float32'):
+        store = PanelStore.write(df, tmp_path)
+        assert store.array('close').dtype == np.float64
+        se = store.calc_exprs(['ts_mean(close, 5)'])[0]
+        assert se.dtype == np.float32
+        np.testing.assert_allclose(se.values, calc_exprs(df, ['ts_mean(close, 5)'], backend='panel')[0].values,
+                                   rtol=1e-5)
+
+
+def test_store_evaluates_on_mapped_arrays(tmp_path):
+    df = make_gapped_df()
+    store = PanelStore.write(df, tmp_path)
+    exprs = ['ts_mean(close, 5)', 'rank(ts_delta(close, 3))', 'close']
+    arrays = store.arrays(['close'])
+    assert np.shares_memory(arrays['close'], store.array('close'))  # 全部标的取出的是映射上的视图
+    for se, ex in zip(store.calc_exprs(exprs), calc_exprs(df, exprs, backend='panel')):
+        pd.testing.assert_series_equal(se, ex, check_names=False)
+    sub = df.loc['2020-02-03':'2020-03-31']
+    sub = sub[sub.index.get_level_values(1).isin(['s1', 's3'])]
+    got = store.calc_exprs(exprs[:2], start_date='20200203', end_date='20200331', symbols=['s3', 's1'])
+    for se, ex in zip(got, calc_exprs(sub, exprs[:2])):
+        pd.testing.assert_series_equal(se, ex, check_names=False)
+
+
+def test_csv_loader_threads_and_stats(tmp_path):
+    symbols = write_quotes(tmp_path)
+    # 日期写成 YYYY-MM-DD 的文件走推断解析，行序打乱的文件需要排序
+    df = pd.read_csv(tmp_path / (symbols[0] + '.csv'))
+    df['date'] = pd.to_datetime(df['date'].astype(str)).dt.strftime('%Y-%m-%d')
+    df.sample(frac=1, random_state=0).to_csv(tmp_path / (symbols[0] + '.csv'), index=False)
+    serial = CSVDataloader(tmp_path, symbols, start_date='20200301', n_jobs=1)
+    threaded = CSVDataloader(tmp_path, symbols, start_date='20200301', n_jobs=3)
+    expected = serial.load()
+    pd.testing.assert_frame_equal(threaded.load(), expected)
+    assert expected.index.is_monotonic_increasing and expected.index.min() >= pd.Timestamp('20200301')
+    assert list(threaded.stats['symbol']) == symbols
+    assert (threaded.stats['rows'] == expected.groupby('symbol').size()[symbols].values).all()
+
+
+def test_align_calendar():
+    df = make_gapped_df(60, 4).reset_index('symbol')
+    df = df[~((df['symbol'] == 's2') & (df.index < df.index[40]))]  # s2 晚上市
+    for limit in [None, 2]:
+        aligned, valid = align_calendar(df, limit)
+        assert aligned.index.is_monotonic_increasing and valid.sum() == len(df)
+        expected = []
+        for symbol, sub in df.groupby('symbol'):
+            calendar = df.index.unique().sort_values()
+            sub = sub.reindex(calendar[calendar >= sub.index[0]], method='ffill', limit=limit).dropna(subset=['symbol'])
+            expected.append(sub)
+        expected = pd.concat(expected).reset_index().sort_values(['date', 'symbol'], kind='stable')
+        pd.testing.assert_frame_equal(aligned.reset_index(), expected.reset_index(drop=True))
+
+
+def test_csv_loader_float32(tmp_path):
+    from kkexpr.dtypes import float_dtype
+    symbols = write_quotes(tmp_path)
+    fields, names = ['ts_mean(close, 5) / open', 'rank(volume)'], ['a', 'b']
+    expected = CSVDataloader(tmp_path, symbols[:2]).load(fields, names)
+    for backend in ['pandas', 'panel']:
+        with float_dtype('float32'):
+            df = CSVDataloader(tmp_path, symbols[:2]).load(fields, names, backend=backend)
+        assert isinstance(df['symbol'].dtype, pd.CategoricalDtype)
+        assert (df[['open', 'close', 'volume']].dtypes == np.float32).all()
+        np.testing.assert_allclose(df[names].values.astype(float), expected[names].values, rtol=1e-5)
+
+
+def test_loader_fetches_lookback_and_horizon(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    symbols = write_quotes(tmp_path)
+    csv_to_parquet(tmp_path, tmp_path / 'parquet')
+    fields, names = ['ts_mean(ts_mean(close, 10), 10)', 'shift(close, -5) / close - 1'], ['ma', 'label']
+    full = CSVDataloader(tmp_path, symbols, start_date='20000101').load(fields, names)
+    ranges = []
+    load_df = ParquetDataloader._load_df
+    monkeypatch.setattr(ParquetDataloader, '_load_df', lambda self, *a: ranges.append(a[1:]) or load_df(self, *a))
+    for loader in [CSVDataloader(tmp_path, symbols, '20200301', '20200831'),
+                   ParquetDataloader(tmp_path / 'parquet', symbols, '20200301', '20200831')]:
+        df = loader.load(fields, names)
+        expected = full.loc['20200301':'20200831']
+        assert not df[names].isna().any().any()  # 第一行的均线、最后几行的标签都完整
+        pd.testing.assert_frame_equal(df.reset_index()[['date', 'symbol'] + names],
+                                      expected.reset_index()[['date', 'symbol'] + names], check_dtype=False)
+    assert ranges[0][0] > pd.Timestamp('20200101')  # 只多读了需要的历史
+    ranges.clear()
+    last = full.index.max().strftime('%Y%m%d')
+    df = ParquetDataloader(tmp_path / 'parquet', symbols, '20200301', last).load(fields, names)
+    assert df.index.max() == full.index.max() and len(ranges) == 2  # 数据到头后只多试一次
+
+
+def test_factor_execute_widens_short_history(monkeypatch):
+    from kkexpr import wrapper
+    df = make_df(200)
+    dates = df.index.get_level_values('date')
+    df = df[(dates < '20200420') | (dates > '20200520')]  # 一个月没有行情，按自然日估计的回看不够
+    calls = []
+
+    def get_price(order_book_ids, frequency, start_date, end_date):
+        calls.append(start_date)
+        dates = df.index.get_level_values('date')
+        return df[(dates >= pd.Timestamp(start_date)) & (dates <= pd.Timestamp(end_date))]
+
+    monkeypatch.setattr(wrapper, 'get_price', get_price)
+    se = wrapper.Factor('ts_mean(close, 20)').execute(None, '1d', '20200601', '20200630')
+    expected = calc_exprs(df, ['ts_mean(close, 20)'])[0].loc['20200601':'20200630']
+    assert len(calls) == 2 and not se.isna().any()
+    np.testing.assert_allclose(se.values, expected.values)
+
+
+def test_iter_blocks_matches_load(tmp_path):
+    symbols = write_quotes(tmp_path)
+    sub = pd.read_csv(tmp_path / (symbols[1] + '.csv'))
+    sub.drop(index=range(100, 103)).to_csv(tmp_path / (symbols[1] + '.csv'), index=False)  # 跨块边界的停牌
+    fields = ['ts_mean(ts_std(close, 10), 5)', 'rank(shift(close, -3) / close)', 'm - 1']
+    names = ['m', 'label', 'n']
+    loader = CSVDataloader(tmp_path, symbols, '20200215', '20201130')
+    expected = loader.load(fields, names, ffill_limit=5)
+    blocks = list(loader.iter_blocks(fields, names, block_days=40, ffill_limit=5))
+    assert len(blocks) > 5
+    pd.testing.assert_frame_equal(pd.concat(blocks), expected)
+    written = []
+    assert loader.load_chunked(fields, names, written.append, block_days=90, ffill_limit=5) == len(expected)
+    pd.testing.assert_frame_equal(pd.concat(written), expected)
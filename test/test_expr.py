@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+from kkexpr.expr import calc_expr, calc_exprs, compile_expr, required_history
+
+
+def make_df(n_dates=60, symbols=('000001.SZ', '600000.SH', '510300.SH'), seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-01-01', periods=n_dates, freq='B')
+    index = pd.MultiIndex.from_product([dates, list(symbols)], names=['date', 'symbol'])
+    close = 10 + rng.standard_normal(len(index)).cumsum() * 0.1
+    df = pd.DataFrame({
+        'open': close + rng.standard_normal(len(index)) * 0.05,
+        'close': close,
+        'volume': rng.integers(1000, 5000, len(index)).astype(float),
+    }, index=index)
+    df['open_interest'] = df['open'] * 100
+    return df
+
+
+def test_compile_expr_cached():
+    plan = compile_expr('ts_mean(close, 5)/close - 1')
+    assert compile_expr('ts_mean(close, 5)/close - 1') is plan
+    assert plan.columns == {'close'}
+
+
+def test_prefix_columns():
+    df = make_df()
+    se = calc_expr(df, 'open_interest - open')
+    np.testing.assert_allclose(se.values, (df['open_interest'] - df['open']).values)
+
+
+def test_calc_expr_matches_operators():
+    df = make_df()
+    se = calc_expr(df, '(close - ts_mean(close, 5)) / close')
+    from kkexpr.expr_functions import ts_mean
+    expected = (df['close'] - ts_mean(df['close'], 5)) / df['close']
+    pd.testing.assert_series_equal(se, expected, check_names=False)
+
+
+def test_common_subexpressions_shared():
+    a = compile_expr('(close - ts_min(close, 5)) / (ts_max(close, 5) - ts_min(close, 5))')
+    b = compile_expr('ts_min(close,5) + close')
+    assert b.root.children[1] is a.root.children[1].children[1]
+    assert compile_expr('close + open').root is compile_expr('open+close').root
+
+
+def test_calc_exprs_matches_calc_expr():
+    df = make_df()
+    exprs = ['ts_max(close, 5)/close', '(close - ts_max(close, 5))/close', 'ts_max(close, 5)/close', 'roc*2']
+    names = ['a', 'b', 'c', 'd']
+    df['roc'] = calc_expr(df, 'close/shift(close, 1) - 1')
+    results = calc_exprs(df, exprs, names)
+    for expr, se in zip(exprs, results):
+        pd.testing.assert_series_equal(se, calc_expr(df, expr), check_names=False)
+
+
+def test_calc_exprs_parallel_matches_serial():
+    from kkexpr.parallel import calc_exprs_parallel
+    df = make_df()
+    exprs = ['ts_mean(close, 5)', 'ts_max(close, 5)/close', 'rank(volume)', 'a - b']
+    names = ['a', 'b', 'c', 'd']
+    results = calc_exprs_parallel(df, exprs, names, n_jobs=2, chunksize=1)
+    for expected, se in zip(calc_exprs(df, exprs, names), results):
+        np.testing.assert_allclose(se.values, expected.values)
+
+
+def test_subexpr_memo_across_calls():
+    from kkexpr.memo import SubexprMemo
+    df = make_df()
+    memo = SubexprMemo()
+    first = calc_expr(df, 'ts_mean(close, 5) / ts_max(close, 10)', memo=memo)
+    assert memo.stats()['hits'] == 0
+    second = calc_expr(df, 'ts_max(close, 10) - ts_mean(close, 5)', memo=memo)
+    assert memo.stats()['hits'] == 2
+    pd.testing.assert_series_equal(second, calc_expr(df, 'ts_max(close, 10) - ts_mean(close, 5)'))
+    calc_expr(df.copy(), 'ts_mean(close, 5)', memo=memo)  # 不同的数据不共用
+    assert memo.stats()['hits'] == 2
+
+    small = SubexprMemo(max_bytes=first.nbytes * 2)
+    for d in range(2, 6):
+        calc_expr(df, 'ts_mean(close, {})'.format(d), memo=small)
+    assert small.stats()['evictions'] == 2 and small.nbytes <= small.max_bytes
+
+
+def test_memo_hit_releases_children():
+    from kkexpr.expr import EvalContext, _count_refs
+    from kkexpr.memo import SubexprMemo
+    df = make_df()
+    # 命中的节点不再读取子节点；子节点若因此不会再被计算，孙节点的引用也要扣掉
+    for first, second in [('ts_mean(close, 5) * 2', 'ts_std(ts_mean(close, 5), 3)'),
+                          ('ts_std(ts_mean(close, 5), 3) * 2', 'ts_mean(close, 5) + 1')]:
+        memo = SubexprMemo()
+        calc_expr(df, first, memo=memo)
+        roots = [compile_expr(expr).root for expr in [first, second]]
+        ctx = EvalContext(df, _count_refs(roots), memo)
+        values = [ctx.evaluate_root(root) for root in roots]
+        assert ctx.cache == {}
+        pd.testing.assert_series_equal(values[1], calc_expr(df, second))
+
+
+def test_subexpr_memo_keyed_by_float_dtype():
+    from kkexpr import dtypes
+    from kkexpr.memo import SubexprMemo
+    df = make_df()
+    memo = SubexprMemo()
+    assert calc_expr(df, 'ts_mean(close, 5) * 2', backend='panel', memo=memo).dtype == np.float64
+    with dtypes.float_dtype('float32'):
+        se = calc_expr(df, 'ts_mean(close, 5) * 2', backend='panel', memo=memo)
+        assert se.dtype == np.float32
+        pd.testing.assert_series_equal(se, calc_expr(df, 'ts_mean(close, 5) * 2', backend='panel'))
+    assert memo.stats()['hits'] == 0
+
+
+def test_lookback_analysis():
+    assert (compile_expr('close / open').lookback, compile_expr('close / open').horizon) == (0, 0)
+    assert compile_expr('ts_mean(ts_std(close, 10), 5)').lookback == 13  # 嵌套的窗口相加
+    assert compile_expr('rank(ts_corr(close, volume, 20)) - ts_delay(close)').lookback == 19
+    plan = compile_expr('ts_mean(shift(close, -5), 10) / close')
+    assert (plan.lookback, plan.horizon) == (9, 5)
+    assert required_history(['ts_mean(close, 5)', 'ts_delta(a, 10)', 'shift(close, -2)'], ['a', 'b', 'c']) == (14, 2)
+    assert compile_expr('decay_linear(close, 10)').lookback == 9
+    assert compile_expr('scale(ts_mean(close, 5), 3)').lookback == 4  # scale 的 a 不是窗口
@@ -0,0 +1,256 @@
+import numpy as np
+import pytest
+
+from kkexpr.expr import calc_expr
+from test_expr import make_df
+
+
+def make_gapped_df(n_dates=120, n_symbols=8, seed=1):
+    # 随机删掉一些行，模拟停牌造成的缺口
+    df = make_df(n_dates, symbols=['s{}'.format(i) for i in range(n_symbols)], seed=seed)
+    rng = np.random.default_rng(seed)
+    return df[rng.random(len(df)) > 0.05]
+
+
+def by_symbol(df, col, func):
+    return df.groupby(level=1)[col].transform(func)
+
+
+CASES = [
+    ('ts_mean(close, 5)', 'close', lambda s: s.rolling(5).mean()),
+    ('ts_std(close, 7)', 'close', lambda s: s.rolling(7).std()),
+    ('ts_sum(volume, 10)', 'volume', lambda s: s.rolling(10).sum()),
+    ('ts_delay(close, 3)', 'close', lambda s: s.shift(3)),
+    ('ts_delta(close, -2)', 'close', lambda s: s - s.shift(-2)),
+]
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'panel'])
+@pytest.mark.parametrize('expr,col,func', CASES)
+def test_ts_ops_match_groupby(expr, col, func, backend):
+    df = make_gapped_df()
+    se = calc_expr(df, expr, backend=backend)
+    assert se.index.equals(df.index)
+    np.testing.assert_allclose(se.values, by_symbol(df, col, func).values, rtol=1e-9, atol=1e-12)
+
+
+def test_panel_backend_falls_back_to_series_ops():
+    df = make_gapped_df()
+    expr = 'ts_mean(close, 5) / ts_std(close, 10) + sign(close - open)'
+    np.testing.assert_allclose(calc_expr(df, expr, backend='panel').values, calc_expr(df, expr).values)
+    # 没有任何包装的算子同样按序列调用
+    expr = 'decay_linear(close, 10)'
+    np.testing.assert_allclose(np.asarray(calc_expr(df, expr, backend='panel')), np.asarray(calc_expr(df, expr)))
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'panel'])
+def test_skew_kurt_match_rolling(backend):
+    df = make_gapped_df(200, 6)
+    df.loc[df.index[60:100], 'volume'] = 7.0  # 整个窗口都相同的值
+    for col in ['close', 'volume']:
+        for expr, func in [('ts_skew({}, 7)', lambda s: s.rolling(7).skew()),
+                           ('ts_kurt({}, 8)', lambda s: s.rolling(8).kurt())]:
+            se = calc_expr(df, expr.format(col), backend=backend)
+            np.testing.assert_allclose(se.values, by_symbol(df, col, func).values, rtol=1e-6, atol=1e-6)
+
+
+def test_rank_matches_pandas_with_ties_and_nan():
+    df = make_gapped_df()
+    close = df['close'].round(1)  # 制造并列
+    close.iloc[::7] = np.nan
+    from kkexpr.expr_functions import rank
+    expected = close.groupby(level=0).rank(pct=True)
+    np.testing.assert_allclose(rank(close).values, expected.values)
+
+
+EXTREMA_CASES = [
+    ('ts_max(close, 5)', lambda s: s.rolling(5).max()),
+    ('ts_min(close, 6)', lambda s: s.rolling(6).min()),
+    ('ts_argmax(close, 5)', lambda s: s.rolling(5, min_periods=1).apply(lambda x: x.argmax())),
+    ('ts_argmin(close, 7)', lambda s: s.rolling(7, min_periods=1).apply(lambda x: x.argmin())),
+    ('ts_maxmin(close, 5)', lambda s: (s - s.rolling(5).min()) / (s.rolling(5).max() - s.rolling(5).min())),
+    ('ts_argmaxmin(close, 4)', lambda s: s.rolling(4, min_periods=1).apply(lambda x: x.argmax() - x.argmin())),
+]
+
+
+@pytest.mark.parametrize('expr,func', EXTREMA_CASES)
+def test_extrema_match_rolling(expr, func):
+    df = make_gapped_df()
+    df['close'] = df['close'].round(1)  # 制造并列，检查取最早位置
+    df.iloc[::11, df.columns.get_loc('close')] = np.nan
+    se = calc_expr(df, expr)
+    np.testing.assert_allclose(se.values, by_symbol(df, 'close', func).values)
+
+
+def test_zscore_closed_form():
+    df = make_gapped_df()
+    df.iloc[::13, df.columns.get_loc('close')] = np.nan
+    df.iloc[:8, df.columns.get_loc('close')] = 1.0  # 常数窗口
+    expected = by_symbol(df, 'close', lambda s: (s - s.rolling(5).mean()) / s.rolling(5).std())
+    expected[np.isinf(expected)] = np.nan
+    se = calc_expr(df, 'zscore(close, 5)')
+    np.testing.assert_allclose(se.values, expected.values, rtol=1e-9)
+
+
+def test_rolling_ols_matches_polyfit():
+    rng = np.random.default_rng(3)
+    y = rng.standard_normal(40).cumsum()
+    x = rng.standard_normal(40)
+    from kkexpr import kernels
+    slope, intercept, rsquare, resid = kernels.rolling_ols(y, x, 10)
+    t_slope, t_intercept, _, t_resid = kernels.rolling_ols(y, window=10)
+    for i in range(9, 40):
+        b, a = np.polyfit(x[i - 9:i + 1], y[i - 9:i + 1], 1)
+        np.testing.assert_allclose([slope[i], intercept[i]], [b, a])
+        np.testing.assert_allclose(rsquare[i], np.corrcoef(x[i - 9:i + 1], y[i - 9:i + 1])[0, 1] ** 2)
+        np.testing.assert_allclose(resid[i], y[i] - a - b * x[i], atol=1e-12)
+        b, a = np.polyfit(np.arange(10), y[i - 9:i + 1], 1)
+        np.testing.assert_allclose([t_slope[i], t_intercept[i], t_resid[i]], [b, a, y[i] - a - 9 * b], atol=1e-12)
+    assert np.isnan(slope[:9]).all()
+
+
+ORDER_STAT_CASES = [
+    ('ts_rank(close, 6)', lambda s: s.rolling(6).rank(pct=True)),
+    ('ts_median(close, 5)', lambda s: s.rolling(5).median()),
+    ('ts_quantile(close, 7, 0.8)', lambda s: s.rolling(7).quantile(0.8)),
+]
+
+
+@pytest.mark.parametrize('expr,func', ORDER_STAT_CASES)
+def test_order_statistics_match_rolling(expr, func):
+    df = make_gapped_df()
+    df['close'] = df['close'].round(1)
+    se = calc_expr(df, expr)
+    np.testing.assert_allclose(se.values, by_symbol(df, 'close', func).values)
+
+
+def _old_corr(df):
+    def corr(sub):
+        left, right = sub['close'], sub['volume']
+        res = left.rolling(10).corr(right)
+        res.loc[np.isclose(left.rolling(10, min_periods=1).std(), 0, atol=2e-05)
+                | np.isclose(right.rolling(10, min_periods=1).std(), 0, atol=2e-05)] = np.nan
+        return res
+    return df.groupby(level=1, group_keys=False).apply(corr).reindex(df.index)
+
+
+def test_corr_cov_match_rolling():
+    df = make_gapped_df()
+    dates = df.index.get_level_values(0)
+    df.loc[(df.index.get_level_values(1) == 's0') & (dates < dates[200]), 'close'] = 10.0  # 常数窗口
+    np.testing.assert_allclose(calc_expr(df, 'ts_corr(close, volume, 10)').values, _old_corr(df).values,
+                               rtol=1e-7, atol=1e-10)
+    expected = df.groupby(level=1, group_keys=False).apply(
+        lambda sub: sub['close'].rolling(10).cov(sub['volume'])).reindex(df.index)
+    np.testing.assert_allclose(calc_expr(df, 'ts_cov(close, volume, 10)').values, expected.values, rtol=1e-7, atol=1e-10)
+
+
+def test_numba_kernels_match_numpy():
+    from kkexpr import kernels
+    if kernels.BACKEND != 'numba':
+        pytest.skip('numba 未安装')
+    rng = np.random.default_rng(5)
+    x = rng.standard_normal((80, 6)).round(1)
+    y = rng.standard_normal((80, 6))
+    x[rng.random(x.shape) < 0.05] = np.nan
+    calls = {
+        'rolling_sum': (x, 5), 'rolling_mean': (x, 5), 'rolling_var': (x, 5), 'rolling_std': (x, 5),
+        'rolling_skew': (y, 5), 'rolling_kurt': (y, 6),
+        'rolling_zscore': (x, 6), 'rolling_corr_cov': (x, y, 7), 'rolling_ols': (y, x, 7),
+        'rolling_max': (x, 5), 'rolling_min': (x, 5), 'rolling_max_min': (x, 5),
+        'rolling_argmax': (x, 5), 'rolling_argmin': (x, 5), 'rolling_argmax_argmin': (x, 5),
+        'rolling_rank': (x, 6), 'rolling_quantile': (x, 6, 0.8), 'rolling_median': (x, 5),
+    }
+    for name, args in calls.items():
+        expected = kernels.numpy_kernels[name](*args)
+        actual = getattr(kernels, name)(*args)
+        if not isinstance(expected, tuple):
+            expected, actual = (expected,), (actual,)
+        for e, a in zip(expected, actual):
+            np.testing.assert_allclose(a, e, rtol=1e-9, atol=1e-12, err_msg=name)
+    slope = kernels.rolling_ols(y, window=7)
+    for e, a in zip(kernels.numpy_kernels['rolling_ols'](y, window=7), slope):
+        np.testing.assert_allclose(a, e, rtol=1e-9, atol=1e-12)
+    long = rng.standard_normal((3000, 3)).round(2)  # 长窗口，含并列、缺失和 float32 输入
+    long[1000:1010, 1] = np.nan
+    for z in [long, long.astype(np.float32)]:
+        for name, args in {'rolling_rank': (z, 300), 'rolling_quantile': (z, 300, 0.3),
+                           'rolling_median': (z, 250)}.items():
+            np.testing.assert_allclose(getattr(kernels, name)(*args), kernels.numpy_kernels[name](*args),
+                                       rtol=1e-9, atol=1e-12, err_msg=name)
+
+
+def test_long_trending_series_precision():
+    from numpy.lib.stride_tricks import sliding_window_view
+    from kkexpr import kernels
+    rng = np.random.default_rng(7)
+    n, w = 300_000, 10
+    x = 100 + 0.01 * np.arange(n) + rng.standard_normal(n).cumsum()
+    y = 50 + 0.02 * np.arange(n) + rng.standard_normal(n)
+    xc = sliding_window_view(x, w) - sliding_window_view(x, w).mean(axis=1, keepdims=True)
+    yc = sliding_window_view(y, w) - sliding_window_view(y, w).mean(axis=1, keepdims=True)
+    corr = (xc * yc).sum(axis=1) / np.sqrt((xc * xc).sum(axis=1) * (yc * yc).sum(axis=1))
+    std = np.sqrt((xc * xc).sum(axis=1) / (w - 1))
+    skew = np.sqrt(w * (w - 1)) / (w - 2) * (xc ** 3).mean(axis=1) / (xc * xc).mean(axis=1) ** 1.5
+    impls = [kernels.__dict__] + ([kernels.numpy_kernels] if kernels.BACKEND == 'numba' else [])
+    for impl in impls:
+        np.testing.assert_allclose(impl['rolling_corr_cov'](x, y, w)[0][w - 1:], corr, rtol=0, atol=1e-8)
+        np.testing.assert_allclose(impl['rolling_std'](x, w)[w - 1:], std, rtol=1e-8)
+        np.testing.assert_allclose(impl['rolling_skew'](x, w)[w - 1:], skew, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'panel'])
+def test_empty_frame(backend):
+    from kkexpr.expr import calc_exprs
+    df = make_gapped_df().iloc[:0]
+    exprs = ['ts_mean(close, 5)', 'ts_std(close, 5)', 'ts_max(close, 5)', 'ts_argmin(close, 5)',
+             'ts_rank(close, 5)', 'ts_quantile(close, 5, 0.8)', 'ts_corr(close, volume, 5)', 'ts_slope(close, 5)',
+             'zscore(close, 5)']
+    for se in calc_exprs(df, exprs, backend=backend):
+        assert len(se) == 0
+
+
+def test_symbol_sharded_matches_serial():
+    from kkexpr.expr import calc_exprs
+    from kkexpr.parallel import calc_exprs_sharded
+    df = make_gapped_df()
+    exprs = ['ts_mean(ts_delta(close, 2), 5)', 'rank(ts_std(close, 5)) * ts_mean(volume, 3)',
+             'ts_corr(rank(close), rank(volume), 6)', 'rank(rank(close) - open)', 'close', 'a + b',
+             'scale(abs(close - open)) * 100', 'ts_delta(close, 2) - scale(volume, 3)']
+    names = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']  # scale 对整个数组求和，分片各算一次会得到不同的结果
+    for backend in ['pandas', 'panel']:
+        results = calc_exprs_sharded(df, exprs, names, n_jobs=2, n_shards=3, backend=backend)
+        for expected, se in zip(calc_exprs(df, exprs, names), results):
+            assert se.index.equals(df.index)
+            np.testing.assert_allclose(se.values, np.asarray(expected), rtol=1e-9, atol=1e-12)
+
+
+def test_float32_policy():
+    from kkexpr.dtypes import float_dtype
+    from kkexpr.expr import calc_exprs
+    df = make_gapped_df(200, 10)
+    df['close'] += 1e4  # 大的偏移下窗口和仍然准确：内核里的累加量是 float64
+    exprs = ['ts_mean(close, 5)', 'ts_sum(volume, 10)', 'ts_std(close, 7)', 'rank(ts_mean(volume, 10))',
+             'ts_max(close, 5) - ts_min(open, 7)', 'ts_corr(close, volume, 10)']
+    expected = calc_exprs(df, exprs, backend='panel')
+    with float_dtype('float32'):
+        results = calc_exprs(df.astype('float32'), exprs, backend='panel')
+    for se, ex in zip(results, expected):
+        assert se.dtype == np.float32
+        np.testing.assert_allclose(se.values, ex.values, rtol=1e-3, atol=1e-3)
+
+
+def test_float32_policy_in_workers():
+    from kkexpr.dtypes import float_dtype
+    from kkexpr.expr import calc_exprs
+    from kkexpr.parallel import calc_exprs_parallel, calc_exprs_sharded
+    df = make_gapped_df()
+    exprs = ['ts_mean(close, 5)', 'rank(ts_std(close, 5)) * ts_mean(volume, 3)']
+    names = ['a', 'b']
+    with float_dtype('float32'):  # 子进程沿用主进程的精度策略
+        expected = calc_exprs(df, exprs, names, backend='panel')
+        for results in [calc_exprs_parallel(df, exprs, names, n_jobs=2, backend='panel'),
+                        calc_exprs_sharded(df, exprs, names, n_jobs=2, backend='panel')]:
+            for se, ex in zip(results, expected):
+                assert ex.dtype == np.float32 and se.dtype == np.float32
+                np.testing.assert_allclose(se.values, ex.values, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from kkexpr.dataloader import CSVDataloader
+from kkexpr.sink import FeatherSink, NpySink, ParquetSink
+from test_dataloader import write_quotes
+
+FIELDS = ['ts_mean(close, 5) / open', 'rank(volume)', 'a - b']
+NAMES = ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('sink_cls', [NpySink, ParquetSink, FeatherSink])
+def test_sink_matches_load(tmp_path, sink_cls):
+    if sink_cls is not NpySink:
+        pytest.importorskip('pyarrow')
+    symbols = write_quotes(tmp_path)
+    loader = CSVDataloader(tmp_path, symbols, '20200301', '20201231')
+    expected = loader.load(FIELDS, NAMES)[['symbol'] + NAMES]
+
+    sink = sink_cls(tmp_path / 'out')
+    assert loader.load(FIELDS, NAMES, sink=sink) == len(expected)
+    df = sink_cls.read(tmp_path / 'out')
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False, check_index_type=False)
+
+    # 分块计算每块写一段，读回来与整段一致；同一目录已有结果时要明确 overwrite=True 才覆盖
+    with pytest.raises(FileExistsError):
+        sink_cls(tmp_path / 'out')
+    assert len(sink_cls.read(tmp_path / 'out')) == len(expected)
+    sink = sink_cls(tmp_path / 'out', overwrite=True)
+    assert loader.load_chunked(FIELDS, NAMES, sink, block_days=60) == len(expected)
+    assert sink.part > 3
+    df = sink_cls.read(tmp_path / 'out', ['c'])
+    np.testing.assert_allclose(df['c'].values, expected['c'].values)
+
+    df = loader.load(FIELDS, NAMES, sink=sink_cls(tmp_path / 'out', overwrite=True), return_df=True)
+    pd.testing.assert_frame_equal(df[['symbol'] + NAMES], expected, check_dtype=False)
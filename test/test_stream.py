@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from kkexpr.expr import calc_exprs
+from kkexpr.stream import StreamEngine
+from test_panel import make_gapped_df
+
+TS_EXPRS = [
+    'ts_mean(close, 5)', 'ts_sum(volume, 10)', 'ts_std(close, 7)', 'zscore(close, 6)', 'zscore(close, 8, 4)',
+    'ts_delay(close, 3)', 'ts_delta(close, 2)', 'ts_pct_change(close, 4)', 'roc(close, 1)',
+    'ts_corr(close, volume, 10)', 'ts_cov(close, volume, 6)', 'slope_pair(close, volume, 8)',
+    'ts_max(close, 5)', 'ts_min(close, 6)', 'ts_maxmin(close, 5)',
+    'ts_argmax(close, 5)', 'ts_argmin(close, 7)', 'ts_argmaxmin(close, 4)',
+    'ts_rank(close, 6)', 'ts_median(close, 5)', 'ts_quantile(close, 7, 0.8)', 'ts_skew(close, 5)', 'ts_kurt(close, 6)',
+    'ts_slope(close, 6)', 'ts_rsquare(close, 6)', 'ts_resi(close, 6)',
+]
+
+MIXED_EXPRS = ['rank(close)', 'ts_mean(rank(volume), 4) - rank(ts_std(close, 5))',
+               'greater(close, open) / abs(log(volume))', 'sign(open - close) * inv(close - open)', 'f0 * 2']
+
+
+def assert_stream_matches(df, exprs, names, rtol=1e-7):
+    batch = calc_exprs(df, exprs, names)
+    stream = StreamEngine(exprs, names, df.index.levels[1]).replay(df)
+    for name, expected in zip(names, batch):
+        np.testing.assert_allclose(stream[name].values, np.asarray(expected, dtype=float), rtol=rtol, atol=1e-9,
+                                   err_msg=name)
+
+
+def test_stream_matches_batch_time_series_ops():
+    df = make_gapped_df(150, 10)
+    df['close'] = df['close'].round(1)  # 并列与常数窗口
+    df.iloc[::17, df.columns.get_loc('volume')] = np.nan
+    # pandas 的滚动偏度、峰度用在线累加，本身只有 1e-7 左右的精度
+    assert_stream_matches(df, TS_EXPRS, TS_EXPRS, rtol=1e-5)
+
+
+def test_stream_long_windows_match_batch():
+    # 窗口比标的多得多时单调队列要反复出队，滚动幂和要跨越多次重算
+    df = make_gapped_df(400, 4)
+    df['close'] = df['close'].round(0)
+    df.iloc[50:70, df.columns.get_loc('close')] = np.nan
+    exprs = ['ts_max(close, 40)', 'ts_min(close, 33)', 'ts_maxmin(close, 25)', 'ts_argmax(close, 40)',
+             'ts_argmin(close, 33)', 'ts_argmaxmin(close, 25)', 'ts_skew(close, 30)', 'ts_kurt(close, 30)',
+             'ts_slope(close, 35)', 'ts_rsquare(close, 35)', 'ts_resi(close, 35)']
+    assert_stream_matches(df, exprs, exprs, rtol=1e-5)
+
+
+def test_stream_matches_batch_cross_section_and_names():
+    df = make_gapped_df(100, 10)
+    df.iloc[::13, df.columns.get_loc('volume')] = np.nan
+    assert_stream_matches(df, ['ts_mean(close, 5)'] + MIXED_EXPRS, ['f0'] + MIXED_EXPRS)
+
+
+def test_stream_resumes_after_history():
+    df = make_gapped_df(60, 6)
+    dates = df.index.levels[0]
+    exprs = ['ts_corr(close, volume, 10)', 'rank(ts_max(close, 5))']
+    engine = StreamEngine.from_history(exprs, exprs, df[df.index.get_level_values(0) < dates[-1]])
+    last = engine.update(df.loc[dates[-1]])
+    expected = calc_exprs(df, exprs)
+    for expr, se in zip(exprs, expected):
+        np.testing.assert_allclose(last[expr].values, se.loc[dates[-1]].values)
+
+
+def test_stream_rejects_future_data_and_unsupported_ops():
+    with pytest.raises(ValueError):
+        StreamEngine(['ts_delay(close, -1)'], symbols=['a'])
+    with pytest.raises(ValueError, match='cross_up'):
+        StreamEngine(['cross_up(close, open)'], symbols=['a'])
+
+
+def test_stream_snapshot_roundtrip(tmp_path):
+    df = make_gapped_df(80, 6)
+    dates = df.index.levels[0]
+    head = df[df.index.get_level_values(0) < dates[60]]
+    exprs = ['ts_corr(close, volume, 10)', 'zscore(close, 8)', 'ts_rank(ts_delta(close, 2), 6)',
+             'ts_argmax(close, 7)', 'ts_kurt(close, 9)']
+    engine = StreamEngine.from_history(exprs, exprs, head)
+    path = tmp_path / 'state.npz'
+    engine.save(path)
+    restored = StreamEngine.load(path, exprs, exprs, engine.symbols)
+    assert restored.last_date == dates[59]
+    for date in dates[60:]:
+        bar = df.loc[date]
+        np.testing.assert_array_equal(restored.update(bar).values, engine.update(bar).values)
+
+    with pytest.raises(ValueError):
+        StreamEngine.load(path, exprs[:2] + ['ts_rank(ts_delta(close, 2), 7)'] + exprs[3:], None, engine.symbols)
+    with pytest.raises(ValueError):
+        StreamEngine.load(path, exprs, exprs, engine.symbols[:-1])